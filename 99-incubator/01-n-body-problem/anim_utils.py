@@ -1,6 +1,12 @@
+import io
 import PIL
 import numpy as np
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from multiprocessing import shared_memory
+from typing import Callable, Iterator
+from polyline import simplify_polyline
 import matplotlib.pyplot as plt
 import matplotlib.ticker as ticker
 import imageio.v2 as iio
@@ -11,6 +17,9 @@ FIGURES_DIR.mkdir(parents=True, exist_ok=True)
 FRAMES_DIR = FIGURES_DIR / "frames"
 FRAMES_DIR.mkdir(parents=True, exist_ok=True)
 
+# Resolution of the frames: 10 inch figures are 1500 x 1500 pixels
+FRAME_DPI = 150
+
 
 def draw_frames(
     positions: np.ndarray,
@@ -22,10 +31,158 @@ def draw_frames(
     view_limit: float = 2.0,
     target_body_index: int | None = None,
     visual_scale: float = 1.0,
-    hide_grid: bool = False
+    hide_grid: bool = False,
+    num_workers: int = 1,
+    incremental: bool = False,
+    trail_length: int | None = None,
+    simplify: bool = False
 ) -> None:
+    """Draw the animation frames as PNG files in FRAMES_DIR, for
+    create_gif / create_mp4.
+
+    Args:
+        positions (np.ndarray): Positions at each frame, shape
+            (num_frames, N, 3), e.g. from frame_scheduler.schedule_frames.
+        labels (list): Name of each body, shown in the legend.
+        colors (list): Matplotlib color of each body.
+        legend (bool): Whether to show the legend.
+        num_frames (int): Number of frames to draw.
+        masses (np.ndarray | None): Masses of the bodies. Stars
+            (m > 0.01) are drawn larger than planets. Same size for all
+            if None.
+        view_limit (float): Half width of the view in AU.
+        target_body_index (int | None): Body the camera follows. The
+            view is fixed around the origin if None.
+        visual_scale (float): Factor on the size of the bodies.
+        hide_grid (bool): Hide the grid, axes and ticks.
+        num_workers (int): Number of processes drawing the frames,
+            sharing the positions. One draws them here, in order.
+        incremental (bool): Build the figure once and move its artists
+            each frame (FrameRenderer) instead of redrawing everything,
+            which is several times faster.
+        trail_length (int | None): Keep only the last trail_length
+            snapshots of each trajectory line. The whole trajectory if
+            None.
+        simplify (bool): Draw the lines through the fewest snapshots
+            that stay within one pixel of them (see polyline.py).
+    """
     print("Drawing frames...")
+    style = _frame_style(
+        labels, colors, legend, masses, view_limit, target_body_index,
+        visual_scale, hide_grid, incremental, trail_length, simplify)
+
+    if num_workers > 1:
+        _draw_frames_parallel(positions, num_frames, style, num_workers)
+    else:
+        fig, draw = _frame_painter(positions, style)
+        for n in range(num_frames):
+            print(f"Progress: {n + 1} / {num_frames}", end="\r")
+            draw(n)
+            _save_frame(fig, n)
+        plt.close(fig)
+    print("\nDone!")
+
+
+def stream_animation(
+    positions: np.ndarray,
+    labels: list,
+    colors: list,
+    legend: bool,
+    num_frames: int,
+    output_path: str | Path = FIGURES_DIR / "animation_stream.mp4",
+    masses: np.ndarray | None = None,
+    view_limit: float = 2.0,
+    target_body_index: int | None = None,
+    visual_scale: float = 1.0,
+    hide_grid: bool = False,
+    fps: float = 12,
+    trail_length: int | None = None,
+    simplify: bool = False
+) -> None:
+    """Render the animation straight into a video or GIF file.
+
+    Same frames as draw_frames followed by create_mp4 / create_gif, but
+    each frame is drawn by a FrameRenderer into the figure's RGB buffer
+    and handed to the encoder from memory: no PNG is written, compressed
+    or read back.
+
+    Args:
+        output_path (str | Path): Output file, a GIF if it ends in .gif
+            and an MP4 (libx264) otherwise. Not animation.mp4 by
+            default, so create_mp4's output is kept.
+        fps (float): Frames per second of the output, e.g. that of
+            frame_scheduler.schedule_frames.
+        Others: See draw_frames.
+    """
+    output_path = Path(output_path)
+    print(f"Rendering {output_path.name}...")
+    style = _frame_style(
+        labels, colors, legend, masses, view_limit, target_body_index,
+        visual_scale, hide_grid, True, trail_length, simplify)
+    images = _frame_images(positions, num_frames, style)
+
+    if output_path.suffix.lower() == ".gif":
+        # The GIF writer pulls the frames one at a time. RGBA like the
+        # PNG frames: Pillow quantizes it with its fast octree method
+        frames = (PIL.Image.fromarray(image) for image in images)
+        next(frames).save(
+            output_path,
+            save_all=True,
+            append_images=frames,
+            loop=0,
+            duration=round(1000 / fps),
+        )
+    else:
+        with iio.get_writer(
+                output_path,
+                fps=fps,
+                codec='libx264',
+                macro_block_size=None
+        ) as writer:
+            for image in images:
+                writer.append_data(image[:, :, :3])  # type: ignore
+
+    print(f"\nOutput completed! Please check {output_path}")
 
+
+def _frame_images(
+    positions: np.ndarray, num_frames: int, style: dict
+) -> Iterator[np.ndarray]:
+    """Draw the frames in memory and yield each as an RGBA array,
+    (H, W, 4).
+
+    Each frame is saved as raw RGBA in memory, with the same settings
+    as the PNG frames (so the pixels are identical).
+    """
+    fig, draw = _frame_painter(positions, style)
+    height = round(fig.get_figheight() * FRAME_DPI)
+    try:
+        for n in range(num_frames):
+            print(f"Progress: {n + 1} / {num_frames}", end="\r")
+            draw(n)
+            buffer = io.BytesIO()
+            fig.savefig(buffer, format="raw", dpi=FRAME_DPI)
+            yield np.frombuffer(
+                buffer.getbuffer(), dtype=np.uint8
+            ).reshape(height, -1, 4)
+    finally:
+        plt.close(fig)
+
+
+def _frame_style(
+    labels: list,
+    colors: list,
+    legend: bool,
+    masses: np.ndarray | None,
+    view_limit: float,
+    target_body_index: int | None,
+    visual_scale: float,
+    hide_grid: bool,
+    incremental: bool,
+    trail_length: int | None,
+    simplify: bool
+) -> dict:
+    """Drawing options shared by every frame, see draw_frames."""
     # Define Visual Radii (AU)
     # We set base radii and multiply by visual_scale for visibility
     base_radii = np.array([0.05] * len(labels))  # Default 0.05 AU
@@ -51,81 +208,305 @@ def draw_frames(
     # This ensures they stay consistent throughout the animation
     marker_sizes = (final_radii_au * au_to_points) ** 2
 
-    for n in range(num_frames):
-        print(f"Progress: {n + 1} / {num_frames}", end="\r")
-
-        # Draw the trajectory
-        fig = plt.figure(figsize=(fig_size_inches, fig_size_inches))
-        ax = fig.add_subplot(111, projection="3d")
-
-        if hide_grid:
-            # Option A: Clean Cinematic Look (No grid, no numbers)
-            ax.grid(False)
-            ax.axis('off')
-        else:
-            # Option B: Stable Engineering Grid
-            # Force ticks to be at exact integers (0, 1, 2...)
-            # This prevents them from jumping around as the camera moves.
-            locator = ticker.MultipleLocator(1.0)
-            ax.xaxis.set_major_locator(locator)
-            ax.yaxis.set_major_locator(locator)
-            ax.zaxis.set_major_locator(locator)
-
-            # Formatting: Force 1 decimal place (e.g. "1.0")
-            formatter = ticker.FormatStrFormatter('%.1f')
-            ax.xaxis.set_major_formatter(formatter)
-            ax.yaxis.set_major_formatter(formatter)
-            ax.zaxis.set_major_formatter(formatter)
-
-            ax.set_xlabel("$x$ (AU)")
-            ax.set_ylabel("$y$ (AU)")
-            ax.set_zlabel("$z$ (AU)")
-
-        # Determine Camera Center
-        center_x, center_y, center_z = 0.0, 0.0, 0.0
-        if target_body_index is not None:
-            # Lock camera onto the specific body's position at this frame 'n'
-            center_x = positions[n, target_body_index, 0]
-            center_y = positions[n, target_body_index, 1]
-            center_z = positions[n, target_body_index, 2]
-
+    return {
+        "labels": labels,
+        "colors": colors,
+        "legend": legend,
+        "marker_sizes": marker_sizes,
+        "view_limit": view_limit,
+        "target_body_index": target_body_index,
+        "hide_grid": hide_grid,
+        "fig_size_inches": fig_size_inches,
+        "incremental": incremental,
+        "trail_length": trail_length,
+        # Size of a pixel in AU: the whole view across the whole figure
+        "tolerance": (
+            plot_width_au / (fig_size_inches * FRAME_DPI) if simplify
+            else None),
+    }
+
+
+def _frame_painter(
+    positions: np.ndarray, style: dict
+) -> tuple[plt.Figure, Callable[[int], None]]:
+    """The figure of an animation and the function drawing frame n on it:
+    updating a FrameRenderer, or redrawing everything."""
+    if style["incremental"]:
+        renderer = FrameRenderer(positions, style)
+        return renderer.fig, renderer.update
+
+    size = style["fig_size_inches"]
+    fig = plt.figure(figsize=(size, size))
+    trails = Trails(positions, style["trail_length"], style["tolerance"])
+    return fig, partial(_draw_frame, fig, positions, trails, style=style)
+
+
+def _save_frame(fig: plt.Figure, n: int) -> None:
+    fig.savefig(FRAMES_DIR / f"frames_{n:05d}.png", dpi=FRAME_DPI)
+
+
+def _setup_axes(ax: plt.Axes, hide_grid: bool) -> None:
+    if hide_grid:
+        # Option A: Clean Cinematic Look (No grid, no numbers)
+        ax.grid(False)
+        ax.axis('off')
+    else:
+        # Option B: Stable Engineering Grid
+        # Force ticks to be at exact integers (0, 1, 2...)
+        # This prevents them from jumping around as the camera moves.
+        locator = ticker.MultipleLocator(1.0)
+        ax.xaxis.set_major_locator(locator)
+        ax.yaxis.set_major_locator(locator)
+        ax.zaxis.set_major_locator(locator)
+
+        # Formatting: Force 1 decimal place (e.g. "1.0")
+        formatter = ticker.FormatStrFormatter('%.1f')
+        ax.xaxis.set_major_formatter(formatter)
+        ax.yaxis.set_major_formatter(formatter)
+        ax.zaxis.set_major_formatter(formatter)
+
+        ax.set_xlabel("$x$ (AU)")
+        ax.set_ylabel("$y$ (AU)")
+        ax.set_zlabel("$z$ (AU)")
+
+
+def _camera_center(
+    positions: np.ndarray, n: int, target_body_index: int | None
+) -> np.ndarray:
+    if target_body_index is None:
+        return np.zeros(3)
+    # Lock camera onto the specific body's position at this frame 'n'
+    return positions[n, target_body_index]
+
+
+def _set_view(ax: plt.Axes, center: np.ndarray, view_limit: float) -> None:
+    # Apply Tracking Limits
+    ax.set_xlim3d(center[0] - view_limit, center[0] + view_limit)
+    ax.set_ylim3d(center[1] - view_limit, center[1] + view_limit)
+    ax.set_zlim3d(center[2] - view_limit, center[2] + view_limit)
+
+    # Set equal aspect ratio to prevent distortion
+    ax.set_aspect("equal")
+
+
+def _draw_frame(
+    fig: plt.Figure, positions: np.ndarray, trails: "Trails", n: int,
+    style: dict
+) -> None:
+    """Draw frame n from scratch on a cleared figure."""
+    view_limit = style["view_limit"]
+    target_body_index = style["target_body_index"]
+    marker_sizes = style["marker_sizes"]
+
+    # Draw the trajectory
+    fig.clear()
+    ax = fig.add_subplot(111, projection="3d")
+    _setup_axes(ax, style["hide_grid"])
+
+    # Determine Camera Center
+    center = _camera_center(positions, n, target_body_index)
+
+    for i in range(positions.shape[1]):
+        trail = trails.indices(i, n)
+        traj = ax.plot(
+            positions[trail, i, 0],
+            positions[trail, i, 1],
+            positions[trail, i, 2],
+            color=style["colors"][i],
+        )
+        # Plot the last position with marker
+        ax.scatter(
+            positions[n, i, 0],
+            positions[n, i, 1],
+            positions[n, i, 2],
+            marker="o",
+            color=traj[0].get_color(),
+            label=style["labels"][i],
+            s=marker_sizes[i],
+            edgecolors='black',
+            linewidth=0.5
+        )
+
+    _set_view(ax, center, view_limit)
+
+    if style["legend"]:
+        ax.legend(
+            loc="center right", bbox_to_anchor=(0, 0.5))
+        fig.subplots_adjust(right=0.7)
+        fig.tight_layout()
+
+
+class Trails:
+    """Snapshots drawn in the trajectory line of each body at frame n:
+    the last trail_length before n (all of them if None), thinned out by
+    Douglas-Peucker simplification if a tolerance is given.
+
+    The whole trajectories are simplified once, up front; each frame
+    only cuts its window out of the kept indices, plus the exact ends.
+    """
+
+    def __init__(
+        self, positions: np.ndarray, trail_length: int | None,
+        tolerance: float | None
+    ) -> None:
+        self.trail_length = trail_length
+        self.kept = None
+        if tolerance is not None:
+            self.kept = [
+                simplify_polyline(positions[:, i], tolerance)
+                for i in range(positions.shape[1])
+            ]
+
+    def indices(self, i: int, n: int) -> slice | np.ndarray:
+        """Snapshots in the line of body i at frame n."""
+        start = 0 if self.trail_length is None else max(
+            0, n - self.trail_length)
+        if self.kept is None or n - start < 2:
+            return slice(start, n)
+        kept = self.kept[i]
+        inside = kept[np.searchsorted(kept, start, "right"):
+                      np.searchsorted(kept, n - 1, "left")]
+        return np.concatenate([[start], inside, [n - 1]])
+
+
+class FrameRenderer:
+    """Animation figure built once, whose artists are moved frame by
+    frame: the trajectory lines get new data (set_data_3d), the markers
+    new offsets and the axes new limits when the camera tracks a body.
+    No figure, axes, ticker or artist is created per frame.
+
+    Attributes:
+        fig (plt.Figure): The figure, to save or grab after update.
+    """
+
+    def __init__(self, positions: np.ndarray, style: dict) -> None:
+        """
+        Args:
+            positions (np.ndarray): Position history, (T, N, 3).
+            style (dict): Drawing options, see draw_frames.
+        """
+        self.positions = positions
+        self.trails = Trails(
+            positions, style["trail_length"], style["tolerance"])
+        self.view_limit = style["view_limit"]
+        self.target_body_index = style["target_body_index"]
+
+        size = style["fig_size_inches"]
+        self.fig = plt.figure(figsize=(size, size))
+        self.ax = self.fig.add_subplot(111, projection="3d")
+        _setup_axes(self.ax, style["hide_grid"])
+
+        self.lines = []
+        self.markers = []
         for i in range(positions.shape[1]):
-            traj = ax.plot(
-                positions[:n, i, 0],
-                positions[:n, i, 1],
-                positions[:n, i, 2],
-                color=colors[i],
-            )
-            # Plot the last position with marker
-            ax.scatter(
-                positions[n, i, 0],
-                positions[n, i, 1],
-                positions[n, i, 2],
+            traj = self.ax.plot([], [], [], color=style["colors"][i])
+            self.lines.append(traj[0])
+            self.markers.append(self.ax.scatter(
+                positions[0, i, 0],
+                positions[0, i, 1],
+                positions[0, i, 2],
                 marker="o",
                 color=traj[0].get_color(),
-                label=labels[i],
-                s=marker_sizes[i],
+                label=style["labels"][i],
+                s=style["marker_sizes"][i],
                 edgecolors='black',
                 linewidth=0.5
+            ))
+
+        _set_view(
+            self.ax, _camera_center(positions, 0, self.target_body_index),
+            self.view_limit)
+
+        if style["legend"]:
+            self.ax.legend(
+                loc="center right", bbox_to_anchor=(0, 0.5))
+            self.fig.subplots_adjust(right=0.7)
+            self.fig.tight_layout()
+
+    def update(self, n: int) -> None:
+        """Move the artists to frame n."""
+        positions = self.positions
+        for i, (line, marker) in enumerate(zip(self.lines, self.markers)):
+            trail = self.trails.indices(i, n)
+            line.set_data_3d(
+                positions[trail, i, 0],
+                positions[trail, i, 1],
+                positions[trail, i, 2],
+            )
+            marker._offsets3d = (
+                positions[n, i, 0:1],
+                positions[n, i, 1:2],
+                positions[n, i, 2:3],
             )
 
-        # Apply Tracking Limits
-        ax.set_xlim3d(center_x - view_limit, center_x + view_limit)
-        ax.set_ylim3d(center_y - view_limit, center_y + view_limit)
-        ax.set_zlim3d(center_z - view_limit, center_z + view_limit)
+        if self.target_body_index is not None:
+            _set_view(
+                self.ax,
+                _camera_center(positions, n, self.target_body_index),
+                self.view_limit)
 
-        # Set equal aspect ratio to prevent distortion
-        ax.set_aspect("equal")
 
-        if legend:
-            ax.legend(
-                loc="center right", bbox_to_anchor=(0, 0.5))
-            fig.subplots_adjust(right=0.7)
-            fig.tight_layout()
+# State of a rendering worker process: the shared positions and its own
+# figure, set up once by _attach_render_worker
+_worker_block: shared_memory.SharedMemory | None = None
+_worker_positions: np.ndarray | None = None
+_worker_figure: plt.Figure | None = None
+_worker_draw: Callable[[int], None] | None = None
 
-        plt.savefig(FRAMES_DIR / f"frames_{n:05d}.png", dpi=150)
-        plt.close("all")
-    print("\nDone!")
+
+def _attach_render_worker(
+    name: str, shape: tuple[int, ...], style: dict
+) -> None:
+    """Worker initializer: attach the shared positions and create the
+    figure this worker draws all its frames on."""
+    global _worker_block, _worker_positions, _worker_figure, _worker_draw
+    # No display in the workers
+    plt.switch_backend("Agg")
+    _worker_block = shared_memory.SharedMemory(name=name)
+    _worker_positions = np.ndarray(
+        shape, dtype=np.float64, buffer=_worker_block.buf)
+    _worker_figure, _worker_draw = _frame_painter(_worker_positions, style)
+
+
+def _draw_frames_worker(frame_indices: range) -> int:
+    """Worker: draw and save some frames, return how many."""
+    for n in frame_indices:
+        _worker_draw(n)
+        _save_frame(_worker_figure, n)
+    return len(frame_indices)
+
+
+def _draw_frames_parallel(
+    positions: np.ndarray, num_frames: int, style: dict, num_workers: int
+) -> None:
+    """Split the frames across a pool of processes sharing the positions.
+
+    Frame n draws the trajectories up to n, so later frames cost more:
+    each task takes every k-th frame to balance the load.
+    """
+    shape = (num_frames, *positions.shape[1:])
+    block = shared_memory.SharedMemory(
+        create=True, size=max(int(np.prod(shape)) * 8, 1))
+    try:
+        shared = np.ndarray(shape, dtype=np.float64, buffer=block.buf)
+        shared[:] = positions[:num_frames]
+        del shared
+
+        # A few tasks per worker, for the progress report
+        num_tasks = min(num_frames, 4 * num_workers)
+        tasks = [range(k, num_frames, num_tasks) for k in range(num_tasks)]
+        done = 0
+        with ProcessPoolExecutor(
+            max_workers=num_workers,
+            initializer=_attach_render_worker,
+            initargs=(block.name, shape, style)
+        ) as pool:
+            for count in pool.map(_draw_frames_worker, tasks):
+                done += count
+                print(f"Progress: {done} / {num_frames}", end="\r")
+    finally:
+        block.close()
+        block.unlink()
 
 
 def frames_generator(num_frames: int):
@@ -134,24 +515,22 @@ def frames_generator(num_frames: int):
             FRAMES_DIR / f"frames_{i:05d}.png")
 
 
-def create_gif(num_frames: int) -> None:
+def create_gif(num_frames: int, fps: float = 12) -> None:
     print("Combining frames to gif...")
-    fps = 12
     frames = frames_generator(num_frames)
     next(frames).save(
         FIGURES_DIR / "animation.gif",
         save_all=True,
         append_images=frames,
         loop=0,
-        duration=(1000 // fps),
+        duration=round(1000 / fps),
     )
 
     print(f"Output completed! Please check {FIGURES_DIR / 'animation.gif'}")
 
 
-def create_mp4(num_frames: int) -> None:
+def create_mp4(num_frames: int, fps: float = 12) -> None:
     print("Combining frames to MP4...")
-    fps = 12
     output_path = FIGURES_DIR / "animation.mp4"
 
     with iio.get_writer(
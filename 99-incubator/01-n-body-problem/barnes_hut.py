@@ -0,0 +1,203 @@
+import numpy as np
+from grid import MAX_DEPTH, cell_keys, expand_ranges
+
+
+class Octree:
+    """Octree over the source bodies, built level by level.
+
+    Every level stores the occupied cells only. Cells are linked to
+    their children at the next level, and the deepest cells to the
+    bodies they contain.
+
+    Attributes:
+        num_levels (int): Number of levels (root is level 0).
+        cell_sizes (np.ndarray): Edge length of the cells at each level.
+        masses (list): Total mass of each cell, per level.
+        centers (list): Center of mass of each cell, per level.
+        counts (list): Number of bodies in each cell, per level.
+        body_index (list): Cell of each body, per level.
+        child_order (list): Cells of the next level sorted by parent.
+        child_start (list): First child of each cell in child_order.
+        child_count (list): Number of children of each cell.
+    """
+
+    def __init__(self, positions: np.ndarray, masses: np.ndarray) -> None:
+        # Cubic bounding box, slightly enlarged so no body sits on the edge
+        lower: np.ndarray = positions.min(axis=0)
+        upper: np.ndarray = positions.max(axis=0)
+        box_size: float = max(float(np.max(upper - lower)), 1e-300) * 1.001
+        origin: np.ndarray = 0.5 * (lower + upper) - 0.5 * box_size
+
+        self.cell_sizes: list[float] = []
+        self.masses: list[np.ndarray] = []
+        self.centers: list[np.ndarray] = []
+        self.counts: list[np.ndarray] = []
+        self.body_index: list[np.ndarray] = []
+        self.child_order: list[np.ndarray] = []
+        self.child_start: list[np.ndarray] = []
+        self.child_count: list[np.ndarray] = []
+
+        for level in range(MAX_DEPTH + 1):
+            cells_per_side: int = 2 ** level
+            cell_size: float = box_size / cells_per_side
+            coords: np.ndarray = np.clip(
+                ((positions - origin) / cell_size).astype(np.int64),
+                0, cells_per_side - 1)
+            keys: np.ndarray = cell_keys(coords, cells_per_side)
+            _, first_body, cell_of_body = np.unique(
+                keys, return_index=True, return_inverse=True)
+            num_cells: int = len(first_body)
+
+            cell_mass: np.ndarray = np.bincount(
+                cell_of_body, weights=masses, minlength=num_cells)
+            cell_count: np.ndarray = np.bincount(
+                cell_of_body, minlength=num_cells)
+
+            # Center of mass, or the mean position for massless cells
+            cell_center: np.ndarray = np.empty((num_cells, 3))
+            has_mass: np.ndarray = cell_mass > 0
+            with np.errstate(divide='ignore', invalid='ignore'):
+                for axis in range(3):
+                    cell_center[:, axis] = np.where(
+                        has_mass,
+                        np.bincount(
+                            cell_of_body,
+                            weights=masses * positions[:, axis],
+                            minlength=num_cells) / cell_mass,
+                        np.bincount(
+                            cell_of_body,
+                            weights=positions[:, axis],
+                            minlength=num_cells) / cell_count
+                    )
+            # Exact positions for single bodies, so a target finds itself
+            # at exactly zero distance
+            single: np.ndarray = cell_count == 1
+            cell_center[single] = positions[first_body[single]]
+
+            if level > 0:
+                # Link the previous level to these cells
+                parent: np.ndarray = self.body_index[-1][first_body]
+                order: np.ndarray = np.argsort(parent, kind="stable")
+                count: np.ndarray = np.bincount(
+                    parent, minlength=len(self.masses[-1]))
+                self.child_order.append(order)
+                self.child_count.append(count)
+                self.child_start.append(np.cumsum(count) - count)
+
+            self.cell_sizes.append(cell_size)
+            self.masses.append(cell_mass)
+            self.centers.append(cell_center)
+            self.counts.append(cell_count)
+            self.body_index.append(cell_of_body)
+
+            if np.all(cell_count == 1):
+                break
+
+        self.num_levels: int = len(self.masses)
+
+        # Bodies of the deepest cells, for cells that still hold several
+        # bodies (coincident bodies or MAX_DEPTH reached)
+        self.leaf_bodies: np.ndarray = np.argsort(
+            self.body_index[-1], kind="stable")
+        leaf_count: np.ndarray = self.counts[-1]
+        self.leaf_start: np.ndarray = np.cumsum(leaf_count) - leaf_count
+
+
+def barnes_hut_accelerations(
+    targets: np.ndarray,
+    sources: np.ndarray,
+    masses: np.ndarray,
+    G: float,
+    theta: float,
+    out: np.ndarray,
+    softening: float = 0.0
+) -> None:
+    """Approximate the gravitational acceleration on each target with a
+    Barnes-Hut octree over the sources.
+
+    A cell is replaced by its center of mass when its size seen from the
+    target is below theta (cell_size / distance < theta). All targets
+    walk the tree together, one level at a time, as flat arrays of
+    (target, cell) interactions. A target at zero distance from a source
+    (itself) feels nothing from it.
+
+    ref: J. Barnes, P. Hut, Nature 324 (1986) 446-449
+
+    Args:
+        targets (np.ndarray): Positions to evaluate, shape (N, 3).
+        sources (np.ndarray): Positions of the sources, shape (M, 3).
+        masses (np.ndarray): Masses of the sources, shape (M,).
+        G (float): Gravitational constant.
+        theta (float): Opening angle. 0 gives the exact direct sum.
+        out (np.ndarray): Accelerations of the targets, shape (N, 3).
+        softening (float): Plummer softening length.
+    """
+    num_targets: int = len(targets)
+    out[:] = 0.0
+    if len(sources) == 0:
+        return
+
+    tree: Octree = Octree(sources, masses)
+    theta_sq: float = theta * theta
+
+    # Every target starts at the root cell
+    pair_target: np.ndarray = np.arange(num_targets)
+    pair_cell: np.ndarray = np.zeros(num_targets, dtype=np.intp)
+
+    for level in range(tree.num_levels):
+        if len(pair_target) == 0:
+            break
+
+        counts: np.ndarray = tree.counts[level][pair_cell]
+        r_ij: np.ndarray = (
+            tree.centers[level][pair_cell] - targets[pair_target])
+        r_sq: np.ndarray = np.einsum("pk,pk->p", r_ij, r_ij)
+
+        # Far enough away, or a single body (exact as a point mass)
+        accept: np.ndarray = (
+            (tree.cell_sizes[level] ** 2 < theta_sq * r_sq) | (counts == 1))
+        add_point_masses(
+            out, pair_target[accept], r_ij[accept], r_sq[accept],
+            tree.masses[level][pair_cell[accept]], G, softening)
+
+        open_target: np.ndarray = pair_target[~accept]
+        open_cell: np.ndarray = pair_cell[~accept]
+
+        if level == tree.num_levels - 1:
+            # Cells still open at the deepest level are summed
+            # body by body
+            owner, body = expand_ranges(
+                tree.leaf_start[open_cell], tree.counts[level][open_cell])
+            body = tree.leaf_bodies[body]
+            target: np.ndarray = open_target[owner]
+            r_ij = sources[body] - targets[target]
+            r_sq = np.einsum("pk,pk->p", r_ij, r_ij)
+            add_point_masses(
+                out, target, r_ij, r_sq, masses[body], G, softening)
+        else:
+            owner, child = expand_ranges(
+                tree.child_start[level][open_cell],
+                tree.child_count[level][open_cell])
+            pair_target = open_target[owner]
+            pair_cell = tree.child_order[level][child]
+
+
+def add_point_masses(
+    out: np.ndarray,
+    target: np.ndarray,
+    r_ij: np.ndarray,
+    r_sq: np.ndarray,
+    mass: np.ndarray,
+    G: float,
+    softening: float = 0.0
+) -> None:
+    """Add G * m * r_ij / r^3 for each (target, point mass) interaction,
+    skipping zero distances (self-interaction). With softening eps,
+    r^2 is replaced by r^2 + eps^2."""
+    soft_sq: np.ndarray = r_sq + softening * softening
+    with np.errstate(divide='ignore'):
+        weight: np.ndarray = np.where(
+            r_sq > 0, G * mass / (soft_sq * np.sqrt(soft_sq)), 0.0)
+    for axis in range(3):
+        out[:, axis] += np.bincount(
+            target, weights=weight * r_ij[:, axis], minlength=len(out))
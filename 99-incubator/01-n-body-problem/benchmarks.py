@@ -0,0 +1,1169 @@
+# %% [markdown]
+# # N-Body Benchmarks
+# **Length:** AU (Astronomical Unit)\
+# **Mass:** Solar mass\
+# **Time:** days
+
+# %%
+import io
+import os
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import matplotlib.pyplot as plt
+from functools import partial
+from typing import Callable
+from math_utils import get_initial_conditions
+from n_body_system import NBodySystem
+from ensemble import NBodyEnsemble
+from level_runner import run_levels
+from trajectory import Trajectory
+from jit_kernels import JIT_AVAILABLE
+from collisions import find_collisions
+from frame_scheduler import schedule_frames
+import anim_utils
+from math_utils import get_3_body_problem
+from level_gen import LevelGenerator
+
+
+def total_energy(system: NBodySystem) -> float:
+    """Kinetic plus potential energy of the system."""
+    kinetic: float = 0.5 * np.sum(
+        system.masses * np.sum(system.velocities ** 2, axis=1))
+
+    r_ij: np.ndarray = (
+        system.positions[:, np.newaxis, :]
+        - system.positions[np.newaxis, :, :])
+    r_norm: np.ndarray = np.linalg.norm(r_ij, axis=2)
+    np.fill_diagonal(r_norm, np.inf)
+    potential: float = -0.5 * system.G * np.sum(
+        system.masses[:, np.newaxis] * system.masses[np.newaxis, :] / r_norm)
+
+    return kinetic + potential
+
+
+def benchmark_integrators(
+    scenario: str,
+    time_frame: float,
+    runs: list[tuple[str, float]]
+) -> None:
+    """Print wall time and relative energy error for each
+    (integrator, time_step) pair over the same simulated duration."""
+    print(f"{scenario}, {time_frame / 365.24:.0f} years")
+    print(f"{'integrator':>16} {'dt (days)':>10} "
+          f"{'wall (s)':>10} {'|dE/E0|':>10}")
+
+    for integrator, time_step in runs:
+        system, _, _, _ = get_initial_conditions(scenario)
+        initial_energy: float = total_energy(system)
+
+        start: float = time.perf_counter()
+        system.run(
+            time_frame=time_frame,
+            time_step=time_step,
+            output_interval=time_frame / 100,
+            integrator=integrator
+        )
+        wall_time: float = time.perf_counter() - start
+
+        energy_error: float = abs(
+            (total_energy(system) - initial_energy) / initial_energy)
+        print(f"{integrator:>16} {time_step:>10.3g} "
+              f"{wall_time:>10.2f} {energy_error:>10.2e}")
+
+
+# %% [markdown]
+# ## Integrators: wall time vs energy error
+# The 200-year solar system run from the README figures.
+# Mercury's 88-day orbit sets the step size for the non-Kepler methods.
+
+# %%
+benchmark_integrators(
+    scenario="solar_system",
+    time_frame=200 * 365.24,
+    runs=[
+        ("euler_cromer", 0.5),
+        ("leapfrog", 0.5),
+        ("leapfrog", 2.0),
+        ("yoshida4", 2.0),
+        ("yoshida4", 4.0),
+        ("yoshida6", 4.0),
+        ("yoshida6", 8.0),
+        ("wisdom_holman", 4.0),
+        ("wisdom_holman", 8.0),
+    ]
+)
+
+
+def count_force_evaluations(system: NBodySystem) -> list[int]:
+    """Wrap the force kernel of a system with a call counter."""
+    calls: list[int] = [0]
+    kernel = system._calculate_accelerations
+
+    def counted_kernel() -> None:
+        calls[0] += 1
+        kernel()
+
+    system._calculate_accelerations = counted_kernel  # type: ignore
+    return calls
+
+
+def benchmark_adaptive(
+    scenario: str,
+    time_frame: float,
+    runs: list[tuple[str, float, float]]
+) -> None:
+    """Print force evaluations, wall time and relative energy error for
+    each (integrator, time_step, tolerance) run."""
+    print(f"{scenario}, {time_frame:.0f} days")
+    print(f"{'integrator':>16} {'dt/tol':>10} {'forces':>10} "
+          f"{'wall (s)':>10} {'|dE/E0|':>10}")
+
+    for integrator, time_step, tolerance in runs:
+        system, _, _, _ = get_initial_conditions(scenario)
+        initial_energy: float = total_energy(system)
+        calls: list[int] = count_force_evaluations(system)
+
+        start: float = time.perf_counter()
+        system.run(
+            time_frame=time_frame,
+            time_step=time_step,
+            output_interval=1.0,
+            integrator=integrator,
+            tolerance=tolerance
+        )
+        wall_time: float = time.perf_counter() - start
+
+        energy_error: float = abs(
+            (total_energy(system) - initial_energy) / initial_energy)
+        setting: float = tolerance if integrator == "rk45" else time_step
+        print(f"{integrator:>16} {setting:>10.0e} {calls[0]:>10} "
+              f"{wall_time:>10.2f} {energy_error:>10.2e}")
+
+
+# %% [markdown]
+# ## Adaptive time step: close encounters
+# The Pythagorean 3-body problem has several near-collisions.
+# A fixed step small enough for them is wasted on the quiet stretches.
+
+# %%
+benchmark_adaptive(
+    scenario="pyth-3-body",
+    time_frame=70.0,
+    runs=[
+        ("leapfrog", 1e-3, 0.0),
+        ("leapfrog", 1e-4, 0.0),
+        ("rk45", 1e-3, 1e-8),
+        ("rk45", 1e-3, 1e-10),
+    ]
+)
+
+
+def random_positions(
+    rng: np.random.Generator, num_bodies: int, layout: str = "cube"
+) -> np.ndarray:
+    """Random positions: 'cube' fills a 10 AU cube evenly, 'core' is a
+    Gaussian cluster (1 AU), 'belt' a thin ring of radius 3 AU, like
+    dust around a star, and 'dust' three stars within 1 AU of the
+    origin followed by a dust disk from 2 to 6 AU."""
+    if layout == "cube":
+        return rng.uniform(-5.0, 5.0, (num_bodies, 3))
+    elif layout == "core":
+        return rng.normal(0.0, 1.0, (num_bodies, 3))
+    elif layout == "belt":
+        angle: np.ndarray = rng.uniform(0.0, 2 * np.pi, num_bodies)
+        radius: np.ndarray = rng.normal(3.0, 0.1, num_bodies)
+        return np.column_stack([
+            radius * np.cos(angle), radius * np.sin(angle),
+            rng.normal(0.0, 0.01, num_bodies)])
+    elif layout == "dust":
+        angle = rng.uniform(0.0, 2 * np.pi, num_bodies - 3)
+        radius = rng.uniform(2.0, 6.0, num_bodies - 3)
+        return np.concatenate([
+            rng.normal(0.0, 0.5, (3, 3)),
+            np.column_stack([
+                radius * np.cos(angle), radius * np.sin(angle),
+                rng.normal(0.0, 0.05, num_bodies - 3)])])
+    raise ValueError(f"Unknown layout: {layout}")
+
+
+def random_system(
+    num_bodies: int, seed: int = 0, layout: str = "cube", **options
+) -> NBodySystem:
+    """Bodies scattered in a 10 AU cube (or another layout, see
+    random_positions) with planet-to-star masses. The dust of the 'dust'
+    layout is massless.
+    Extra keyword options are passed on to NBodySystem."""
+    rng: np.random.Generator = np.random.default_rng(seed)
+    positions: np.ndarray = random_positions(rng, num_bodies, layout)
+    velocities: np.ndarray = rng.normal(0.0, 0.01, (num_bodies, 3))
+    masses: np.ndarray = rng.uniform(1e-5, 1.0, num_bodies)
+    if layout == "dust":
+        masses[3:] = 0.0
+    return NBodySystem(
+        num_bodies=num_bodies,
+        positions=positions,
+        velocities=velocities,
+        masses=masses,
+        G=0.00029591220828,
+        **options
+    )
+
+
+def broadcast_accelerations(system: NBodySystem) -> None:
+    """The original kernel, which allocates its (N, N, 3) temporaries
+    on every call. Kept as the baseline for the benchmarks."""
+    r_ij: np.ndarray = (
+        system.positions[:, np.newaxis, :]
+        - system.positions[np.newaxis, :, :])
+    r_norm: np.ndarray = np.linalg.norm(r_ij, axis=2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inv_r_cubed: np.ndarray = 1.0 / (r_norm * r_norm * r_norm)
+    np.fill_diagonal(inv_r_cubed, 0.0)
+    system.accelerations = system.G * np.sum(
+        system.masses[:, np.newaxis, np.newaxis]
+        * r_ij * inv_r_cubed[:, :, np.newaxis],
+        axis=0
+    )
+
+
+def workspace_mb(system: NBodySystem) -> float:
+    """Memory held by the private arrays of a system, in MB."""
+    return sum(
+        value.nbytes for name, value in vars(system).items()
+        if name.startswith("_") and isinstance(value, np.ndarray)
+    ) / 1e6
+
+
+def measure_steps(
+    system: NBodySystem, num_steps: int
+) -> tuple[float, float]:
+    """Run leapfrog steps and return (steps per second, peak MB)."""
+    step = system._get_stepper("leapfrog")
+
+    start: float = time.perf_counter()
+    for _ in range(num_steps):
+        step(1e-3)
+    steps_per_second: float = num_steps / (time.perf_counter() - start)
+
+    # Peak memory of a single step, measured separately so tracing
+    # does not slow down the timing loop
+    tracemalloc.start()
+    step(1e-3)
+    peak_mb: float = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+
+    return steps_per_second, peak_mb
+
+
+def benchmark_kernels(
+    sizes: list[int],
+    kernels: dict[str, str | Callable[[NBodySystem], None]]
+) -> None:
+    """Print steps/sec and peak step memory for each force kernel.
+    A kernel is either a force_backend name or a function called with
+    the system in place of _calculate_accelerations."""
+    print(f"{'N':>6} {'kernel':>12} {'steps/s':>10} "
+          f"{'peak MB':>10} {'buffers MB':>10}")
+
+    for num_bodies in sizes:
+        num_steps: int = max(5, 20_000 // num_bodies)
+        for name, kernel in kernels.items():
+            system: NBodySystem
+            if isinstance(kernel, str):
+                system = random_system(num_bodies, force_backend=kernel)
+            else:
+                system = random_system(num_bodies)
+                system._calculate_accelerations = (  # type: ignore
+                    partial(kernel, system))
+            steps_per_second, peak_mb = measure_steps(system, num_steps)
+            print(f"{num_bodies:>6} {name:>12} "
+                  f"{steps_per_second:>10.1f} {peak_mb:>10.2f} "
+                  f"{workspace_mb(system):>10.2f}")
+
+
+# %% [markdown]
+# ## Force kernel: allocating vs preallocated workspace
+
+# %%
+benchmark_kernels(
+    sizes=[4, 12, 100, 1000],
+    kernels={"allocating": broadcast_accelerations, "workspace": "direct"}
+)
+
+# %% [markdown]
+# ## Force kernel: full grid vs unique pairs
+
+# %%
+benchmark_kernels(
+    sizes=[4, 12, 100, 1000, 2000],
+    kernels={"direct": "direct", "pairwise": "pairwise"}
+)
+
+
+def time_force_evaluation(system: NBodySystem) -> float:
+    """Wall time of a single call to the force kernel, in seconds."""
+    start: float = time.perf_counter()
+    system._calculate_accelerations()
+    return time.perf_counter() - start
+
+
+def benchmark_force_backend(
+    sizes: list[int], backend: str, settings: list[dict],
+    layout: str = "cube"
+) -> None:
+    """Compare one force evaluation of an approximate backend against the
+    exact direct sum: wall time and relative error per body."""
+    print(f"{'N':>7} {'setting':>22} {'time (s)':>10} "
+          f"{'median err':>10} {'max err':>10}")
+
+    for num_bodies in sizes:
+        exact: NBodySystem = random_system(num_bodies, layout=layout)
+        exact_time: float = time_force_evaluation(exact)
+        exact_norm: np.ndarray = np.linalg.norm(exact.accelerations, axis=1)
+        print(f"{num_bodies:>7} {'direct':>22} {exact_time:>10.3f}")
+
+        for options in settings:
+            system: NBodySystem = random_system(
+                num_bodies, layout=layout, force_backend=backend, **options)
+            approx_time: float = time_force_evaluation(system)
+            error: np.ndarray = np.linalg.norm(
+                system.accelerations - exact.accelerations, axis=1
+            ) / exact_norm
+            setting: str = ", ".join(f"{k}={v}" for k, v in options.items())
+            print(f"{num_bodies:>7} {setting:>22} {approx_time:>10.3f} "
+                  f"{np.median(error):>10.1e} {np.max(error):>10.1e}")
+
+
+# %% [markdown]
+# ## Barnes-Hut: error against the direct sum, and crossover N
+# theta = 0 opens every cell, so it must match the direct sum exactly.
+
+# %%
+benchmark_force_backend(
+    sizes=[250, 500, 1000, 2000, 4000],
+    backend="barnes_hut",
+    settings=[{"theta": 0.0}, {"theta": 0.3},
+              {"theta": 0.5}, {"theta": 0.8}]
+)
+
+# %% [markdown]
+# ## Fast multipole method: error against the direct sum, and scaling
+# Error falls with the expansion order; time grows about linearly in N,
+# also for clustered bodies, since the leaves split where the sources
+# are dense.
+
+# %%
+benchmark_force_backend(
+    sizes=[1000, 4000],
+    backend="fmm",
+    settings=[{"expansion_order": 2}, {"expansion_order": 4},
+              {"expansion_order": 6}, {"expansion_order": 8}]
+)
+
+# %% [markdown]
+# ## Stars among dust: error of both tree codes
+# Three stars and massless dust, where a few sources make all the force.
+# The FMM sums the sparse star cells directly.
+
+# %%
+benchmark_force_backend(
+    sizes=[2000, 20_000],
+    backend="fmm",
+    settings=[{"expansion_order": 2}, {"expansion_order": 4}],
+    layout="dust"
+)
+benchmark_force_backend(
+    sizes=[2000, 20_000],
+    backend="barnes_hut",
+    settings=[{"theta": 0.5}],
+    layout="dust"
+)
+
+
+def benchmark_fmm_scaling(
+    sizes: list[int], expansion_order: int, layouts: list[str]
+) -> None:
+    """Time one FMM force evaluation at sizes too large for direct sums,
+    for evenly spread and clustered bodies."""
+    print(f"{'N':>9} {'layout':>7} {'time (s)':>10} {'us / body':>10}")
+    for num_bodies in sizes:
+        for layout in layouts:
+            system: NBodySystem = random_system(
+                num_bodies, layout=layout, force_backend="fmm",
+                expansion_order=expansion_order)
+            elapsed: float = time_force_evaluation(system)
+            print(f"{num_bodies:>9} {layout:>7} {elapsed:>10.2f} "
+                  f"{elapsed / num_bodies * 1e6:>10.1f}")
+
+
+# %%
+benchmark_fmm_scaling(
+    sizes=[10_000, 100_000, 1_000_000], expansion_order=4,
+    layouts=["cube", "core", "belt"])
+
+# %% [markdown]
+# ## Blocked direct sum: bounded memory at exact forces
+# "buffers MB" is what each kernel keeps allocated between steps.
+
+# %%
+benchmark_kernels(
+    sizes=[100, 1000, 4000],
+    kernels={"direct": "direct", "blocked": "blocked"}
+)
+
+
+def benchmark_block_sizes(num_bodies: int, block_sizes: list[int]) -> None:
+    """Time one blocked force evaluation for several tile edges,
+    to check the cache-based automatic choice."""
+    print(f"N = {num_bodies}, automatic block = "
+          f"{NBodySystem._auto_block_size()}")
+    print(f"{'block':>7} {'time (s)':>10}")
+    for block_size in block_sizes:
+        system: NBodySystem = random_system(
+            num_bodies, force_backend="blocked", block_size=block_size)
+        print(f"{block_size:>7} {time_force_evaluation(system):>10.3f}")
+
+
+# %%
+benchmark_block_sizes(2000, block_sizes=[32, 64, 128, 256, 512, 1024])
+
+
+def solar_system_with_probes(
+    num_probes: int, all_massive: bool, seed: int = 0, **options
+) -> NBodySystem:
+    """The solar system plus probes on circular orbits between 2 and 3.5
+    AU (an asteroid belt). With all_massive the probes are given a tiny
+    mass and treated as ordinary bodies, otherwise as test particles."""
+    system, _, _, _ = get_initial_conditions("solar_system")
+    rng: np.random.Generator = np.random.default_rng(seed)
+    radius: np.ndarray = rng.uniform(2.0, 3.5, num_probes)
+    angle: np.ndarray = rng.uniform(0.0, 2.0 * np.pi, num_probes)
+    speed: np.ndarray = np.sqrt(system.G * system.masses[0] / radius)
+    positions: np.ndarray = np.zeros((num_probes, 3))
+    velocities: np.ndarray = np.zeros((num_probes, 3))
+    positions[:, 0] = radius * np.cos(angle)
+    positions[:, 1] = radius * np.sin(angle)
+    velocities[:, 0] = -speed * np.sin(angle)
+    velocities[:, 1] = speed * np.cos(angle)
+
+    masses: np.ndarray = np.concatenate(
+        [system.masses, np.full(num_probes, 1e-20)])
+    massive: np.ndarray = np.concatenate([
+        np.ones(system.num_bodies, dtype=bool),
+        np.full(num_probes, all_massive)
+    ])
+    return NBodySystem(
+        num_bodies=len(masses),
+        positions=np.concatenate([system.positions, positions]),
+        velocities=np.concatenate([system.velocities, velocities]),
+        masses=masses,
+        G=system.G,
+        massive=massive,
+        **options
+    )
+
+
+def benchmark_test_particles(
+    probe_counts: list[int], backends: list[str]
+) -> None:
+    """Leapfrog steps/sec with probes as massive bodies vs as test
+    particles, which only feel the 9 massive bodies."""
+    print(f"{'probes':>7} {'backend':>10} {'all massive':>12} "
+          f"{'test part.':>12} {'speedup':>8}")
+    for num_probes in probe_counts:
+        num_steps: int = max(5, 200_000 // num_probes)
+        for backend in backends:
+            rates: list[float] = []
+            for all_massive in (True, False):
+                system: NBodySystem = solar_system_with_probes(
+                    num_probes, all_massive, force_backend=backend)
+                rates.append(measure_steps(system, num_steps)[0])
+            print(f"{num_probes:>7} {backend:>10} {rates[0]:>12.1f} "
+                  f"{rates[1]:>12.1f} {rates[1] / rates[0]:>8.1f}")
+
+
+# %% [markdown]
+# ## Test particles: forces from the massive bodies only
+# Probes cost O(N_massive) each instead of O(N), so thousands of them
+# can be scanned at once.
+
+# %%
+benchmark_test_particles(
+    probe_counts=[100, 1000, 4000],
+    backends=["direct", "pairwise", "blocked"]
+)
+
+
+def benchmark_ensemble(
+    initial_condition: str, batch_sizes: list[int], num_steps: int,
+    max_loop_copies: int = 1000
+) -> None:
+    """Leapfrog steps of B perturbed copies: one NBodyEnsemble against a
+    Python loop over B NBodySystem objects (timed up to max_loop_copies
+    and extrapolated beyond)."""
+    system, _, _, _ = get_initial_conditions(initial_condition)
+    print(f"{'B':>7} {'ensemble (s)':>13} {'loop (s)':>10} "
+          f"{'copy-steps/s':>13} {'speedup':>8}")
+
+    for num_copies in batch_sizes:
+        ensemble: NBodyEnsemble = NBodyEnsemble.from_system(
+            system, num_copies, position_scale=1e-3, seed=0)
+        step = ensemble._get_stepper("leapfrog")
+        start: float = time.perf_counter()
+        for _ in range(num_steps):
+            step(1e-3)
+        ensemble_time: float = time.perf_counter() - start
+
+        looped: int = min(num_copies, max_loop_copies)
+        steppers: list[Callable[[float], None]] = [
+            NBodySystem(
+                num_bodies=system.num_bodies,
+                positions=ensemble.positions[b].copy(),
+                velocities=ensemble.velocities[b].copy(),
+                masses=system.masses,
+                G=system.G,
+            )._get_stepper("leapfrog")
+            for b in range(looped)
+        ]
+        start = time.perf_counter()
+        for _ in range(num_steps):
+            for step in steppers:
+                step(1e-3)
+        loop_time: float = (
+            (time.perf_counter() - start) * num_copies / looped)
+
+        print(f"{num_copies:>7} {ensemble_time:>13.3f} {loop_time:>10.3f} "
+              f"{num_copies * num_steps / ensemble_time:>13.0f} "
+              f"{loop_time / ensemble_time:>8.1f}")
+
+
+# %% [markdown]
+# ## Ensembles: perturbed copies stepped as one batch
+# Pythagorean 3-body problem, 100 leapfrog steps.
+
+# %%
+benchmark_ensemble(
+    "pyth-3-body", batch_sizes=[10, 100, 1000, 10_000], num_steps=100)
+
+
+def benchmark_level_runner(num_levels: int, worker_counts: list[int]) -> None:
+    """Validate num_levels seeded procedural levels (1 year of leapfrog)
+    with each worker count; run_levels prints the per-worker report."""
+    level_ids: list[str | int] = [
+        1 + seed % 10 for seed in range(num_levels)]
+    for num_workers in worker_counts:
+        print(f"\n{num_workers} worker(s)")
+        run_levels(
+            level_ids, time_frame=365.24, time_step=0.1,
+            output_interval=10.0, integrator="leapfrog",
+            seeds=list(range(num_levels)), num_workers=num_workers)
+
+
+# %% [markdown]
+# ## Level validation across worker processes
+
+# %%
+benchmark_level_runner(
+    num_levels=100, worker_counts=sorted({1, os.cpu_count() or 1}))
+
+
+def benchmark_streaming(
+    initial_condition: str, time_frame: float, time_step: float,
+    output_interval: float
+) -> None:
+    """Peak memory and time to the first snapshot of run() against
+    consuming iter_run() one snapshot at a time."""
+    print(f"{'mode':>9} {'snapshots':>10} {'first (ms)':>11} "
+          f"{'total (s)':>10} {'peak MB':>8}")
+    for mode in ("run", "iter_run"):
+        system, _, _, _ = get_initial_conditions(initial_condition)
+        first: list[float] = []
+        tracemalloc.start()
+        start: float = time.perf_counter()
+        if mode == "run":
+            _, _, time_history = system.run(
+                time_frame, time_step, output_interval, "leapfrog",
+                observer=lambda _: first.append(time.perf_counter()))
+            num_snapshots: int = len(time_history)
+        else:
+            num_snapshots = 0
+            for _ in system.iter_run(
+                    time_frame, time_step, output_interval, "leapfrog"):
+                first.append(time.perf_counter())
+                num_snapshots += 1
+        total: float = time.perf_counter() - start
+        peak_mb: float = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+        print(f"{mode:>9} {num_snapshots:>10} "
+              f"{(first[0] - start) * 1e3:>11.2f} {total:>10.2f} "
+              f"{peak_mb:>8.2f}")
+
+
+# %% [markdown]
+# ## Streaming snapshots: 200 years of the solar system, daily output
+# The observer of run() sees each snapshot as early as iter_run, but
+# run() still holds the whole history.
+
+# %%
+benchmark_streaming(
+    "solar_system", time_frame=200 * 365.24, time_step=1.0,
+    output_interval=1.0)
+
+
+def benchmark_trajectory_sink(
+    initial_condition: str, time_frame: float, time_step: float,
+    output_interval: float
+) -> None:
+    """Peak RAM of a run kept in memory against one streamed to
+    memory-mapped .npy files, and the time to read back a slice."""
+    print(f"{'history':>9} {'snapshots':>10} {'run (s)':>8} "
+          f"{'peak MB':>8} {'file MB':>8} {'slice (ms)':>11}")
+    with tempfile.TemporaryDirectory() as directory:
+        for path in (None, directory):
+            system, _, _, _ = get_initial_conditions(initial_condition)
+            tracemalloc.start()
+            start: float = time.perf_counter()
+            _, _, time_history = system.run(
+                time_frame, time_step, output_interval, "leapfrog",
+                trajectory_path=path)
+            run_time: float = time.perf_counter() - start
+            peak_mb: float = tracemalloc.get_traced_memory()[1] / 1e6
+            tracemalloc.stop()
+
+            file_mb: float = 0.0
+            slice_ms: float = 0.0
+            if path is not None:
+                file_mb = sum(
+                    file.stat().st_size for file in os.scandir(path)) / 1e6
+                # Last century of Jupiter and Saturn, yearly
+                start = time.perf_counter()
+                Trajectory(path).select(
+                    time_frame - 36524.0, None, [5, 6], stride=365)
+                slice_ms = (time.perf_counter() - start) * 1e3
+            print(f"{'memmap' if path else 'RAM':>9} "
+                  f"{len(time_history):>10} {run_time:>8.2f} "
+                  f"{peak_mb:>8.2f} {file_mb:>8.2f} {slice_ms:>11.2f}")
+
+
+# %% [markdown]
+# ## Trajectory sink: 1000 years of the solar system, daily output
+
+# %%
+benchmark_trajectory_sink(
+    "solar_system", time_frame=1000 * 365.24, time_step=1.0,
+    output_interval=1.0)
+
+
+def run_checking_every_step(
+    system: NBodySystem, time_frame: float, time_step: float,
+    output_interval: float, integrator: str
+) -> int:
+    """The original run() loop: a Python snapshot check after every
+    step. Kept as the baseline for the benchmarks; returns the number
+    of snapshots."""
+    step = system._get_stepper(integrator)
+    snapshots: list[np.ndarray] = [system.positions.copy()]
+    next_output_time: float = output_interval
+    for i in range(int(time_frame / time_step)):
+        step(time_step)
+        current_time: float = i * time_step
+        if current_time >= next_output_time:
+            snapshots.append(system.positions.copy())
+            next_output_time = len(snapshots) * output_interval
+    return len(snapshots)
+
+
+def benchmark_run_loop(
+    initial_conditions: list[str], integrators: list[str],
+    time_frame: float, time_step: float, output_interval: float
+) -> None:
+    """Steps/sec of run() (blocks of steps between outputs) against the
+    per-step snapshot check, at small N where Python overhead
+    dominates."""
+    num_steps: int = round(time_frame / time_step)
+    print(f"{'system':>14} {'N':>3} {'integrator':>12} "
+          f"{'per step':>10} {'blocks':>10} {'speedup':>8}")
+    for initial_condition in initial_conditions:
+        for integrator in integrators:
+            # Best of 3 runs of each loop
+            per_step: float = 0.0
+            blocks: float = 0.0
+            for _ in range(3):
+                system, _, _, _ = get_initial_conditions(initial_condition)
+                start: float = time.perf_counter()
+                run_checking_every_step(
+                    system, time_frame, time_step, output_interval,
+                    integrator)
+                per_step = max(
+                    per_step, num_steps / (time.perf_counter() - start))
+
+                system, _, _, _ = get_initial_conditions(initial_condition)
+                start = time.perf_counter()
+                system.run(time_frame, time_step, output_interval, integrator)
+                blocks = max(
+                    blocks, num_steps / (time.perf_counter() - start))
+
+            print(f"{initial_condition:>14} {system.num_bodies:>3} "
+                  f"{integrator:>12} {per_step:>10.0f} {blocks:>10.0f} "
+                  f"{blocks / per_step:>8.2f}")
+
+
+# %% [markdown]
+# ## Run loop: Python overhead per step at small N
+# 20k steps, one output every 100 steps; steps/sec, best of 3.
+# The snapshot check was only a small part of a step: at N <= 10 the
+# time goes into the ~10 NumPy calls of the step itself.
+
+# %%
+benchmark_run_loop(
+    ["pyth-3-body", "solar_system"], ["euler_cromer", "leapfrog"],
+    time_frame=200.0, time_step=0.01, output_interval=1.0)
+
+
+def benchmark_jit(
+    scenario: str, integrators: list[str], time_frame: float,
+    time_step: float, output_interval: float
+) -> None:
+    """Steps/sec of run() with the NumPy steppers and with the fused
+    compiled loop (jit=True), after a warm-up run that compiles it."""
+    if not JIT_AVAILABLE:
+        print("Numba is not installed: jit=True falls back to NumPy.")
+    num_steps: int = round(time_frame / time_step)
+    generator: LevelGenerator = LevelGenerator()
+    print(f"{'integrator':>12} {'NumPy':>10} {'JIT':>10} {'speedup':>8}")
+    for integrator in integrators:
+        rates: list[float] = []
+        for jit in (False, True):
+            system, _, _, _ = generator.generate_level(scenario)
+            system.jit = jit
+            system.run(output_interval, time_step, output_interval,
+                       integrator)
+            start: float = time.perf_counter()
+            system.run(time_frame, time_step, output_interval, integrator)
+            rates.append(num_steps / (time.perf_counter() - start))
+        print(f"{integrator:>12} {rates[0]:>10.0f} {rates[1]:>10.0f} "
+              f"{rates[1] / rates[0]:>8.1f}")
+
+
+# %% [markdown]
+# ## JIT: fused steps between outputs for the false_stability scenario
+# 1 year at dt = 0.01 days, steps/sec.
+
+# %%
+benchmark_jit(
+    "false_stability", ["euler_cromer", "leapfrog"],
+    time_frame=365.24, time_step=0.01, output_interval=0.01 * 365.24)
+
+
+def benchmark_threads(sizes: list[int], thread_counts: list[int]) -> None:
+    """Best-of-3 time of one threaded force evaluation for each thread
+    count, and the speedup over one thread."""
+    print(f"{os.cpu_count()} core(s)")
+    print(f"{'N':>6} {'threads':>8} {'time (s)':>10} {'speedup':>8}")
+    for num_bodies in sizes:
+        single: float = 0.0
+        for num_threads in thread_counts:
+            with random_system(
+                    num_bodies, force_backend="threaded",
+                    num_threads=num_threads) as system:
+                elapsed: float = min(
+                    time_force_evaluation(system) for _ in range(3))
+            single = single or elapsed
+            print(f"{num_bodies:>6} {num_threads:>8} {elapsed:>10.4f} "
+                  f"{single / elapsed:>8.2f}")
+
+
+# %% [markdown]
+# ## Threaded direct sum: scaling with the number of threads
+
+# %%
+benchmark_threads(
+    sizes=[500, 1000, 2000, 4000],
+    thread_counts=sorted({1, 2, 4, os.cpu_count() or 1}))
+
+
+def copy_system(system: NBodySystem, **options) -> NBodySystem:
+    """A new system with the same state, built with other options."""
+    return NBodySystem(
+        num_bodies=system.num_bodies,
+        positions=system.positions.copy(),
+        velocities=system.velocities.copy(),
+        masses=system.masses.copy(),
+        G=system.G,
+        **options
+    )
+
+
+def benchmark_precision(
+    scenarios: list[str], integrator: str, time_frame: float,
+    time_step: float
+) -> None:
+    """Accuracy of mixed precision against the float64 baseline: the
+    largest energy drift over the run and the final position gap."""
+    print(f"{'scenario':>16} {'precision':>10} {'max |dE/E0|':>12} "
+          f"{'max |dx| (AU)':>14}")
+    for scenario in scenarios:
+        baseline, _, _, _ = get_initial_conditions(scenario)
+        final_positions: np.ndarray = np.empty(0)
+        for precision in ("double", "mixed"):
+            system: NBodySystem = copy_system(baseline, precision=precision)
+            initial_energy: float = total_energy(system)
+            drift: list[float] = []
+            system.run(
+                time_frame, time_step, time_frame / 100, integrator,
+                observer=lambda _: drift.append(abs(
+                    total_energy(system) / initial_energy - 1.0)))
+            if precision == "double":
+                final_positions = system.positions.copy()
+            gap: float = np.max(np.abs(system.positions - final_positions))
+            print(f"{scenario:>16} {precision:>10} {max(drift):>12.2e} "
+                  f"{gap:>14.2e}")
+
+
+def benchmark_precision_speed(sizes: list[int], backends: list[str]) -> None:
+    """Best-of-3 force evaluation time and buffer memory, float64 against
+    mixed precision."""
+    print(f"{'N':>6} {'backend':>9} {'double (s)':>11} {'mixed (s)':>10} "
+          f"{'speedup':>8} {'MB double':>10} {'MB mixed':>9}")
+    for num_bodies in sizes:
+        for backend in backends:
+            times: list[float] = []
+            memory: list[float] = []
+            for precision in ("double", "mixed"):
+                system: NBodySystem = random_system(
+                    num_bodies, force_backend=backend, precision=precision)
+                times.append(min(
+                    time_force_evaluation(system) for _ in range(3)))
+                memory.append(workspace_mb(system))
+            print(f"{num_bodies:>6} {backend:>9} {times[0]:>11.4f} "
+                  f"{times[1]:>10.4f} {times[0] / times[1]:>8.2f} "
+                  f"{memory[0]:>10.1f} {memory[1]:>9.1f}")
+
+
+# %% [markdown]
+# ## Mixed precision: energy drift against float64
+# Leapfrog, 100 years, energy checked at 100 outputs.
+
+# %%
+benchmark_precision(
+    ["solar_system", "solar_system_plus"], "leapfrog",
+    time_frame=100 * 365.24, time_step=1.0)
+
+# %%
+benchmark_precision_speed(
+    sizes=[500, 1000, 2000], backends=["direct", "blocked"])
+
+
+def benchmark_diagnostics(
+    num_bodies: int, integrators: list[str], num_outputs: int
+) -> None:
+    """Run time with and without diagnostics at every output. Leapfrog
+    reuses the kernel's distances, Euler-Cromer has to recompute them."""
+    print(f"N = {num_bodies}, {num_outputs} outputs")
+    print(f"{'integrator':>12} {'off (s)':>8} {'on (s)':>8} "
+          f"{'overhead':>9}")
+    for integrator in integrators:
+        times: list[float] = []
+        for diagnostics in (False, True):
+            system: NBodySystem = random_system(num_bodies)
+            start: float = time.perf_counter()
+            system.run(
+                num_outputs * 1.0, 1.0, 1.0, integrator,
+                diagnostics=diagnostics)
+            times.append(time.perf_counter() - start)
+        print(f"{integrator:>12} {times[0]:>8.2f} {times[1]:>8.2f} "
+              f"{times[1] / times[0] - 1:>9.1%}")
+
+
+# %% [markdown]
+# ## Diagnostics: cost of tracking energy and momenta at each output
+
+# %%
+benchmark_diagnostics(
+    1000, ["leapfrog", "euler_cromer"], num_outputs=50)
+
+
+def brute_force_collisions(
+    positions: np.ndarray, radii: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """Colliding pairs from the full (N, N) distance matrix."""
+    r_ij: np.ndarray = positions[:, np.newaxis, :] - positions[np.newaxis]
+    touching: np.ndarray = (
+        np.einsum("ijk,ijk->ij", r_ij, r_ij)
+        < (radii[:, np.newaxis] + radii[np.newaxis]) ** 2)
+    return np.nonzero(np.triu(touching, k=1))
+
+
+def benchmark_collision_search(sizes: list[int], brute_limit: int) -> None:
+    """Best-of-3 time to find the colliding pairs, uniform grid against
+    the full distance matrix (skipped above brute_limit bodies)."""
+    print(f"{'N':>7} {'pairs':>6} {'grid (s)':>9} {'matrix (s)':>11} "
+          f"{'speedup':>8}")
+    for num_bodies in sizes:
+        # (the tree backend allocates no (N, N) buffers)
+        system: NBodySystem = random_system(
+            num_bodies, force_backend="barnes_hut")
+        # Radii growing with the mass, scaled so that a few bodies touch
+        radii: np.ndarray = np.cbrt(system.masses / num_bodies)
+        timings: list[float] = []
+        for search in (find_collisions, brute_force_collisions):
+            if search is brute_force_collisions and num_bodies > brute_limit:
+                break
+            best: float = np.inf
+            for _ in range(3):
+                start: float = time.perf_counter()
+                pair_i, _ = search(system.positions, radii)
+                best = min(best, time.perf_counter() - start)
+            timings.append(best)
+        matrix: str = (
+            f"{timings[1]:>11.4f} {timings[1] / timings[0]:>8.1f}"
+            if len(timings) == 2 else f"{'-':>11} {'-':>8}")
+        print(f"{num_bodies:>7} {len(pair_i):>6} {timings[0]:>9.4f} "
+              f"{matrix}")
+
+
+def benchmark_mergers(
+    num_bodies: int, time_frame: float, time_step: float,
+    softening: float
+) -> None:
+    """Cold collapse of a cluster with physical radii: bodies left,
+    conservation of mass and momentum through the mergers, and the cost
+    of the collision checks."""
+    rng: np.random.Generator = np.random.default_rng(0)
+    masses: np.ndarray = rng.uniform(1e-6, 1e-3, num_bodies)
+    options: dict = {
+        "num_bodies": num_bodies,
+        "positions": rng.uniform(-1.0, 1.0, (num_bodies, 3)),
+        "velocities": np.zeros((num_bodies, 3)),
+        "masses": masses,
+        "G": 1.0,
+        "softening": softening,
+    }
+    print(f"N = {num_bodies}, softening = {softening}")
+    print(f"{'radii':>6} {'left':>5} {'time (s)':>9} {'mass error':>11} "
+          f"{'max |P|':>9}")
+    for radii in (None, np.cbrt(masses) * 0.05):
+        system: NBodySystem = NBodySystem(
+            **{**options, "masses": masses.copy()}, radii=radii)
+        start: float = time.perf_counter()
+        _, _, _, diagnostics = system.run(
+            time_frame, time_step, time_frame / 20, "leapfrog",
+            diagnostics=True)
+        elapsed: float = time.perf_counter() - start
+        mass_error: float = abs(system.masses.sum() / masses.sum() - 1.0)
+        print(f"{'off' if radii is None else 'on':>6} "
+              f"{system.num_bodies:>5} {elapsed:>9.2f} {mass_error:>11.1e} "
+              f"{np.abs(diagnostics['momentum']).max():>9.1e}")
+
+
+# %% [markdown]
+# ## Collisions: close pair search, uniform grid against distance matrix
+
+# %%
+benchmark_collision_search(
+    sizes=[1000, 3000, 10000, 100000], brute_limit=10000)
+
+# %% [markdown]
+# ## Collisions: mergers in a collapsing cluster
+
+# %%
+benchmark_mergers(
+    500, time_frame=20.0, time_step=0.01, softening=0.01)
+
+
+def false_stability_history(num_frames: int) -> tuple:
+    """The 3-year false_stability run of physics_prototype.py, with its
+    plotting options, cut to num_frames snapshots."""
+    system, labels, colors, legend = get_3_body_problem("false_stability")
+    position_history, _, _ = system.run(3 * 365.24, 0.01, 0.01 * 365.24)
+    return position_history[:num_frames], {
+        "labels": labels,
+        "colors": colors,
+        "legend": legend,
+        "masses": system.masses,
+        "view_limit": 4.0,
+        "visual_scale": 1.5,
+    }
+
+
+def benchmark_draw_frames(num_frames: int, worker_counts: list[int]) -> None:
+    """Time to draw and save the PNG frames, serial against a pool of
+    rendering processes."""
+    positions, options = false_stability_history(num_frames)
+    print(f"{'workers':>8} {'time (s)':>9} {'frames/s':>9} {'speedup':>8}")
+    serial: float = 0.0
+    for num_workers in worker_counts:
+        start: float = time.perf_counter()
+        anim_utils.draw_frames(
+            positions, num_frames=num_frames, num_workers=num_workers,
+            **options)
+        elapsed: float = time.perf_counter() - start
+        anim_utils.delete_frames(num_frames)
+        serial = serial or elapsed
+        print(f"{num_workers:>8} {elapsed:>9.2f} "
+              f"{num_frames / elapsed:>9.2f} {serial / elapsed:>8.2f}")
+
+
+# %% [markdown]
+# ## Animation: parallel frame rendering
+# 60 frames of the false_stability animation.
+
+# %%
+benchmark_draw_frames(60, sorted({1, 2, 4, os.cpu_count() or 1}))
+
+
+def benchmark_frame_renderers(
+    num_frames: int, history_lengths: list[int]
+) -> None:
+    """Time per frame to update and render the figure (no saving), with
+    the figure rebuilt every frame against the persistent FrameRenderer.
+    The frames are taken at the end of histories of growing length."""
+    positions, options = false_stability_history(max(history_lengths))
+    style: dict = anim_utils._frame_style(
+        options["labels"], options["colors"], options["legend"],
+        options["masses"], options["view_limit"], None,
+        options["visual_scale"], False, False, None, False)
+    print(f"{'history':>8} {'rebuild (ms)':>13} {'update (ms)':>12} "
+          f"{'speedup':>8}")
+    for length in history_lengths:
+        frames: range = range(length - num_frames, length)
+        timings: list[float] = []
+        for incremental in (False, True):
+            fig, draw = anim_utils._frame_painter(
+                positions[:length], {**style, "incremental": incremental})
+            start: float = time.perf_counter()
+            for n in frames:
+                draw(n)
+                fig.canvas.draw()
+            timings.append((time.perf_counter() - start) / num_frames)
+            plt.close(fig)
+        print(f"{length:>8} {timings[0] * 1e3:>13.1f} "
+              f"{timings[1] * 1e3:>12.1f} {timings[0] / timings[1]:>8.2f}")
+
+
+# %% [markdown]
+# ## Animation: persistent figure against one new figure per frame
+
+# %%
+benchmark_frame_renderers(20, [20, 100, 300])
+
+
+def benchmark_video_pipeline(num_frames: int) -> None:
+    """Time to produce the GIF: PNG frames on disk read back by
+    create_gif, against frames streamed from memory to the encoder."""
+    positions, options = false_stability_history(num_frames)
+
+    start: float = time.perf_counter()
+    anim_utils.draw_frames(
+        positions, num_frames=num_frames, incremental=True, **options)
+    anim_utils.create_gif(num_frames)
+    png_time: float = time.perf_counter() - start
+    anim_utils.delete_frames(num_frames)
+    (anim_utils.FIGURES_DIR / "animation.gif").unlink()
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        anim_utils.stream_animation(
+            positions, num_frames=num_frames,
+            output_path=os.path.join(directory, "animation.gif"), **options)
+        stream_time: float = time.perf_counter() - start
+
+    print(f"{'pipeline':>9} {'time (s)':>9} {'frames/s':>9}")
+    for name, elapsed in (("png", png_time), ("stream", stream_time)):
+        print(f"{name:>9} {elapsed:>9.2f} {num_frames / elapsed:>9.2f}")
+
+
+# %% [markdown]
+# ## Animation: PNG frames against streaming to the encoder
+
+# %%
+benchmark_video_pipeline(60)
+
+
+def benchmark_trails(
+    output_interval: float, num_frames: int, trail_length: int
+) -> None:
+    """Vertices in the trajectory lines and time per frame (drawn and
+    rendered to memory) at the end of the 3-year false_stability run,
+    for full lines, simplified lines and a simplified trail window."""
+    system, labels, colors, legend = get_3_body_problem("false_stability")
+    positions, _, _ = system.run(3 * 365.24, 0.01, output_interval)
+    print(f"{len(positions)} snapshots, last {num_frames} frames")
+    print(f"{'lines':>10} {'vertices':>9} {'ms/frame':>9}")
+    for name, options in (
+        ("full", {}),
+        ("simplify", {"simplify": True}),
+        ("trail", {"simplify": True, "trail_length": trail_length}),
+    ):
+        style: dict = anim_utils._frame_style(
+            labels, colors, legend, system.masses, 4.0, None, 1.5, False,
+            True, options.get("trail_length"), options.get("simplify", False))
+        renderer: anim_utils.FrameRenderer = anim_utils.FrameRenderer(
+            positions, style)
+        start: float = time.perf_counter()
+        for n in range(len(positions) - num_frames, len(positions)):
+            renderer.update(n)
+            renderer.fig.savefig(
+                io.BytesIO(), format="raw", dpi=anim_utils.FRAME_DPI)
+        elapsed: float = (time.perf_counter() - start) / num_frames
+        vertices: int = sum(
+            len(line.get_data_3d()[0]) for line in renderer.lines)
+        plt.close(renderer.fig)
+        print(f"{name:>10} {vertices:>9} {elapsed * 1e3:>9.1f}")
+
+
+# %% [markdown]
+# ## Animation: trail window and line simplification
+# Output every 0.01 days, about 110k snapshots per body.
+
+# %%
+benchmark_trails(0.01, num_frames=10, trail_length=20000)
+
+
+def linear_frames(
+    frame_times: np.ndarray, times: np.ndarray, positions: np.ndarray
+) -> np.ndarray:
+    """Positions at the frame times, linearly interpolated."""
+    flat: np.ndarray = positions.reshape(len(times), -1)
+    return np.stack(
+        [np.interp(frame_times, times, column) for column in flat.T],
+        axis=-1).reshape(len(frame_times), *positions.shape[1:])
+
+
+def benchmark_frame_scheduler(
+    fps: float, duration: float, output_intervals: list[float]
+) -> None:
+    """Error of the interpolated frames of the false_stability video
+    for sparser and sparser outputs, cubic Hermite against linear. The
+    reference is the run with an output every step."""
+    system, _, _, _ = get_3_body_problem("false_stability")
+    time_step: float = 0.01
+    positions, velocities, times = system.run(
+        3 * 365.24, time_step, time_step)
+
+    print(f"{fps} fps, {duration} s: {round(fps * duration)} frames")
+    print(f"{'interval':>9} {'snapshots':>10} {'history MB':>11} "
+          f"{'hermite (AU)':>13} {'linear (AU)':>12}")
+    for output_interval in output_intervals:
+        stride: int = round(output_interval / time_step)
+        sparse: tuple[np.ndarray, ...] = (
+            times[::stride], positions[::stride], velocities[::stride])
+        frame_times, frame_positions = schedule_frames(
+            *sparse, fps, duration)
+        reference: np.ndarray = linear_frames(frame_times, times, positions)
+        hermite: float = np.max(np.abs(frame_positions - reference))
+        linear: float = np.max(np.abs(
+            linear_frames(frame_times, sparse[0], sparse[1]) - reference))
+        history_mb: float = 2 * sparse[1].nbytes / 2**20
+        print(f"{output_interval:>9.2f} {len(sparse[0]):>10} "
+              f"{history_mb:>11.2f} {hermite:>13.2e} {linear:>12.2e}")
+
+
+# %% [markdown]
+# ## Animation: frames interpolated from sparse outputs
+# 20 seconds at 30 fps of the 3-year false_stability run.
+
+# %%
+benchmark_frame_scheduler(30, 20, [1.0, 3.65, 10.0])
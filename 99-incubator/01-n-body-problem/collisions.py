@@ -0,0 +1,178 @@
+import numpy as np
+from grid import MAX_DEPTH, cell_keys, expand_ranges
+
+# Offsets from a cell to itself and half of its 26 neighbours (the
+# lexicographically larger ones), so each pair of cells is visited once
+HALF_NEIGHBOURS: np.ndarray = np.array([
+    (i, j, k)
+    for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1)
+])[13:]
+
+
+def find_collisions(
+    positions: np.ndarray, radii: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """Find the pairs of bodies whose spheres overlap.
+
+    The bodies are binned into a uniform grid of cells at least as wide
+    as the largest diameter, so two touching bodies are in the same or
+    in adjacent cells. The cells are found by binary search in the
+    sorted cell keys: O(N log N) while the cells hold few bodies,
+    instead of the O(N^2) distance matrix.
+
+    Args:
+        positions (np.ndarray): Positions, shape (N, 3).
+        radii (np.ndarray): Physical radii, shape (N,).
+
+    Returns:
+        tuple: (pair_i, pair_j) of the colliding pairs, with i < j
+    """
+    empty: np.ndarray = np.empty(0, dtype=np.intp)
+    if len(positions) < 2 or not np.any(radii > 0):
+        return empty, empty
+
+    # Cells no smaller than the largest diameter, and at most
+    # 2^MAX_DEPTH per side so the keys fit in an int64
+    lower: np.ndarray = positions.min(axis=0)
+    extent: float = float(np.max(positions.max(axis=0) - lower))
+    cell_size: float = max(2.0 * float(radii.max()), extent / 2 ** MAX_DEPTH)
+    # One empty layer of cells on each side for the neighbour offsets
+    cells_per_side: int = int(extent / cell_size) + 3
+    coords: np.ndarray = (
+        (positions - lower) / cell_size).astype(np.int64) + 1
+
+    keys: np.ndarray = cell_keys(coords, cells_per_side)
+    order: np.ndarray = np.argsort(keys, kind="stable")
+    sorted_keys: np.ndarray = keys[order]
+
+    # Candidate pairs: each body against the bodies of its neighbour cells
+    pair_i: list[np.ndarray] = []
+    pair_j: list[np.ndarray] = []
+    for offset in HALF_NEIGHBOURS:
+        neighbour: np.ndarray = cell_keys(coords + offset, cells_per_side)
+        start: np.ndarray = np.searchsorted(sorted_keys, neighbour, "left")
+        end: np.ndarray = np.searchsorted(sorted_keys, neighbour, "right")
+        body, index = expand_ranges(start, end - start)
+        other: np.ndarray = order[index]
+        if not np.any(offset):
+            # Same cell: each pair once, and not a body with itself
+            keep: np.ndarray = body < other
+            body, other = body[keep], other[keep]
+        pair_i.append(body)
+        pair_j.append(other)
+
+    i: np.ndarray = np.concatenate(pair_i)
+    j: np.ndarray = np.concatenate(pair_j)
+    r_ij: np.ndarray = positions[i] - positions[j]
+    touching: np.ndarray = (
+        np.einsum("pk,pk->p", r_ij, r_ij) < (radii[i] + radii[j]) ** 2)
+    i, j = i[touching], j[touching]
+    return np.minimum(i, j), np.maximum(i, j)
+
+
+def cluster_labels(
+    pair_i: np.ndarray, pair_j: np.ndarray, num_bodies: int
+) -> np.ndarray:
+    """Group the bodies linked by collisions (connected components),
+    so that three or more bodies touching at once merge together.
+
+    Args:
+        pair_i (np.ndarray): First body of each colliding pair.
+        pair_j (np.ndarray): Second body of each colliding pair.
+        num_bodies (int): Number of bodies.
+
+    Returns:
+        np.ndarray: Smallest body index of the cluster of each body.
+    """
+    labels: np.ndarray = np.arange(num_bodies)
+    while True:
+        # Both ends of a pair take the smaller label, then each label
+        # jumps to the label of its label
+        lowest: np.ndarray = np.minimum(labels[pair_i], labels[pair_j])
+        new_labels: np.ndarray = labels.copy()
+        np.minimum.at(new_labels, pair_i, lowest)
+        np.minimum.at(new_labels, pair_j, lowest)
+        new_labels = new_labels[new_labels]
+        if np.array_equal(new_labels, labels):
+            return labels
+        labels = new_labels
+
+
+def merge_clusters(
+    labels: np.ndarray,
+    positions: np.ndarray,
+    velocities: np.ndarray,
+    masses: np.ndarray,
+    radii: np.ndarray,
+    massive: np.ndarray
+) -> tuple[np.ndarray, ...]:
+    """Merge each cluster of bodies into one, inelastically.
+
+    The merged body keeps the index of the most massive member and sits
+    at the center of mass, with the velocity of the center of mass, so
+    mass and linear momentum are conserved (the kinetic energy of the
+    relative motion is lost). Volumes add up: r^3 = sum(r_k^3).
+
+    Args:
+        labels (np.ndarray): Cluster of each body, see cluster_labels.
+        positions (np.ndarray): Positions, shape (N, 3).
+        velocities (np.ndarray): Velocities, shape (N, 3).
+        masses (np.ndarray): Masses, shape (N,).
+        radii (np.ndarray): Radii, shape (N,).
+        massive (np.ndarray): Which bodies are sources of gravity.
+
+    Returns:
+        tuple:
+        A tuple containing:
+            - keep: Indices of the surviving bodies, in order
+            - positions, velocities, masses, radii and massive of the
+              surviving bodies
+    """
+    n: int = len(labels)
+    _, cluster = np.unique(labels, return_inverse=True)
+    num_clusters: int = int(cluster.max()) + 1
+
+    # Most massive member of each cluster, lowest index on ties
+    ranking: np.ndarray = np.lexsort((np.arange(n), -masses, cluster))
+    survivor: np.ndarray = ranking[np.searchsorted(
+        cluster[ranking], np.arange(num_clusters))]
+    keep: np.ndarray = np.sort(survivor)
+    kept_cluster: np.ndarray = cluster[keep]
+
+    total_mass: np.ndarray = np.bincount(
+        cluster, weights=masses, minlength=num_clusters)
+    # Clusters of test particles only are averaged with equal weights
+    weights: np.ndarray = np.where(total_mass[cluster] > 0, masses, 1.0)
+    total_weight: np.ndarray = np.bincount(
+        cluster, weights=weights, minlength=num_clusters)
+
+    merged_positions: np.ndarray = np.empty((num_clusters, 3))
+    merged_velocities: np.ndarray = np.empty((num_clusters, 3))
+    for axis in range(3):
+        merged_positions[:, axis] = np.bincount(
+            cluster, weights=weights * positions[:, axis],
+            minlength=num_clusters) / total_weight
+        merged_velocities[:, axis] = np.bincount(
+            cluster, weights=weights * velocities[:, axis],
+            minlength=num_clusters) / total_weight
+    merged_radii: np.ndarray = np.cbrt(np.bincount(
+        cluster, weights=radii ** 3, minlength=num_clusters))
+    merged_massive: np.ndarray = np.bincount(
+        cluster, weights=massive.astype(float), minlength=num_clusters) > 0
+
+    # Bodies that did not collide are copied as they are (no rounding)
+    new_positions: np.ndarray = positions[keep]
+    new_velocities: np.ndarray = velocities[keep]
+    new_radii: np.ndarray = radii[keep]
+    new_massive: np.ndarray = massive[keep]
+    merged: np.ndarray = np.bincount(cluster)[kept_cluster] > 1
+    merged_cluster: np.ndarray = kept_cluster[merged]
+    new_positions[merged] = merged_positions[merged_cluster]
+    new_velocities[merged] = merged_velocities[merged_cluster]
+    new_radii[merged] = merged_radii[merged_cluster]
+    new_massive[merged] = merged_massive[merged_cluster]
+
+    return (
+        keep, new_positions, new_velocities, total_mass[kept_cluster],
+        new_radii, new_massive
+    )
@@ -0,0 +1,186 @@
+import numpy as np
+from pathlib import Path
+from typing import Callable, Iterator
+from n_body_system import NBodySystem, Snapshot
+
+
+class NBodyEnsemble(NBodySystem):
+    """A batch of copies of the same N-body system, stepped together.
+
+    Positions, velocities and accelerations have shape (B, N, 3) and the
+    direct force kernel broadcasts over the batch, so B copies cost one
+    set of NumPy calls per step instead of B. The integrators of
+    NBodySystem work unchanged on the batched arrays.
+
+    Attributes:
+        num_copies (int): Number of copies in the batch (B).
+        masses (np.ndarray): Masses of the bodies in each copy, (B, N).
+    """
+
+    def __init__(
+        self, positions: np.ndarray, velocities: np.ndarray,
+        masses: np.ndarray, G: float
+    ) -> None:
+        """
+        Args:
+            positions (np.ndarray): Positions, shape (B, N, 3).
+            velocities (np.ndarray): Velocities, shape (B, N, 3).
+            masses (np.ndarray): Masses, shape (N,) shared by all copies,
+                or (B, N).
+            G (float): Gravitational constant.
+        """
+        self.num_copies: int = len(positions)
+        super().__init__(
+            num_bodies=positions.shape[1],
+            positions=positions,
+            velocities=velocities,
+            masses=np.broadcast_to(masses, positions.shape[:2]).copy(),
+            G=G,
+        )
+
+    @classmethod
+    def from_system(
+        cls, system: NBodySystem, num_copies: int,
+        position_scale: float = 0.0, velocity_scale: float = 0.0,
+        seed: int | None = None
+    ) -> "NBodyEnsemble":
+        """Copies of a system with Gaussian perturbations of the
+        positions and velocities (e.g. for stability maps).
+
+        Args:
+            system (NBodySystem): The system to copy.
+            num_copies (int): Number of copies (B).
+            position_scale (float): Standard deviation of the position
+                perturbations.
+            velocity_scale (float): Standard deviation of the velocity
+                perturbations.
+            seed (int | None): Seed of the random perturbations.
+
+        Returns:
+            NBodyEnsemble: The perturbed copies.
+        """
+        rng: np.random.Generator = np.random.default_rng(seed)
+        shape: tuple[int, int, int] = (num_copies, system.num_bodies, 3)
+        return cls(
+            positions=system.positions + rng.normal(
+                0.0, position_scale, shape),
+            velocities=system.velocities + rng.normal(
+                0.0, velocity_scale, shape),
+            masses=system.masses,
+            G=system.G,
+        )
+
+    def recenter_com_to_origin(self) -> None:
+        """Shift each copy so its Center of Mass is at (0,0,0)
+        with zero momentum."""
+        weights: np.ndarray = (
+            self.masses / np.sum(self.masses, axis=1, keepdims=True))
+        self.positions -= np.einsum("bi,bik->bk", weights, self.positions)[
+            :, np.newaxis, :]
+        self.velocities -= np.einsum(
+            "bi,bik->bk", weights, self.velocities)[:, np.newaxis, :]
+
+    def _allocate_workspace(self) -> None:
+        """Allocate the (B, N, N) buffers of the batched direct kernel."""
+        if self.force_backend != "direct":
+            raise ValueError(
+                f"Unsupported force backend for an ensemble: "
+                f"{self.force_backend}")
+
+        # Mixed precision has no batched kernel
+        self._set_precision(mixed_backends=())
+        b: int = self.num_copies
+        n: int = self.num_bodies
+        self.accelerations = np.zeros((b, n, 3))
+        self._r_ij: np.ndarray = np.empty((b, n, n, 3))
+        self._r_norm: np.ndarray = np.empty((b, n, n))
+        self._inv_r_cubed: np.ndarray = np.empty((b, n, n))
+        self._diagonal: np.ndarray = np.arange(n)
+        self._force_kernel = self._calculate_accelerations_batched
+
+    def _calculate_accelerations_batched(self) -> None:
+        """Calculate the gravitational acceleration of each body in each
+        copy: the direct kernel with a leading batch axis."""
+        r_ij: np.ndarray = self._r_ij
+        r_norm: np.ndarray = self._r_norm
+        inv_r_cubed: np.ndarray = self._inv_r_cubed
+
+        # r_ij = r_i - r_j [shape: (B, N, N, 3)]
+        np.subtract(
+            self.positions[:, :, np.newaxis, :],
+            self.positions[:, np.newaxis, :, :],
+            out=r_ij
+        )
+        np.einsum("bijk,bijk->bij", r_ij, r_ij, out=r_norm)
+        np.sqrt(r_norm, out=r_norm)
+        r_norm[:, self._diagonal, self._diagonal] = np.inf
+
+        # m_i / r^3
+        np.multiply(r_norm, r_norm, out=inv_r_cubed)
+        inv_r_cubed *= r_norm
+        np.divide(
+            self.masses[:, :, np.newaxis], inv_r_cubed, out=inv_r_cubed)
+
+        # a_j = G * sum_i(m_i / r^3 * r_ij)
+        np.einsum(
+            "bij,bijk->bjk", inv_r_cubed, r_ij, out=self.accelerations)
+        self.accelerations *= self.G
+
+    def iter_run(
+        self,
+        time_frame: float,
+        time_step: float,
+        output_interval: float,
+        integrator: str = "euler_cromer",
+        tolerance: float = 1e-9,
+        checkpoint_path: str | Path | None = None,
+        checkpoint_interval: float | None = None
+    ) -> Iterator[Snapshot]:
+        """Run every copy lazily, see NBodySystem.iter_run.
+
+        The fixed step integrators are supported; 'wisdom_holman' and
+        'rk45' are not, since the copies would need different central
+        bodies or step sizes. Neither are checkpoints.
+
+        Yields:
+            tuple: (positions, velocities, time), positions and
+            velocities of shape (B, N, 3)
+        """
+        if integrator in ("wisdom_holman", "rk45"):
+            raise ValueError(
+                f"Unsupported integrator for an ensemble: {integrator}")
+        if checkpoint_path is not None:
+            raise ValueError("Checkpoints are not supported for ensembles")
+        return super().iter_run(
+            time_frame, time_step, output_interval, integrator, tolerance)
+
+    def run(
+        self,
+        time_frame: float,
+        time_step: float,
+        output_interval: float,
+        integrator: str = "euler_cromer",
+        tolerance: float = 1e-9,
+        observer: Callable[[Snapshot], None] | None = None,
+        trajectory_path: str | Path | None = None
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Run every copy for a specified duration and return the history.
+
+        Same arguments as NBodySystem.run, with the integrators of
+        iter_run.
+
+        Returns:
+            tuple:
+            A tuple containing:
+                - position_history, shape (B, T, N, 3)
+                - velocity_history, shape (B, T, N, 3)
+                - time_history, shape (T,)
+        """
+        position_history, velocity_history, time_history = super().run(
+            time_frame, time_step, output_interval, integrator, tolerance,
+            observer, trajectory_path)
+        return (
+            np.moveaxis(position_history, 1, 0),
+            np.moveaxis(velocity_history, 1, 0),
+            time_history
+        )
@@ -0,0 +1,462 @@
+import math
+from functools import lru_cache
+import numpy as np
+from barnes_hut import add_point_masses
+from grid import MAX_DEPTH, cell_keys, expand_ranges
+
+# Cell offsets between a cell and its neighbours (near field)
+_NEIGHBOUR_OFFSETS: np.ndarray = np.array(
+    [(x, y, z) for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1)])
+# Offsets that can appear in an interaction list: children of the
+# parent's neighbours that are not neighbours themselves
+_INTERACTION_OFFSETS: np.ndarray = np.array(
+    [(x, y, z)
+     for x in range(-3, 4) for y in range(-3, 4) for z in range(-3, 4)
+     if max(abs(x), abs(y), abs(z)) > 1])
+# Position of a child inside its parent (0 or 1 on each axis)
+_OCTANTS: np.ndarray = np.array(
+    [(x, y, z) for x in (0, 1) for y in (0, 1) for z in (0, 1)])
+
+
+class ExpansionTables:
+    """Index tables for Cartesian Taylor expansions up to a given order.
+
+    Coefficients are stored as rows over the multi-indices
+    alpha = (a, b, c) with a + b + c <= order.
+
+    Attributes:
+        order (int): Expansion order p.
+        multi_indices (np.ndarray): The multi-indices, shape (K, 3).
+    """
+
+    def __init__(self, order: int) -> None:
+        self.order: int = order
+        self.multi_indices: np.ndarray = np.array(
+            [(a, b, n - a - b)
+             for n in range(order + 1)
+             for a in range(n, -1, -1)
+             for b in range(n - a, -1, -1)])
+        size: int = len(self.multi_indices)
+        index: dict[tuple[int, int, int], int] = {
+            tuple(alpha): k for k, alpha in enumerate(self.multi_indices)}
+
+        # Shift (M2M, L2L): S[alpha, gamma] = C(alpha, gamma) d^(alpha-gamma)
+        shift: list[tuple[int, int, float, int]] = []
+        # M2L: Q[beta, alpha] = C(alpha + beta, beta) T_(alpha+beta)
+        m2l: list[tuple[int, int, float, int]] = []
+        for k, alpha in enumerate(self.multi_indices):
+            for j, other in enumerate(self.multi_indices):
+                if np.all(other <= alpha):
+                    shift.append((
+                        k, j, _multi_binomial(alpha, other),
+                        index[tuple(alpha - other)]))
+                if sum(alpha) + sum(other) <= order:
+                    m2l.append((
+                        k, j, _multi_binomial(alpha + other, alpha),
+                        index[tuple(alpha + other)]))
+        self._shift: tuple[np.ndarray, ...] = _columns(shift)
+        self._m2l: tuple[np.ndarray, ...] = _columns(m2l)
+
+        # Recurrence for the Taylor coefficients of 1/r, by degree n:
+        # n r^2 T_g + (2n - 1) sum_i R_i T_(g-e_i)
+        #   + (n - 1) sum_i T_(g-2e_i) = 0
+        self._recurrence: list[tuple] = []
+        for k, gamma in enumerate(self.multi_indices[1:], start=1):
+            first: list[tuple[int, int]] = []
+            second: list[int] = []
+            for axis in range(3):
+                step: np.ndarray = np.eye(3, dtype=int)[axis]
+                if gamma[axis] >= 1:
+                    first.append((axis, index[tuple(gamma - step)]))
+                if gamma[axis] >= 2:
+                    second.append(index[tuple(gamma - 2 * step)])
+            self._recurrence.append((k, int(sum(gamma)), first, second))
+
+        # Gradient of sum_b L_b d^b along each axis:
+        # sum_b L_b b_i d^(b-e_i)
+        self.gradient: np.ndarray = np.zeros((3, size, size))
+        for k, beta in enumerate(self.multi_indices):
+            for axis in range(3):
+                if beta[axis] >= 1:
+                    lower: np.ndarray = beta - np.eye(3, dtype=int)[axis]
+                    self.gradient[axis, k, index[tuple(lower)]] = beta[axis]
+
+    @property
+    def size(self) -> int:
+        """Number of coefficients K."""
+        return len(self.multi_indices)
+
+    def monomials(self, d: np.ndarray) -> np.ndarray:
+        """d^alpha for every multi-index, shape (B, K)."""
+        powers: np.ndarray = d[:, :, np.newaxis] ** np.arange(self.order + 1)
+        return (
+            powers[:, 0, self.multi_indices[:, 0]]
+            * powers[:, 1, self.multi_indices[:, 1]]
+            * powers[:, 2, self.multi_indices[:, 2]])
+
+    def shift_matrix(self, d: np.ndarray) -> np.ndarray:
+        """Matrix moving multipoles by d (M_new = S @ M), shape (K, K).
+        Its transpose moves local expansions by d."""
+        rows, cols, coefficients, powers = self._shift
+        matrix: np.ndarray = np.zeros((self.size, self.size))
+        matrix[rows, cols] = (
+            coefficients * self.monomials(d[np.newaxis, :])[0, powers])
+        return matrix
+
+    def taylor_inverse_distance(self, r: np.ndarray) -> np.ndarray:
+        """Taylor coefficients T_g = d^g(1/|r|)/g! for each r, (B, K)."""
+        r_sq: np.ndarray = np.einsum("bk,bk->b", r, r)
+        taylor: np.ndarray = np.empty((len(r), self.size))
+        taylor[:, 0] = 1.0 / np.sqrt(r_sq)
+        for k, degree, first, second in self._recurrence:
+            total: np.ndarray = np.zeros(len(r))
+            for axis, lower in first:
+                total += (2 * degree - 1) * r[:, axis] * taylor[:, lower]
+            for lower in second:
+                total += (degree - 1) * taylor[:, lower]
+            taylor[:, k] = -total / (degree * r_sq)
+        return taylor
+
+    def m2l_matrices(self, r: np.ndarray) -> np.ndarray:
+        """Matrices turning multipoles about c into local coefficients
+        about z = c + r (L = Q @ M, without -G), shape (B, K, K)."""
+        rows, cols, coefficients, orders = self._m2l
+        taylor: np.ndarray = self.taylor_inverse_distance(r)
+        matrices: np.ndarray = np.zeros((len(r), self.size, self.size))
+        matrices[:, rows, cols] = coefficients * taylor[:, orders]
+        return matrices
+
+
+def _multi_binomial(alpha: np.ndarray, beta: np.ndarray) -> float:
+    """Product of binomial coefficients C(alpha_i, beta_i)."""
+    return float(np.prod([math.comb(int(a), int(b))
+                          for a, b in zip(alpha, beta)]))
+
+
+def _columns(entries: list[tuple]) -> tuple[np.ndarray, ...]:
+    """Transpose a list of (row, col, coefficient, index) tuples."""
+    rows, cols, coefficients, indices = zip(*entries)
+    return (np.array(rows), np.array(cols),
+            np.array(coefficients), np.array(indices))
+
+
+@lru_cache(maxsize=4)
+def get_expansion_tables(order: int) -> ExpansionTables:
+    """Expansion tables, cached per order."""
+    return ExpansionTables(order)
+
+
+class _GridLevel:
+    """Occupied cells of one grid level, for one set of points.
+
+    Attributes:
+        coords (np.ndarray): Integer cell coordinates, shape (C, 3).
+        keys (np.ndarray): Sorted cell keys, shape (C,).
+        points (np.ndarray): Points that reach this level.
+        point_cell (np.ndarray): Cell of each of those points.
+        count (np.ndarray): Number of points in each cell.
+        split (np.ndarray): Which cells have children at the next level.
+    """
+
+    def __init__(
+        self, coords: np.ndarray, points: np.ndarray, level: int
+    ) -> None:
+        point_coords: np.ndarray = coords[points] >> (MAX_DEPTH - level)
+        keys: np.ndarray = cell_keys(point_coords, 2 ** level)
+        self.keys, first_point, self.point_cell = np.unique(
+            keys, return_index=True, return_inverse=True)
+        self.coords: np.ndarray = point_coords[first_point]
+        self.points: np.ndarray = points
+        self.count: np.ndarray = np.bincount(
+            self.point_cell, minlength=len(self.keys))
+        self.split: np.ndarray = np.zeros(len(self.keys), dtype=bool)
+        # Points grouped by cell
+        self._order: np.ndarray = points[np.argsort(
+            self.point_cell, kind="stable")]
+        self._start: np.ndarray = np.cumsum(self.count) - self.count
+
+    def find(self, coords: np.ndarray, cells_per_side: int) -> np.ndarray:
+        """Index of the cell at each coordinate, or -1 if empty."""
+        if len(self.keys) == 0:
+            return np.full(len(coords), -1)
+        inside: np.ndarray = np.all(
+            (coords >= 0) & (coords < cells_per_side), axis=1)
+        keys: np.ndarray = cell_keys(
+            np.clip(coords, 0, cells_per_side - 1), cells_per_side)
+        found: np.ndarray = np.minimum(
+            np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return np.where(inside & (self.keys[found] == keys), found, -1)
+
+    def members(self, cells: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Points of the given cells.
+
+        Returns:
+            tuple: (owner, point), owner being the position in cells of
+            the cell each point came from
+        """
+        owner, slot = expand_ranges(self._start[cells], self.count[cells])
+        return owner, self._order[slot]
+
+    def continuing(self) -> np.ndarray:
+        """Points of the split cells, which go on to the next level."""
+        return self.points[self.split[self.point_cell]]
+
+
+def _build_levels(
+    target_coords: np.ndarray,
+    source_coords: np.ndarray,
+    leaf_size: int
+) -> tuple[list[_GridLevel], list[_GridLevel]]:
+    """Adaptive octree, from level 2 down: a source cell is split while
+    it holds more than leaf_size sources, and a target cell while one of
+    its neighbours (or itself) is a split source cell. So a split source
+    cell only ever meets target cells of its own size, and leaves sit
+    deeper where the sources are denser.
+
+    Args:
+        target_coords (np.ndarray): Finest grid cell of each target.
+        source_coords (np.ndarray): Finest grid cell of each source.
+        leaf_size (int): Largest number of sources in a leaf.
+
+    Returns:
+        tuple: (target_levels, source_levels), the cells of levels 2, 3,
+        ... down to the deepest split
+    """
+    target_levels: list[_GridLevel] = []
+    source_levels: list[_GridLevel] = []
+    target_points: np.ndarray = np.arange(len(target_coords))
+    source_points: np.ndarray = np.arange(len(source_coords))
+
+    for level in range(2, MAX_DEPTH + 1):
+        side: int = 2 ** level
+        sources_here: _GridLevel = _GridLevel(
+            source_coords, source_points, level)
+        targets_here: _GridLevel = _GridLevel(
+            target_coords, target_points, level)
+        if level < MAX_DEPTH:
+            sources_here.split = sources_here.count > leaf_size
+        for offset in _NEIGHBOUR_OFFSETS:
+            found: np.ndarray = sources_here.find(
+                targets_here.coords + offset, side)
+            targets_here.split |= np.where(
+                found >= 0, sources_here.split[found], False)
+        source_levels.append(sources_here)
+        target_levels.append(targets_here)
+
+        if not np.any(sources_here.split):
+            break
+        source_points = sources_here.continuing()
+        target_points = targets_here.continuing()
+
+    return target_levels, source_levels
+
+
+def fmm_accelerations(
+    targets: np.ndarray,
+    sources: np.ndarray,
+    masses: np.ndarray,
+    G: float,
+    order: int,
+    out: np.ndarray,
+    leaf_size: int = 32,
+    softening: float = 0.0,
+    direct_size: int = 8
+) -> None:
+    """Approximate the gravitational acceleration on each target with the
+    fast multipole method.
+
+    Space is split into an adaptive octree whose leaves hold at most
+    leaf_size sources (see _build_levels), so clustered bodies (a belt,
+    a dense core) get deeper leaves instead of crowded ones. Each cell's
+    sources are summarised by a Cartesian multipole expansion, converted
+    into local (Taylor) expansions for the well-separated cells of its
+    interaction list, and passed down to the targets. Targets interact
+    directly with the sources of the neighbouring leaves. Target leaves
+    also take the leaves of their interaction list that hold at most
+    direct_size sources directly: a few bodies off the center of their
+    cell (stars among massless dust) are poorly described by a low
+    order expansion about that center, and are cheap to sum. Cost is O(N)
+    for a bounded number of levels; the error falls roughly
+    geometrically with order. A target at zero distance from a source
+    (itself) feels nothing from it.
+
+    ref: L. Greengard, V. Rokhlin, J. Comput. Phys. 73 (1987) 325-348
+    ref: J. Carrier, L. Greengard, V. Rokhlin, SIAM J. Sci. Stat.
+    Comput. 9 (1988) 669-686
+
+    Args:
+        targets (np.ndarray): Positions to evaluate, shape (N, 3).
+        sources (np.ndarray): Positions of the sources, shape (M, 3).
+        masses (np.ndarray): Masses of the sources, shape (M,).
+        G (float): Gravitational constant.
+        order (int): Expansion order p.
+        out (np.ndarray): Accelerations of the targets, shape (N, 3).
+        leaf_size (int): Largest number of sources in a leaf.
+        softening (float): Plummer softening length, applied to the
+            direct sums only (well-separated cells are assumed to be
+            much farther apart than the softening length).
+        direct_size (int): Source leaves with at most this many sources
+            are summed directly into target leaves.
+    """
+    out[:] = 0.0
+    if len(sources) == 0 or len(targets) == 0:
+        return
+
+    tables: ExpansionTables = get_expansion_tables(order)
+
+    # Cubic bounding box of all points
+    everything: np.ndarray = np.concatenate([targets, sources])
+    lower: np.ndarray = everything.min(axis=0)
+    upper: np.ndarray = everything.max(axis=0)
+    extent: float = float(np.max(upper - lower))
+    if extent == 0.0:
+        # Every target sits on every source (e.g. a single body)
+        return
+    box_size: float = extent * 1.001
+    origin: np.ndarray = 0.5 * (lower + upper) - 0.5 * box_size
+
+    # Cell of each point on the finest grid; coarser levels by shifts
+    finest_side: int = 2 ** MAX_DEPTH
+    target_levels, source_levels = _build_levels(
+        np.clip(((targets - origin) * (finest_side / box_size)).astype(
+            np.int64), 0, finest_side - 1),
+        np.clip(((sources - origin) * (finest_side / box_size)).astype(
+            np.int64), 0, finest_side - 1),
+        leaf_size)
+    # Level of the first entry of the lists
+    top: int = 2
+
+    def cell_centers(coords: np.ndarray, level: int) -> np.ndarray:
+        return origin + (coords + 0.5) * (box_size / 2 ** level)
+
+    # --- Upward pass: multipoles, leaves to level 2 ---
+    multipoles: list[np.ndarray] = [np.empty(0)] * len(source_levels)
+    for index in range(len(source_levels) - 1, -1, -1):
+        level: int = top + index
+        cells: _GridLevel = source_levels[index]
+        # Sources of the leaves
+        in_leaf: np.ndarray = ~cells.split[cells.point_cell]
+        point: np.ndarray = cells.points[in_leaf]
+        point_cell: np.ndarray = cells.point_cell[in_leaf]
+        weighted: np.ndarray = tables.monomials(
+            cell_centers(cells.coords, level)[point_cell] - sources[point]
+        ) * masses[point, np.newaxis]
+        multipoles[index] = np.zeros((len(cells.keys), tables.size))
+        for k, column in enumerate(weighted.T):
+            multipoles[index][:, k] = np.bincount(
+                point_cell, weights=column, minlength=len(cells.keys))
+        if index == len(source_levels) - 1:
+            continue
+
+        # Children of the split cells
+        child: _GridLevel = source_levels[index + 1]
+        parent_index: np.ndarray = cells.find(
+            child.coords >> 1, 2 ** level)
+        octant: np.ndarray = _octant_of(child.coords)
+        child_size: float = box_size / 2 ** (level + 1)
+        for number, bits in enumerate(_OCTANTS):
+            chosen: np.ndarray = octant == number
+            if not np.any(chosen):
+                continue
+            # Parent center minus child center
+            matrix: np.ndarray = tables.shift_matrix((0.5 - bits) * child_size)
+            multipoles[index][parent_index[chosen]] += (
+                multipoles[index + 1][chosen] @ matrix.T)
+
+    def add_direct(
+        targets_here: _GridLevel, sources_here: _GridLevel,
+        target_cell: np.ndarray, source_cell: np.ndarray
+    ) -> None:
+        # Every target of each target cell ...
+        owner, target = targets_here.members(target_cell)
+        # ... against every source of the matching source cell
+        pair, source = sources_here.members(source_cell[owner])
+        target = target[pair]
+        r_ij: np.ndarray = sources[source] - targets[target]
+        r_sq: np.ndarray = np.einsum("pk,pk->p", r_ij, r_ij)
+        add_point_masses(
+            out, target, r_ij, r_sq, masses[source], G, softening)
+
+    # --- Multipole to local, on every level ---
+    locals_: list[np.ndarray] = [
+        np.zeros((len(cells.keys), tables.size)) for cells in target_levels]
+    for index, (targets_here, sources_here) in enumerate(
+            zip(target_levels, source_levels)):
+        side: int = 2 ** (top + index)
+        cell_size: float = box_size / side
+        # Source leaves summed directly into target leaves
+        small: np.ndarray = (
+            ~sources_here.split & (sources_here.count <= direct_size))
+        # R = target center - source center = -offset * cell_size
+        matrices: np.ndarray = tables.m2l_matrices(
+            -_INTERACTION_OFFSETS * cell_size)
+        target_parent: np.ndarray = targets_here.coords >> 1
+
+        for offset, matrix in zip(_INTERACTION_OFFSETS, matrices):
+            source_coords: np.ndarray = targets_here.coords + offset
+            source_index: np.ndarray = sources_here.find(source_coords, side)
+            # Only cells whose parents are neighbours
+            linked: np.ndarray = (source_index >= 0) & np.all(
+                np.abs((source_coords >> 1) - target_parent) <= 1, axis=1)
+            direct: np.ndarray = linked & ~targets_here.split & np.where(
+                source_index >= 0, small[source_index], False)
+            if np.any(direct):
+                add_direct(
+                    targets_here, sources_here, np.flatnonzero(direct),
+                    source_index[direct])
+                linked &= ~direct
+            if not np.any(linked):
+                continue
+            locals_[index][linked] += (
+                multipoles[index][source_index[linked]] @ matrix.T)
+
+    # --- Downward pass: locals, level 2 to the leaves ---
+    for index in range(len(target_levels) - 1):
+        level = top + index
+        child = target_levels[index + 1]
+        parent_index = target_levels[index].find(
+            child.coords >> 1, 2 ** level)
+        octant = _octant_of(child.coords)
+        child_size = box_size / 2 ** (level + 1)
+        for number, bits in enumerate(_OCTANTS):
+            chosen = octant == number
+            if not np.any(chosen):
+                continue
+            # Child center minus parent center
+            matrix = tables.shift_matrix((bits - 0.5) * child_size)
+            locals_[index + 1][chosen] += (
+                locals_[index][parent_index[chosen]] @ matrix)
+
+    for index, (targets_here, sources_here) in enumerate(
+            zip(target_levels, source_levels)):
+        level = top + index
+
+        # --- Local expansions to the targets of the leaves (far field) ---
+        in_leaf = ~targets_here.split[targets_here.point_cell]
+        point = targets_here.points[in_leaf]
+        point_cell = targets_here.point_cell[in_leaf]
+        leaf_locals: np.ndarray = locals_[index][point_cell]
+        offsets: np.ndarray = tables.monomials(
+            targets[point]
+            - cell_centers(targets_here.coords, level)[point_cell])
+        for axis in range(3):
+            # a = -grad(phi), with phi = -G * sum_b L_b d^b
+            out[point, axis] += G * np.einsum(
+                "tk,tk->t", leaf_locals @ tables.gradient[axis], offsets)
+
+        # --- Source leaves next to a target cell (near field) ---
+        # Split source cells are reached through their children instead
+        for offset in _NEIGHBOUR_OFFSETS:
+            source_cell: np.ndarray = sources_here.find(
+                targets_here.coords + offset, 2 ** level)
+            target_cell: np.ndarray = np.flatnonzero(
+                (source_cell >= 0) & ~sources_here.split[source_cell])
+            add_direct(
+                targets_here, sources_here, target_cell,
+                source_cell[target_cell])
+
+
+def _octant_of(coords: np.ndarray) -> np.ndarray:
+    """Number (0-7) of the child octant of each cell inside its parent."""
+    bits: np.ndarray = coords & 1
+    return bits[:, 0] * 4 + bits[:, 1] * 2 + bits[:, 2]
@@ -0,0 +1,55 @@
+import numpy as np
+
+
+def schedule_frames(
+    times: np.ndarray,
+    positions: np.ndarray,
+    velocities: np.ndarray,
+    fps: float,
+    duration: float
+) -> tuple[np.ndarray, np.ndarray]:
+    """Positions of the frames of a video of given fps and duration,
+    spread evenly over the simulated time and interpolated between the
+    stored snapshots.
+
+    Each frame uses cubic Hermite interpolation on the snapshots around
+    it: positions and velocities at both ends, so the motion is smooth
+    (continuous velocity) even when the snapshots are far apart. The
+    run can then keep a sparse output_interval, and the video any frame
+    rate.
+
+    Args:
+        times (np.ndarray): Time of each snapshot, increasing, (T,).
+        positions (np.ndarray): Position history, (T, N, 3). May be
+            memory-mapped: only the snapshots around the frames are read.
+        velocities (np.ndarray): Velocity history, (T, N, 3).
+        fps (float): Frames per second of the video.
+        duration (float): Length of the video in seconds.
+
+    Returns:
+        tuple:
+        A tuple containing:
+            - frame_times: Simulated time of each frame, (F,), from the
+              first to the last snapshot
+            - frame_positions: Positions at those times, (F, N, 3)
+    """
+    num_frames: int = max(2, round(fps * duration))
+    frame_times: np.ndarray = np.linspace(times[0], times[-1], num_frames)
+
+    # Snapshot interval [k, k + 1] of each frame
+    k: np.ndarray = np.clip(
+        np.searchsorted(times, frame_times, "right") - 1, 0, len(times) - 2)
+    step: np.ndarray = (times[k + 1] - times[k])[:, np.newaxis, np.newaxis]
+    s: np.ndarray = (
+        frame_times - times[k])[:, np.newaxis, np.newaxis] / step
+    s2: np.ndarray = s * s
+    s3: np.ndarray = s2 * s
+
+    # Cubic Hermite basis functions
+    frame_positions: np.ndarray = (
+        (2 * s3 - 3 * s2 + 1) * positions[k]
+        + (s3 - 2 * s2 + s) * step * velocities[k]
+        + (-2 * s3 + 3 * s2) * positions[k + 1]
+        + (s3 - s2) * step * velocities[k + 1]
+    )
+    return frame_times, frame_positions
@@ -0,0 +1,33 @@
+import numpy as np
+
+# Grids are at most 2^MAX_DEPTH cells per side, so cell keys fit in an
+# int64 (3 coordinates x 20 bits) and trees built on them cannot recurse
+# forever on coincident points
+MAX_DEPTH: int = 20
+
+
+def cell_keys(coords: np.ndarray, cells_per_side: int) -> np.ndarray:
+    """Unique int64 key of each integer cell coordinate, shape (C, 3)."""
+    return (coords[:, 0] * cells_per_side + coords[:, 1]) \
+        * cells_per_side + coords[:, 2]
+
+
+def expand_ranges(
+    starts: np.ndarray, counts: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """Expand ranges [start, start + count) into flat index arrays.
+
+    Args:
+        starts (np.ndarray): First index of each range.
+        counts (np.ndarray): Length of each range.
+
+    Returns:
+        tuple:
+        A tuple containing:
+            - owner: Position of the range each index came from
+            - index: The expanded indices
+    """
+    owner: np.ndarray = np.repeat(np.arange(len(counts)), counts)
+    offsets: np.ndarray = np.arange(len(owner)) - np.repeat(
+        np.cumsum(counts) - counts, counts)
+    return owner, np.repeat(starts, counts) + offsets
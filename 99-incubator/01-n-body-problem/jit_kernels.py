@@ -0,0 +1,125 @@
+import numpy as np
+from typing import Callable
+
+# Numba is optional: without it the kernels below stay plain Python
+# (far too slow to use) and NBodySystem keeps to its NumPy steppers
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+JIT_AVAILABLE: bool = njit is not None
+
+
+def _jit(function: Callable) -> Callable:
+    """Compile a kernel with Numba when it is installed."""
+    if njit is None:
+        return function
+    return njit(cache=True)(function)
+
+
+@_jit
+def accelerations_kernel(
+    positions: np.ndarray, masses: np.ndarray, G: float,
+    softening_sq: float, out: np.ndarray
+) -> None:
+    """Direct sum over unique pairs, one scalar loop (no temporaries).
+
+    Args:
+        positions (np.ndarray): Positions, shape (N, 3).
+        masses (np.ndarray): Masses, shape (N,). Zero for test particles.
+        G (float): Gravitational constant.
+        softening_sq (float): Squared softening length.
+        out (np.ndarray): Accelerations, shape (N, 3).
+    """
+    n: int = positions.shape[0]
+    out[:, :] = 0.0
+    for i in range(n):
+        for j in range(i + 1, n):
+            dx: float = positions[j, 0] - positions[i, 0]
+            dy: float = positions[j, 1] - positions[i, 1]
+            dz: float = positions[j, 2] - positions[i, 2]
+            r_sq: float = dx * dx + dy * dy + dz * dz + softening_sq
+            inv_r_cubed: float = 1.0 / (r_sq * np.sqrt(r_sq))
+            pull_to_j: float = masses[j] * inv_r_cubed
+            pull_to_i: float = masses[i] * inv_r_cubed
+            out[i, 0] += pull_to_j * dx
+            out[i, 1] += pull_to_j * dy
+            out[i, 2] += pull_to_j * dz
+            out[j, 0] -= pull_to_i * dx
+            out[j, 1] -= pull_to_i * dy
+            out[j, 2] -= pull_to_i * dz
+    for i in range(n):
+        for k in range(3):
+            out[i, k] *= G
+
+
+@_jit
+def euler_cromer_steps(
+    positions: np.ndarray, velocities: np.ndarray,
+    accelerations: np.ndarray, masses: np.ndarray, G: float,
+    softening_sq: float, dt: float, num_steps: int
+) -> None:
+    """Advance num_steps Euler-Cromer steps in place, in one call.
+
+    Args:
+        positions (np.ndarray): Positions, shape (N, 3).
+        velocities (np.ndarray): Velocities, shape (N, 3).
+        accelerations (np.ndarray): Buffer for the accelerations.
+        masses (np.ndarray): Masses, shape (N,).
+        G (float): Gravitational constant.
+        softening_sq (float): Squared softening length.
+        dt (float): Time step.
+        num_steps (int): Number of steps.
+    """
+    n: int = positions.shape[0]
+    for _ in range(num_steps):
+        accelerations_kernel(
+            positions, masses, G, softening_sq, accelerations)
+        for i in range(n):
+            for k in range(3):
+                velocities[i, k] += accelerations[i, k] * dt
+                positions[i, k] += velocities[i, k] * dt
+
+
+@_jit
+def leapfrog_steps(
+    positions: np.ndarray, velocities: np.ndarray,
+    accelerations: np.ndarray, masses: np.ndarray, G: float,
+    softening_sq: float, dt: float, num_steps: int
+) -> None:
+    """Advance num_steps kick-drift-kick leapfrog steps in place, in one
+    call. Expects the accelerations to match the current positions,
+    and leaves them matching the new positions.
+
+    Args:
+        positions (np.ndarray): Positions, shape (N, 3).
+        velocities (np.ndarray): Velocities, shape (N, 3).
+        accelerations (np.ndarray): Accelerations, shape (N, 3).
+        masses (np.ndarray): Masses, shape (N,).
+        G (float): Gravitational constant.
+        softening_sq (float): Squared softening length.
+        dt (float): Time step.
+        num_steps (int): Number of steps.
+    """
+    n: int = positions.shape[0]
+    half_dt: float = 0.5 * dt
+    for _ in range(num_steps):
+        for i in range(n):
+            for k in range(3):
+                velocities[i, k] += accelerations[i, k] * half_dt  # Kick
+                positions[i, k] += velocities[i, k] * dt           # Drift
+        accelerations_kernel(
+            positions, masses, G, softening_sq, accelerations)
+        for i in range(n):
+            for k in range(3):
+                velocities[i, k] += accelerations[i, k] * half_dt  # Kick
+
+
+# Fused multi-step kernels, by integrator name
+FUSED_STEPPERS: dict[str, Callable[..., None]] = {
+    "euler_cromer": euler_cromer_steps,
+    "leapfrog": leapfrog_steps,
+    # Same trajectory as leapfrog, see NBodySystem._step_velocity_verlet
+    "velocity_verlet": leapfrog_steps,
+}
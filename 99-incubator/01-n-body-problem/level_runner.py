@@ -0,0 +1,186 @@
+import os
+import random
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from level_gen import LevelGenerator
+from n_body_system import NBodySystem
+
+# Shared memory block of the results, attached once per worker process
+_shared_block: shared_memory.SharedMemory | None = None
+
+
+def _attach_shared_block(name: str) -> None:
+    """Worker initializer: attach the shared results block."""
+    global _shared_block
+    _shared_block = shared_memory.SharedMemory(name=name)
+
+
+def _history_views(
+    buffer: memoryview, offset: int, capacity: int, num_bodies: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Views of the position, velocity and time history of one level
+    inside the shared block, starting at float offset."""
+    size: int = capacity * num_bodies * 3
+    floats: np.ndarray = np.ndarray(
+        2 * size + capacity, dtype=np.float64, buffer=buffer,
+        offset=offset * 8)
+    return (
+        floats[:size].reshape(capacity, num_bodies, 3),
+        floats[size:2 * size].reshape(capacity, num_bodies, 3),
+        floats[2 * size:]
+    )
+
+
+def _run_level(task: tuple) -> tuple[int, int, int, float]:
+    """Worker: run one level and write its history to shared memory.
+
+    Returns:
+        tuple:
+        A tuple containing:
+            - index of the level
+            - worker process id
+            - number of snapshots written
+            - run time in seconds
+    """
+    index, positions, velocities, masses, G, offset, capacity, options = (
+        task)
+    system: NBodySystem = NBodySystem(
+        len(masses), positions, velocities, masses, G)
+
+    start: float = time.perf_counter()
+    position_history, velocity_history, time_history = system.run(**options)
+    elapsed: float = time.perf_counter() - start
+
+    count: int = min(len(time_history), capacity)
+    positions_out, velocities_out, times_out = _history_views(
+        _shared_block.buf, offset, capacity, len(masses))
+    positions_out[:count] = position_history[:count]
+    velocities_out[:count] = velocity_history[:count]
+    times_out[:count] = time_history[:count]
+    return index, os.getpid(), count, elapsed
+
+
+def run_levels(
+    level_ids: list[str | int],
+    time_frame: float,
+    time_step: float,
+    output_interval: float,
+    integrator: str = "euler_cromer",
+    seeds: list[int] | None = None,
+    num_workers: int | None = None,
+    report: bool = True
+) -> list[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Run many levels in parallel, one level per task, across a pool of
+    worker processes.
+
+    The levels are generated here (seeding the random module first, if
+    seeds are given) and only their initial conditions are sent to the
+    workers. The workers write the histories into one shared memory
+    block, so no history array is pickled back.
+
+    Args:
+        level_ids (list): Level ids for LevelGenerator.generate_level,
+            scenario names or level numbers.
+        time_frame (float): The total duration of each run in days.
+        time_step (float): The integration time step (dt) in days.
+        output_interval (float): Save frequency in days.
+        integrator (str): Integration method, see NBodySystem.run.
+        seeds (list[int] | None): Seed of the random module before each
+            level is generated, for reproducible procedural levels.
+        num_workers (int | None): Number of processes, None for one per
+            core.
+        report (bool): Print the throughput of each worker.
+
+    Returns:
+        list:
+        (position_history, velocity_history, time_history) of each level,
+        in the order of level_ids.
+    """
+    generator: LevelGenerator = LevelGenerator()
+    systems: list[NBodySystem] = []
+    for i, level_id in enumerate(level_ids):
+        if seeds is not None:
+            random.seed(seeds[i])
+        system, _, _, _ = generator.generate_level(level_id)
+        systems.append(system)
+
+    capacity: int = NBodySystem.count_snapshots(
+        time_frame, time_step, output_interval, integrator)
+    sizes: list[int] = [
+        capacity * (2 * system.num_bodies * 3 + 1) for system in systems]
+    offsets: np.ndarray = np.cumsum([0] + sizes)
+    options: dict = {
+        "time_frame": time_frame,
+        "time_step": time_step,
+        "output_interval": output_interval,
+        "integrator": integrator,
+    }
+    tasks: list[tuple] = [
+        (i, system.positions, system.velocities, system.masses, system.G,
+         int(offsets[i]), capacity, options)
+        for i, system in enumerate(systems)
+    ]
+
+    block: shared_memory.SharedMemory = shared_memory.SharedMemory(
+        create=True, size=max(int(offsets[-1]) * 8, 1))
+    try:
+        start: float = time.perf_counter()
+        with ProcessPoolExecutor(
+            max_workers=num_workers,
+            initializer=_attach_shared_block,
+            initargs=(block.name,)
+        ) as pool:
+            stats: list[tuple[int, int, int, float]] = list(
+                pool.map(_run_level, tasks))
+        wall_time: float = time.perf_counter() - start
+
+        # Copy the results out before the block is released
+        results: list[tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        for (i, _, count, _), system in zip(stats, systems):
+            position_history, velocity_history, time_history = (
+                _history_views(
+                    block.buf, int(offsets[i]), capacity, system.num_bodies))
+            results.append((
+                position_history[:count].copy(),
+                velocity_history[:count].copy(),
+                time_history[:count].copy()
+            ))
+            del position_history, velocity_history, time_history
+    finally:
+        block.close()
+        block.unlink()
+
+    if report:
+        num_steps: int = round(time_frame / time_step)
+        print_throughput(
+            stats, [num_steps * system.num_bodies for system in systems],
+            wall_time)
+    return results
+
+
+def print_throughput(
+    stats: list[tuple[int, int, int, float]],
+    body_steps: list[int],
+    wall_time: float
+) -> None:
+    """Print levels and body-steps per second of each worker process.
+
+    Args:
+        stats (list): (index, worker pid, snapshots, run time) per level.
+        body_steps (list): Number of steps times bodies of each level.
+        wall_time (float): Wall time of the whole pool in seconds.
+    """
+    workers: dict[int, list[float]] = {}
+    for index, pid, _, elapsed in stats:
+        levels, steps, busy = workers.get(pid, [0, 0, 0.0])
+        workers[pid] = [levels + 1, steps + body_steps[index], busy + elapsed]
+
+    print(f"{'worker':>8} {'levels':>7} {'busy (s)':>9} "
+          f"{'levels/s':>9} {'body-steps/s':>13}")
+    for pid, (levels, steps, busy) in sorted(workers.items()):
+        print(f"{pid:>8} {levels:>7} {busy:>9.2f} "
+              f"{levels / busy:>9.2f} {steps / busy:>13.0f}")
+    print(f"{len(stats)} levels on {len(workers)} workers in "
+          f"{wall_time:.2f} s ({len(stats) / wall_time:.2f} levels/s)")
@@ -1,4 +1,5 @@
 from n_body_system import NBodySystem
+from polyline import simplify_polyline
 from typing import List, Tuple
 import numpy as np
 import matplotlib.pyplot as plt
@@ -178,11 +179,40 @@ def set_3d_axes_equal(ax: plt.Axes) -> None:  # type: ignore
         [z_middle - plot_radius, z_middle + plot_radius])
 
 
+def _snapshots_to_draw(
+    sol_x: np.ndarray, fig: plt.Figure, num_dims: int, simplify: bool
+) -> list:
+    """
+    Snapshots to draw in the trajectory line of each body: all of them,
+    or with simplify those kept by Douglas-Peucker with a tolerance of
+    one pixel (the data extent across the figure's width in pixels).
+    Bodies are read one at a time.
+    """
+    num_bodies = sol_x.shape[1]
+    if not simplify:
+        return [slice(None)] * num_bodies
+
+    lower = np.full(num_dims, np.inf)
+    upper = np.full(num_dims, -np.inf)
+    for i in range(num_bodies):
+        body = np.asarray(sol_x[:, i, :num_dims])
+        lower = np.fmin(lower, np.nanmin(body, axis=0))
+        upper = np.fmax(upper, np.nanmax(body, axis=0))
+    pixels = max(fig.get_size_inches() * fig.dpi)
+    tolerance = float(np.max(upper - lower)) / pixels
+
+    return [
+        simplify_polyline(np.asarray(sol_x[:, i, :num_dims]), tolerance)
+        for i in range(num_bodies)
+    ]
+
+
 def plot_3d_trajectory(
     sol_x: np.ndarray,
     labels: list,
     colors: list,
     legend: bool,
+    simplify: bool = False,
 ) -> None:
     """
     Plot the 3D trajectory.
@@ -191,12 +221,18 @@ def plot_3d_trajectory(
     ----------
     sol_x : np.ndarray
         Solution position array with shape (N_steps, num_particles, 3).
+        May be memory-mapped (trajectory.Trajectory), it is then only
+        read one body at a time.
     labels : list
         List of labels for the particles.
     colors : list
         List of colors for the particles.
     legend : bool
         Whether to show the legend.
+    simplify : bool
+        Draw each trajectory through the fewest snapshots that keep it
+        within one pixel of the full line (Douglas-Peucker), so long
+        runs stay light to draw.
 
     Source
     ------
@@ -211,11 +247,12 @@ def plot_3d_trajectory(
     ax.set_ylabel("$y$ (AU)")
     ax.set_zlabel("$z$ (AU)")  # type: ignore
 
+    snapshots = _snapshots_to_draw(sol_x, fig, 3, simplify)
     for i in range(sol_x.shape[1]):
         traj = ax.plot(
-            sol_x[:, i, 0],
-            sol_x[:, i, 1],
-            sol_x[:, i, 2],
+            sol_x[snapshots[i], i, 0],
+            sol_x[snapshots[i], i, 1],
+            sol_x[snapshots[i], i, 2],
             color=colors[i],
         )
         # Plot the last position with marker
@@ -242,6 +279,7 @@ def plot_trajectory(
     labels: list,
     colors: list,
     legend: bool,
+    simplify: bool = False,
 ) -> None:
     """
     Plot the 2D trajectory.
@@ -250,12 +288,18 @@ def plot_trajectory(
     ----------
     sol_x : np.ndarray
         Solution position array with shape (N_steps, num_particles, 3).
+        May be memory-mapped (trajectory.Trajectory), it is then only
+        read one body at a time.
     labels : list
         List of labels for the particles.
     colors : list
         List of colors for the particles.
     legend : bool
         Whether to show the legend.
+    simplify : bool
+        Draw each trajectory through the fewest snapshots that keep it
+        within one pixel of the full line (Douglas-Peucker), so long
+        runs stay light to draw.
 
     Source
     ------
@@ -268,10 +312,11 @@ def plot_trajectory(
     ax.set_xlabel("$x$ (AU)")
     ax.set_ylabel("$y$ (AU)")
 
+    snapshots = _snapshots_to_draw(sol_x, fig, 2, simplify)
     for i in range(sol_x.shape[1]):
         traj = ax.plot(
-            sol_x[:, i, 0],
-            sol_x[:, i, 1],
+            sol_x[snapshots[i], i, 0],
+            sol_x[snapshots[i], i, 1],
             color=colors[i],
         )
         # Plot the last position with marker
@@ -1,4 +1,239 @@
+import json
+import math
+import os
+import weakref
+from pathlib import Path
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+from typing import Callable, Iterator
+from barnes_hut import barnes_hut_accelerations
+from collisions import cluster_labels, find_collisions, merge_clusters
+from fmm import fmm_accelerations
+from trajectory import Trajectory, TrajectoryWriter
+from jit_kernels import FUSED_STEPPERS, JIT_AVAILABLE
+
+# Leapfrog sub-step weights for Yoshida's symmetric compositions
+# ref: H. Yoshida, Phys. Lett. A 150 (1990) 262-268
+_CBRT_2: float = 2.0 ** (1.0 / 3.0)
+YOSHIDA_4_WEIGHTS: tuple[float, ...] = (
+    1.0 / (2.0 - _CBRT_2),
+    -_CBRT_2 / (2.0 - _CBRT_2),
+    1.0 / (2.0 - _CBRT_2),
+)
+# Solution A of the 6th order composition (7 sub-steps)
+_Y6: tuple[float, float, float] = (
+    0.784513610477560, 0.235573213359357, -1.17767998417887)
+YOSHIDA_6_WEIGHTS: tuple[float, ...] = (
+    _Y6[0], _Y6[1], _Y6[2], 1.0 - 2.0 * sum(_Y6), _Y6[2], _Y6[1], _Y6[0])
+
+# (positions, velocities, time) of one output of a run
+Snapshot = tuple[np.ndarray, np.ndarray, float]
+
+# Dormand-Prince 5(4) Butcher tableau
+# ref: J. R. Dormand, P. J. Prince, J. Comput. Appl. Math. 6 (1980) 19-26
+DORMAND_PRINCE_A: tuple[tuple[float, ...], ...] = (
+    (1 / 5,),
+    (3 / 40, 9 / 40),
+    (44 / 45, -56 / 15, 32 / 9),
+    (19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729),
+    (9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656),
+    # Last row is the 5th order solution (First Same As Last)
+    (35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84),
+)
+# Difference between the 5th and embedded 4th order weights
+DORMAND_PRINCE_ERROR: tuple[float, ...] = (
+    35 / 384 - 5179 / 57600,
+    0,
+    500 / 1113 - 7571 / 16695,
+    125 / 192 - 393 / 640,
+    -2187 / 6784 + 92097 / 339200,
+    11 / 84 - 187 / 2100,
+    -1 / 40,
+)
+
+# Stumpff series coefficients (1/(2k+2)!, 1/(2k+3)!), highest order first
+_STUMPFF_SERIES: tuple[tuple[float, float], ...] = tuple(
+    (1.0 / math.factorial(2 * k + 2), 1.0 / math.factorial(2 * k + 3))
+    for k in reversed(range(7))
+)
+
+
+def _stumpff(z: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Stumpff functions C(z) and S(z) used by the universal Kepler solver.
+
+    Args:
+        z (np.ndarray): alpha * chi^2 for each orbit.
+
+    Returns:
+        tuple: (C(z), S(z))
+    """
+    # Power series near z = 0 (parabolic) where the closed forms cancel
+    # C(z) = sum (-z)^k / (2k + 2)!,  S(z) = sum (-z)^k / (2k + 3)!
+    series_c: np.ndarray = np.zeros_like(z)
+    series_s: np.ndarray = np.zeros_like(z)
+    for coefficient_c, coefficient_s in _STUMPFF_SERIES:
+        series_c = series_c * -z + coefficient_c
+        series_s = series_s * -z + coefficient_s
+
+    # Closed forms, elliptic (z > 0) and hyperbolic (z < 0) orbits
+    root: np.ndarray = np.sqrt(np.abs(z))
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        closed_c: np.ndarray = np.where(
+            z > 0,
+            2.0 * np.sin(0.5 * root) ** 2 / z,
+            2.0 * np.sinh(0.5 * root) ** 2 / -z)
+        closed_s: np.ndarray = np.where(
+            z > 0,
+            (root - np.sin(root)) / root ** 3,
+            (np.sinh(root) - root) / root ** 3)
+
+    small: np.ndarray = np.abs(z) < 0.1
+    return (
+        np.where(small, series_c, closed_c),
+        np.where(small, series_s, closed_s)
+    )
+
+
+def _hermite_interpolate(
+    theta: float, dt: float,
+    positions: tuple[np.ndarray, np.ndarray],
+    velocities: tuple[np.ndarray, np.ndarray],
+    accelerations: tuple[np.ndarray, np.ndarray]
+) -> tuple[np.ndarray, np.ndarray]:
+    """Interpolate the state inside a step from its end points.
+
+    Positions use quintic Hermite (x, v, a at both ends) and velocities
+    cubic Hermite (v, a at both ends).
+
+    Args:
+        theta (float): Fraction of the step, between 0 and 1.
+        dt (float): Step length.
+        positions (tuple): Positions at the start and end of the step.
+        velocities (tuple): Velocities at the start and end of the step.
+        accelerations (tuple): Accelerations at the start and end.
+
+    Returns:
+        tuple: (positions, velocities) at start + theta * dt
+    """
+    t: float = theta
+    t2: float = t * t
+    t3: float = t2 * t
+    t4: float = t3 * t
+    t5: float = t4 * t
+
+    position: np.ndarray = (
+        (1 - 10 * t3 + 15 * t4 - 6 * t5) * positions[0]
+        + (t - 6 * t3 + 8 * t4 - 3 * t5) * dt * velocities[0]
+        + 0.5 * (t2 - 3 * t3 + 3 * t4 - t5) * dt * dt * accelerations[0]
+        + 0.5 * (t3 - 2 * t4 + t5) * dt * dt * accelerations[1]
+        + (-4 * t3 + 7 * t4 - 3 * t5) * dt * velocities[1]
+        + (10 * t3 - 15 * t4 + 6 * t5) * positions[1]
+    )
+    velocity: np.ndarray = (
+        (2 * t3 - 3 * t2 + 1) * velocities[0]
+        + (t3 - 2 * t2 + t) * dt * accelerations[0]
+        + (-2 * t3 + 3 * t2) * velocities[1]
+        + (t3 - t2) * dt * accelerations[1]
+    )
+    return position, velocity
+
+
+def _kepler_drift(
+    positions: np.ndarray, velocities: np.ndarray, mu: float, dt: float
+) -> tuple[np.ndarray, np.ndarray]:
+    """Propagate independent two-body orbits around a fixed centre
+    exactly, using universal variables and Lagrange f and g functions.
+
+    ref: H. D. Curtis, Orbital Mechanics for Engineering Students, ch. 3
+
+    Args:
+        positions (np.ndarray): Relative positions, shape (K, 3).
+        velocities (np.ndarray): Relative velocities, shape (K, 3).
+        mu (float): Gravitational parameter G * M of the centre.
+        dt (float): Time to propagate.
+
+    Returns:
+        tuple: (new_positions, new_velocities)
+    """
+    sqrt_mu: float = np.sqrt(mu)
+    r0: np.ndarray = np.linalg.norm(positions, axis=1)
+    rv0: np.ndarray = np.sum(positions * velocities, axis=1) / sqrt_mu
+    # Reciprocal of the semi-major axis (negative for hyperbolic orbits)
+    alpha: np.ndarray = 2.0 / r0 - np.sum(velocities ** 2, axis=1) / mu
+
+    # Solve the universal Kepler equation for chi with Newton's method
+    chi: np.ndarray = sqrt_mu * dt / r0
+    for _ in range(50):
+        z: np.ndarray = alpha * chi * chi
+        c, s = _stumpff(z)
+        chi_sq: np.ndarray = chi * chi
+        kepler: np.ndarray = (
+            rv0 * chi_sq * c + (1.0 - alpha * r0) * chi_sq * chi * s
+            + r0 * chi - sqrt_mu * dt)
+        # d(kepler)/d(chi) is the radius at the new position
+        radius: np.ndarray = (
+            rv0 * chi * (1.0 - z * s) + (1.0 - alpha * r0) * chi_sq * c + r0)
+        delta: np.ndarray = kepler / radius
+        chi -= delta
+        if np.all(np.abs(delta) <= 1e-14 * np.abs(chi)):
+            break
+
+    z = alpha * chi * chi
+    c, s = _stumpff(z)
+    chi_sq = chi * chi
+
+    # Lagrange coefficients
+    f: np.ndarray = 1.0 - chi_sq / r0 * c
+    g: np.ndarray = dt - chi_sq * chi / sqrt_mu * s
+    new_positions: np.ndarray = (
+        f[:, np.newaxis] * positions + g[:, np.newaxis] * velocities)
+
+    r: np.ndarray = np.linalg.norm(new_positions, axis=1)
+    f_dot: np.ndarray = sqrt_mu / (r * r0) * (alpha * chi_sq * chi * s - chi)
+    g_dot: np.ndarray = 1.0 - chi_sq / r * c
+    new_velocities: np.ndarray = (
+        f_dot[:, np.newaxis] * positions + g_dot[:, np.newaxis] * velocities)
+
+    return new_positions, new_velocities
+
+
+def _cache_size_bytes(level: int = 2, default: int = 1 << 20) -> int:
+    """Size of the CPU data cache at a given level, read from sysfs on
+    Linux, or the default when it cannot be found.
+
+    Args:
+        level (int): Cache level (1, 2 or 3).
+        default (int): Fallback size in bytes.
+
+    Returns:
+        int: Cache size in bytes.
+    """
+    units: dict[str, int] = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    for index in Path("/sys/devices/system/cpu/cpu0/cache").glob("index*"):
+        try:
+            if (int((index / "level").read_text()) != level
+                    or (index / "type").read_text().strip() == "Instruction"):
+                continue
+            size: str = (index / "size").read_text().strip()
+            return int(size[:-1]) * units[size[-1]]
+        except (OSError, ValueError, KeyError):
+            continue
+    return default
+
+
+@lru_cache(maxsize=8)
+def _pair_indices(num_bodies: int) -> tuple[np.ndarray, np.ndarray]:
+    """Indices (i, j) of every unique pair i < j, cached per N.
+
+    Args:
+        num_bodies (int): Number of bodies.
+
+    Returns:
+        tuple: (pair_i, pair_j), each of length N(N - 1)/2
+    """
+    pair_i, pair_j = np.triu_indices(num_bodies, k=1)
+    return pair_i, pair_j
 
 
 class NBodySystem:
@@ -11,18 +246,86 @@ class NBodySystem:
         accelerations (np.ndarray): Accelerations of bodies in 3D space.
         masses (np.ndarray): Masses of bodies.
         G (float): Gravitational constant.
+        force_backend (str): Force kernel used by the integrators.
+        theta (float): Barnes-Hut opening angle.
+        expansion_order (int): Fast multipole expansion order.
+        block_size (int | None): Tile edge of the blocked direct sum,
+            None to fit the tiles in the L2 cache.
+        num_threads (int | None): Worker threads of the threaded direct
+            sum, None for one per core. They run until close, or the end
+            of a with block on the system.
+        precision (str): 'double' for float64 everywhere, or 'mixed' for
+            float32 pairwise terms in the direct, blocked and threaded
+            kernels with compensated (Kahan) float64 position updates.
+            Halves the memory traffic of the (N, N) buffers.
+        massive (np.ndarray): Which bodies pull on the others (sources).
+            The rest are test particles: they feel gravity but exert
+            none. Defaults to the bodies with nonzero mass.
+        jit (bool): Run the blocks of steps between two outputs as one
+            compiled loop (see jit_kernels.py) for 'euler_cromer',
+            'leapfrog' and 'velocity_verlet' with the direct backend,
+            in double precision. Falls back to NumPy otherwise, and when
+            Numba is not installed.
+        softening (float): Plummer softening length eps: every pair
+            distance r is replaced by sqrt(r^2 + eps^2), which bounds
+            the acceleration in close encounters.
+        radii (np.ndarray | None): Physical radii. When given, bodies
+            whose spheres overlap after a step merge inelastically and
+            num_bodies shrinks (fixed step integrators only).
+        body_ids (np.ndarray): Original index of each body, to follow
+            the bodies through merges.
     """
 
     def __init__(
         self, num_bodies: int, positions: np.ndarray,
-        velocities: np.ndarray, masses: np.ndarray, G: float
+        velocities: np.ndarray, masses: np.ndarray, G: float,
+        force_backend: str = "direct", theta: float = 0.5,
+        expansion_order: int = 4, block_size: int | None = None,
+        massive: np.ndarray | None = None, jit: bool = False,
+        num_threads: int | None = None, precision: str = "double",
+        softening: float = 0.0, radii: np.ndarray | None = None
     ) -> None:
         self.num_bodies: int = num_bodies
         self.positions: np.ndarray = positions
         self.velocities: np.ndarray = velocities
-        self.accelerations: np.ndarray = np.zeros((num_bodies, num_bodies))
+        self.accelerations: np.ndarray = np.zeros((num_bodies, 3))
         self.masses: np.ndarray = masses
         self.G: float = G
+        self.force_backend: str = force_backend
+        self.theta: float = theta
+        self.expansion_order: int = expansion_order
+        self.block_size: int | None = block_size
+        self.num_threads: int | None = num_threads
+        self.precision: str = precision
+        self.massive: np.ndarray = (
+            masses > 0 if massive is None else np.asarray(massive, bool))
+        self.jit: bool = jit
+        self.softening: float = softening
+        self.radii: np.ndarray | None = (
+            None if radii is None else np.asarray(radii, float))
+        self.body_ids: np.ndarray = np.arange(num_bodies)
+        # Number of ids handed out, the width of the histories
+        self._num_ids: int = num_bodies
+        # Worker threads of the 'threaded' backend, started on first use
+        self._thread_pool: ThreadPoolExecutor | None = None
+        self._allocate_workspace()
+
+    def __enter__(self) -> "NBodySystem":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Stop the worker threads of the 'threaded' backend, if any.
+
+        The system stays usable: the threads start again on the next
+        force evaluation. Systems that are discarded without close stop
+        their threads when they are garbage collected.
+        """
+        if self._thread_pool is not None:
+            self._close_thread_pool()
+            self._thread_pool = None
 
     def recenter_com_to_origin(self) -> None:
         """Shift the system so:
@@ -38,39 +341,418 @@ class NBodySystem:
         self.positions -= center_of_mass_position
         self.velocities -= center_of_mass_velocity
 
+    def add_test_particles(
+        self, positions: np.ndarray, velocities: np.ndarray
+    ) -> None:
+        """Append massless test particles (e.g. probes) to the system.
+
+        They follow the gravity of the massive bodies without disturbing
+        them, so adding thousands costs O(N_massive) each per step.
+
+        Args:
+            positions (np.ndarray): Positions, shape (K, 3).
+            velocities (np.ndarray): Velocities, shape (K, 3).
+        """
+        count: int = len(positions)
+        self.positions = np.concatenate([self.positions, positions])
+        self.velocities = np.concatenate([self.velocities, velocities])
+        self.masses = np.concatenate([self.masses, np.zeros(count)])
+        self.massive = np.concatenate(
+            [self.massive, np.zeros(count, dtype=bool)])
+        if self.radii is not None:
+            self.radii = np.concatenate([self.radii, np.zeros(count)])
+        self.body_ids = np.concatenate([
+            self.body_ids,
+            np.arange(self._num_ids, self._num_ids + count)])
+        self._num_ids += count
+        self.num_bodies += count
+        self._allocate_workspace()
+
+    def _allocate_workspace(self) -> None:
+        """Select the force kernel and allocate its scratch buffers,
+        so that stepping does not create new arrays.
+
+        **Force backends:**
+        1. 'direct': Full (N, N) broadcast. Fastest for small N.
+        2. 'pairwise': Each unique pair once (Newton's third law).
+           Half the work and memory of 'direct'.
+        3. 'barnes_hut': Octree approximation, O(N log N), controlled
+           by theta. For large N.
+        4. 'fmm': Fast multipole method, O(N), controlled by
+           expansion_order. For very large N.
+        5. 'blocked': Exact direct sum over (block, block) tiles.
+           Memory O(block^2) instead of O(N^2).
+        6. 'threaded': Direct sum with the targets split across a pool
+           of threads. NumPy releases the GIL inside each call, so the
+           threads run on separate cores.
+        """
+        n: int = self.num_bodies
+        self.accelerations = np.zeros((n, 3))
+
+        # Sources: the massive bodies. Test particles only receive forces,
+        # so every kernel costs O(N_massive * N) instead of O(N^2)
+        self._sources: np.ndarray = np.flatnonzero(self.massive)
+        m: int = len(self._sources)
+        self._source_positions: np.ndarray = np.empty((m, 3))
+        self._source_masses: np.ndarray = self.masses[self._sources]
+        # Whether the kernel's pair distances match the positions
+        self._distances_fresh: bool = False
+        self._active_masses: np.ndarray = np.where(
+            self.massive, self.masses, 0.0)
+
+        dtype: type = self._set_precision(
+            mixed_backends=("direct", "blocked", "threaded"))
+
+        if self.force_backend == "direct":
+            # Rows are sources, columns are all bodies
+            self._r_ij: np.ndarray = np.empty((m, n, 3), dtype)
+            self._r_norm: np.ndarray = np.empty((m, n), dtype)
+            self._inv_r_cubed: np.ndarray = np.empty((m, n), dtype)
+            self._force_kernel: Callable[[], None] = (
+                self._calculate_accelerations_direct)
+        elif self.force_backend == "pairwise":
+            self._pair_i, self._pair_j = _pair_indices(n)
+            if m < n:
+                # Pairs of two test particles do not interact
+                keep: np.ndarray = (
+                    self.massive[self._pair_i] | self.massive[self._pair_j])
+                self._pair_i = self._pair_i[keep]
+                self._pair_j = self._pair_j[keep]
+            num_pairs: int = len(self._pair_i)
+            # Component-major (3, P) so each gather is a contiguous row
+            self._r_ij = np.empty((3, num_pairs))
+            self._r_norm = np.empty(num_pairs)
+            self._pull_to_i: np.ndarray = np.empty(num_pairs)
+            self._pull_to_j: np.ndarray = np.empty(num_pairs)
+            self._force_kernel = self._calculate_accelerations_pairwise
+        elif self.force_backend == "barnes_hut":
+            # The tree is rebuilt every call, nothing to keep
+            self._force_kernel = self._calculate_accelerations_barnes_hut
+        elif self.force_backend == "fmm":
+            self._force_kernel = self._calculate_accelerations_fmm
+        elif self.force_backend == "blocked":
+            block: int = self.block_size or self._auto_block_size()
+            block = max(1, min(block, max(n, m)))
+            self._block: int = block
+            self._r_ij = np.empty((block, block, 3), dtype)
+            self._r_norm = np.empty((block, block), dtype)
+            self._inv_r_cubed = np.empty((block, block), dtype)
+            self._block_accelerations: np.ndarray = np.empty((block, 3))
+            self._force_kernel = self._calculate_accelerations_blocked
+        elif self.force_backend == "threaded":
+            num_threads: int = max(
+                1, min(self.num_threads or os.cpu_count() or 1, n))
+            bounds: np.ndarray = np.linspace(
+                0, n, num_threads + 1).astype(int)
+            # One slice of targets [t0, t1) per thread, with its own
+            # buffers
+            self._target_chunks: list[tuple] = []
+            for t0, t1 in zip(bounds[:-1], bounds[1:]):
+                self._target_chunks.append((
+                    t0, t1,
+                    np.empty((m, t1 - t0, 3), dtype),
+                    np.empty((m, t1 - t0), dtype),
+                    np.empty((m, t1 - t0), dtype)
+                ))
+            # A pool of another size (N changed) is replaced on first use
+            if (self._thread_pool is not None
+                    and self._thread_pool_size != num_threads):
+                self.close()
+            self._force_kernel = self._calculate_accelerations_threaded
+        else:
+            raise ValueError(f"Unknown force backend: {self.force_backend}")
+
+    def _set_precision(self, mixed_backends: tuple[str, ...]) -> type:
+        """Check self.precision and reset the running rounding error of
+        the positions, kept when they are updated in mixed precision.
+
+        Args:
+            mixed_backends (tuple): Force backends with float32 kernels.
+
+        Returns:
+            type: Dtype of the pairwise terms.
+        """
+        self._position_error: np.ndarray | None = None
+        if self.precision == "double":
+            return np.float64
+        elif self.precision == "mixed":
+            if self.force_backend not in mixed_backends:
+                raise ValueError(
+                    f"Mixed precision is not supported by "
+                    f"{type(self).__name__} with the "
+                    f"{self.force_backend} backend")
+            self._position_error = np.zeros(self.positions.shape)
+            return np.float32
+        raise ValueError(f"Unknown precision: {self.precision}")
+
+    @staticmethod
+    def _auto_block_size() -> int:
+        """Largest tile edge whose scratch buffers (5 floats per pair)
+        fit in half of the L2 cache, leaving room for the positions."""
+        tile_bytes: int = _cache_size_bytes(level=2) // 2
+        return max(16, int(np.sqrt(tile_bytes / (5 * 8))))
+
     def _calculate_accelerations(self) -> None:
-        """Calculate the gravitational acceleration of each body"""
-        # Prepare positions for broadcasting (N x N matrix)
-        # r_j [shape: (N, 1, 3)] column vector of positions
-        pos_col: np.ndarray = self.positions[:, np.newaxis, :]
-        # r_i [shape: (1, N, 3)] row vector of positions
-        pos_row: np.ndarray = self.positions[np.newaxis, :, :]
+        """Calculate the gravitational acceleration of each body
+        with the selected force backend."""
+        self._force_kernel()
+
+    def _gather_source_positions(self) -> np.ndarray:
+        """Copy the positions of the sources into their buffer."""
+        return np.take(
+            self.positions, self._sources, axis=0,
+            out=self._source_positions, mode="clip")
+
+    def _calculate_accelerations_direct(self) -> None:
+        """Calculate the gravitational acceleration of each body:
+        all sources against all bodies as a single tile."""
+        self._tile_accelerations(
+            self._gather_source_positions(), self._source_masses,
+            self._sources, self.positions, 0,
+            self._r_ij, self._r_norm, self._inv_r_cubed,
+            out=self.accelerations)
+        self.accelerations *= self.G
+        self._distances_fresh = True
+
+    def _calculate_accelerations_threaded(self) -> None:
+        """Calculate the gravitational acceleration of each body, one
+        slice of targets per thread."""
+        if self._thread_pool is None:
+            self._thread_pool_size: int = len(self._target_chunks)
+            self._thread_pool = ThreadPoolExecutor(
+                max_workers=self._thread_pool_size)
+            # Without a reference to self, so it can be collected
+            self._close_thread_pool: weakref.finalize = weakref.finalize(
+                self, self._thread_pool.shutdown)
+        self._gather_source_positions()
+        for future in [
+            self._thread_pool.submit(
+                self._calculate_target_chunk, *chunk)
+            for chunk in self._target_chunks
+        ]:
+            future.result()
+        self._distances_fresh = True
 
-        # Calculate the displacement vector
-        # r_ij = r_j - r_i [shape: (N, N, 3)]
-        r_ij: np.ndarray = pos_col - pos_row
+    def _calculate_target_chunk(
+        self, t0: int, t1: int, r_ij: np.ndarray, r_norm: np.ndarray,
+        inv_r_cubed: np.ndarray
+    ) -> None:
+        """All sources against targets [t0, t1) only, as one tile."""
+        accelerations: np.ndarray = self.accelerations[t0:t1]
+        self._tile_accelerations(
+            self._source_positions, self._source_masses, self._sources,
+            self.positions[t0:t1], t0, r_ij, r_norm, inv_r_cubed,
+            out=accelerations)
+        accelerations *= self.G
+
+    def _tile_distances(
+        self, sources: np.ndarray, source_index: np.ndarray,
+        targets: np.ndarray, t0: int, r_ij: np.ndarray, r_norm: np.ndarray
+    ) -> None:
+        """Pair distances of one tile: sources (rows) against the bodies
+        t0, t0 + 1, ... (columns).
+
+        Args:
+            sources (np.ndarray): Positions of the sources, (S, 3).
+            source_index (np.ndarray): Body index of each source, so a
+                source that is also a target of the tile is infinitely
+                far from itself (no self-interaction).
+            targets (np.ndarray): Positions of the targets, (T, 3).
+            t0 (int): Body index of the first target.
+            r_ij (np.ndarray): Out: r_i - r_j, shape (S, T, 3).
+            r_norm (np.ndarray): Out: sqrt(|r_ij|^2 + eps^2), (S, T).
+        """
+        # Calculate the displacement vector by broadcasting
+        # r_i [shape: (S, 1, 3)] column of sources
+        # against r_j [shape: (1, T, 3)] row of targets
+        np.subtract(
+            sources[:, np.newaxis, :], targets[np.newaxis, :, :], out=r_ij)
 
         # Calculate the magnitude of displacement (distance)
-        # r_norm = sqrt(x^2 + y^2 + z^2)
-        r_norm: np.ndarray = np.linalg.norm(r_ij, axis=2)
-
-        # Calculate 1 / r^3
-        # Ignore zero division errors on diagonal
-        with np.errstate(divide='ignore', invalid='ignore'):
-            inv_r_cubed: np.ndarray = 1.0 / (r_norm * r_norm * r_norm)
-        # Set diagonal elements to 0 to avoid self-interaction
-        np.fill_diagonal(inv_r_cubed, 0.0)
-
-        # Calculate acceleration
-        # Reshape mass to (N, 1, 1) so it aligns with the (N, N, 3) grid
-        mass_column: np.ndarray = self.masses[:, np.newaxis, np.newaxis]
-
-        # G * Sum( mass_i * vector_ij / r^3 )
-        # Sum over axis 0 (the 'i' bodies) to get total force on 'j'
-        self.accelerations = self.G * np.sum(
-            mass_column * r_ij * inv_r_cubed[:, :, np.newaxis],
-            axis=0
-        )
+        # r_norm = sqrt(x^2 + y^2 + z^2 + eps^2)
+        np.einsum("ijk,ijk->ij", r_ij, r_ij, out=r_norm)
+        self._soften(r_norm)
+        np.sqrt(r_norm, out=r_norm)
+
+        # Sources that are also targets of this tile
+        is_self: np.ndarray = (
+            (source_index >= t0) & (source_index < t0 + len(targets)))
+        r_norm[np.flatnonzero(is_self), source_index[is_self] - t0] = np.inf
+
+    def _tile_accelerations(
+        self, sources: np.ndarray, source_masses: np.ndarray,
+        source_index: np.ndarray, targets: np.ndarray, t0: int,
+        r_ij: np.ndarray, r_norm: np.ndarray, inv_r_cubed: np.ndarray,
+        out: np.ndarray
+    ) -> None:
+        """The force kernel on one tile: sum_i(m_i * r_ij / r^3) on each
+        target, without G. Every direct sum goes through here.
+
+        Args:
+            sources, source_index, targets, t0, r_ij, r_norm: See
+                _tile_distances.
+            source_masses (np.ndarray): Masses of the sources, (S,).
+            inv_r_cubed (np.ndarray): Scratch buffer, shape (S, T).
+            out (np.ndarray): Accelerations of the targets, (T, 3).
+        """
+        self._tile_distances(
+            sources, source_index, targets, t0, r_ij, r_norm)
+
+        # Calculate m_i / r^3
+        np.multiply(r_norm, r_norm, out=inv_r_cubed)
+        inv_r_cubed *= r_norm
+        np.divide(
+            source_masses[:, np.newaxis], inv_r_cubed, out=inv_r_cubed)
+
+        # Sum( mass_i * vector_ij / r^3 )
+        # Sum over axis 0 (the 'i' sources) to get the total on 'j'
+        np.einsum("ij,ijk->jk", inv_r_cubed, r_ij, out=out)
+
+    def _sum_tiles(
+        self, sources: np.ndarray, source_masses: np.ndarray,
+        source_index: np.ndarray, targets: np.ndarray, out: np.ndarray
+    ) -> None:
+        """The force kernel over (block, block) tiles of sources and
+        targets, so memory stays O(block^2) whatever N. Uses the blocked
+        backend's buffers, or cache-sized tiles for other backends.
+
+        Args:
+            sources, source_masses, source_index, targets: See
+                _tile_accelerations, with targets starting at body 0.
+            out (np.ndarray): Accelerations of the targets without G,
+                shape (T, 3).
+        """
+        n: int = len(targets)
+        m: int = len(sources)
+        if self.force_backend == "blocked":
+            block: int = self._block
+            r_ij_buffer: np.ndarray = self._r_ij
+            r_norm_buffer: np.ndarray = self._r_norm
+            inv_r_cubed_buffer: np.ndarray = self._inv_r_cubed
+            acceleration_buffer: np.ndarray = self._block_accelerations
+        else:
+            block = self._auto_block_size()
+            r_ij_buffer = np.empty((min(block, m), min(block, n), 3))
+            r_norm_buffer = np.empty((min(block, m), min(block, n)))
+            inv_r_cubed_buffer = np.empty_like(r_norm_buffer)
+            acceleration_buffer = np.empty((min(block, n), 3))
+        out[:] = 0.0
+
+        for t0 in range(0, n, block):
+            t1: int = min(t0 + block, n)
+            tile_acceleration: np.ndarray = acceleration_buffer[:t1 - t0]
+            for s0 in range(0, m, block):
+                s1: int = min(s0 + block, m)
+                self._tile_accelerations(
+                    sources[s0:s1], source_masses[s0:s1],
+                    source_index[s0:s1], targets[t0:t1], t0,
+                    r_ij_buffer[:s1 - s0, :t1 - t0],
+                    r_norm_buffer[:s1 - s0, :t1 - t0],
+                    inv_r_cubed_buffer[:s1 - s0, :t1 - t0],
+                    out=tile_acceleration)
+                out[t0:t1] += tile_acceleration
+
+    def _calculate_accelerations_pairwise(self) -> None:
+        """Calculate the gravitational acceleration of each body,
+        visiting each pair (i < j) once.
+
+        The pair term is applied to both bodies with opposite sign
+        (Newton's third law), so only N(N - 1)/2 distances are needed.
+        """
+        pair_i: np.ndarray = self._pair_i
+        pair_j: np.ndarray = self._pair_j
+        r_ij: np.ndarray = self._r_ij
+        r_norm: np.ndarray = self._r_norm
+        pull_to_i: np.ndarray = self._pull_to_i
+        pull_to_j: np.ndarray = self._pull_to_j
+        positions_by_axis: np.ndarray = self.positions.T
+
+        # r_ij = r_i - r_j for every pair [shape: (3, P)]
+        # pull_to_j holds r_j until it is needed
+        # (mode="clip" lets np.take write straight into out, unbuffered)
+        for axis in range(3):
+            np.take(positions_by_axis[axis], pair_i,
+                    out=r_ij[axis], mode="clip")
+            np.take(positions_by_axis[axis], pair_j,
+                    out=pull_to_j, mode="clip")
+            r_ij[axis] -= pull_to_j
+
+        # r_norm = sqrt(x^2 + y^2 + z^2 + eps^2)
+        np.einsum("kp,kp->p", r_ij, r_ij, out=r_norm)
+        self._soften(r_norm)
+        np.sqrt(r_norm, out=r_norm)
+
+        # G / r^3, then weighted by the mass doing the pulling
+        np.multiply(r_norm, r_norm, out=pull_to_i)
+        pull_to_i *= r_norm
+        np.divide(self.G, pull_to_i, out=pull_to_i)
+        np.take(self._active_masses, pair_j, out=pull_to_j, mode="clip")
+        pull_to_j *= pull_to_i
+        np.take(self._active_masses, pair_i, out=r_norm, mode="clip")
+        pull_to_i *= r_norm
+
+        # Scatter: j is pulled along +r_ij by m_i, i along -r_ij by m_j
+        n: int = self.num_bodies
+        for axis in range(3):
+            np.multiply(r_ij[axis], pull_to_i, out=r_norm)
+            self.accelerations[:, axis] = np.bincount(
+                pair_j, weights=r_norm, minlength=n)
+            np.multiply(r_ij[axis], pull_to_j, out=r_norm)
+            self.accelerations[:, axis] -= np.bincount(
+                pair_i, weights=r_norm, minlength=n)
+
+    def _calculate_accelerations_blocked(self) -> None:
+        """Calculate the gravitational acceleration of each body
+        tile by tile: sources [s0, s1) on targets [t0, t1).
+
+        Same arithmetic as the direct kernel, but each tile only needs
+        (block, block) scratch buffers that stay in cache.
+        """
+        self._sum_tiles(
+            self._gather_source_positions(), self._source_masses,
+            self._sources, self.positions, out=self.accelerations)
+        self.accelerations *= self.G
+
+    def _calculate_accelerations_barnes_hut(self) -> None:
+        """Calculate the gravitational acceleration of each body
+        with a Barnes-Hut octree (opening angle self.theta)."""
+        barnes_hut_accelerations(
+            self.positions, self._gather_source_positions(),
+            self._source_masses,
+            self.G, self.theta, out=self.accelerations,
+            softening=self.softening)
+
+    def _calculate_accelerations_fmm(self) -> None:
+        """Calculate the gravitational acceleration of each body with the
+        fast multipole method (order self.expansion_order)."""
+        fmm_accelerations(
+            self.positions, self._gather_source_positions(),
+            self._source_masses,
+            self.G, self.expansion_order, out=self.accelerations,
+            softening=self.softening)
+
+    def _soften(self, r_sq: np.ndarray) -> None:
+        """Add the squared softening length to squared distances, in
+        place."""
+        if self.softening:
+            r_sq += self.softening * self.softening
+
+    def _move_positions(self, displacement: np.ndarray) -> None:
+        """Add a displacement to the positions, with Kahan compensation
+        in mixed precision so the small per-step displacements are not
+        lost to rounding over long runs."""
+        error: np.ndarray | None = self._position_error
+        if error is None:
+            self.positions += displacement
+            return
+
+        # displacement - error, added to the positions; the part that
+        # rounding dropped is carried over to the next step
+        displacement -= error
+        new_positions: np.ndarray = self.positions + displacement
+        np.subtract(new_positions, self.positions, out=error)
+        error -= displacement
+        self.positions[:] = new_positions
 
     def _step(self, dt: float) -> None:
         """Advance the simulation by one time step using Euler-Cromer method.
@@ -80,20 +762,663 @@ class NBodySystem:
         """
         self._calculate_accelerations()
         self.velocities += self.accelerations * dt
-        self.positions += self.velocities * dt
+        self._move_positions(self.velocities * dt)
+
+    def _step_leapfrog(self, dt: float) -> None:
+        """Advance the simulation by one time step using
+        kick-drift-kick leapfrog.
+
+        Expects self.accelerations to match the current positions, and
+        leaves them matching the new positions, so each step costs a
+        single force evaluation.
+
+        Args:
+            dt (float): Time step.
+        """
+        half_dt: float = 0.5 * dt
+        self.velocities += self.accelerations * half_dt  # Kick
+        self._move_positions(self.velocities * dt)       # Drift
+        self._calculate_accelerations()
+        self.velocities += self.accelerations * half_dt  # Kick
+
+    def _step_velocity_verlet(self, dt: float) -> None:
+        """Advance the simulation by one time step using velocity-Verlet.
+
+        Same trajectory as kick-drift-kick leapfrog (up to rounding),
+        written in the position-first textbook form.
+        Expects self.accelerations to match the current positions.
+
+        Args:
+            dt (float): Time step.
+        """
+        half_dt: float = 0.5 * dt
+        # x(t + dt) = x + v * dt + a/2 * dt^2
+        self._move_positions(
+            (self.velocities + self.accelerations * half_dt) * dt)
+        # v(t + dt) = v + (a(t) + a(t + dt))/2 * dt
+        self.velocities += self.accelerations * half_dt
+        self._calculate_accelerations()
+        self.velocities += self.accelerations * half_dt
+
+    def _step_composition(
+        self, dt: float, weights: tuple[float, ...]
+    ) -> None:
+        """Advance the simulation by one time step as a sequence of
+        leapfrog sub-steps of length weight * dt.
+
+        Args:
+            dt (float): Time step.
+            weights (tuple): Sub-step weights, summing to 1.
+        """
+        for weight in weights:
+            self._step_leapfrog(weight * dt)
+
+    def _step_yoshida4(self, dt: float) -> None:
+        """Advance the simulation by one time step using Yoshida's
+        4th order composition (3 force evaluations per step).
+
+        Args:
+            dt (float): Time step.
+        """
+        self._step_composition(dt, YOSHIDA_4_WEIGHTS)
+
+    def _step_yoshida6(self, dt: float) -> None:
+        """Advance the simulation by one time step using Yoshida's
+        6th order composition (7 force evaluations per step).
+
+        Args:
+            dt (float): Time step.
+        """
+        self._step_composition(dt, YOSHIDA_6_WEIGHTS)
+
+    def _calculate_interaction_accelerations(
+        self, helio_positions: np.ndarray
+    ) -> np.ndarray:
+        """Calculate the accelerations between the orbiting bodies only,
+        leaving out the central body (handled by the Kepler drift).
+
+        Args:
+            helio_positions (np.ndarray): Positions relative to the
+                central body, shape (N - 1, 3).
+
+        Returns:
+            np.ndarray: Accelerations, shape (N - 1, 3).
+        """
+        # Only the orbiting sources pull, tile by tile as in the
+        # blocked kernel, so memory stays bounded with many test bodies
+        sources: np.ndarray = self._orbiting_sources
+        accelerations: np.ndarray = np.empty_like(helio_positions)
+        self._sum_tiles(
+            helio_positions[sources],
+            self._active_masses[self._orbiting[sources]], sources,
+            helio_positions, out=accelerations)
+        accelerations *= self.G
+        return accelerations
+
+    def _step_wisdom_holman(self, dt: float) -> None:
+        """Advance the simulation by one time step using a Wisdom-Holman
+        map in democratic heliocentric coordinates.
+
+        The motion of every body around the central (most massive) body
+        is solved exactly as a Kepler orbit, so only the much smaller
+        interactions between the other bodies are integrated
+        numerically. Suited to systems dominated by one mass.
+
+        ref: M. J. Duncan, H. F. Levison, M. H. Lee, AJ 116 (1998) 2067
+
+        Args:
+            dt (float): Time step.
+        """
+        half_dt: float = 0.5 * dt
+        central: int = self._central_index
+        orbiting: np.ndarray = self._orbiting
+        all_masses: np.ndarray = self._active_masses
+        central_mass: float = all_masses[central]
+        masses: np.ndarray = all_masses[orbiting]
+        total_mass: float = np.sum(all_masses)
+
+        # Barycentric -> democratic heliocentric coordinates
+        # Positions relative to the central body,
+        # velocities relative to the center of mass
+        com_position: np.ndarray = (
+            all_masses @ self.positions / total_mass)
+        com_velocity: np.ndarray = (
+            all_masses @ self.velocities / total_mass)
+        helio_pos: np.ndarray = (
+            self.positions[orbiting] - self.positions[central])
+        bary_vel: np.ndarray = self.velocities[orbiting] - com_velocity
+
+        # Interaction kick (half)
+        bary_vel += self._calculate_interaction_accelerations(
+            helio_pos) * half_dt
+        # Central body jump (half)
+        helio_pos += (masses @ bary_vel) / central_mass * half_dt
+        # Kepler drift around the central body
+        helio_pos, bary_vel = _kepler_drift(
+            helio_pos, bary_vel, self.G * central_mass, dt)
+        # Central body jump (half)
+        helio_pos += (masses @ bary_vel) / central_mass * half_dt
+        # Interaction kick (half)
+        bary_vel += self._calculate_interaction_accelerations(
+            helio_pos) * half_dt
+
+        # Democratic heliocentric -> barycentric coordinates
+        # The center of mass moves in a straight line
+        com_position += com_velocity * dt
+        central_position: np.ndarray = (
+            com_position - masses @ helio_pos / total_mass)
+        self.positions[orbiting] = helio_pos + central_position
+        self.positions[central] = central_position
+        self.velocities[orbiting] = bary_vel + com_velocity
+        self.velocities[central] = (
+            com_velocity - masses @ bary_vel / central_mass)
+
+    def _get_stepper(self, integrator: str) -> Callable[[float], None]:
+        """Return the step function for an integrator name and prepare
+        the system state it expects.
+
+        **Integrators:**
+        1. 'euler_cromer': First order, the original method.
+        2. 'leapfrog': Kick-drift-kick leapfrog. Second order, symplectic.
+        3. 'velocity_verlet': Velocity-Verlet. Second order, symplectic.
+        4. 'yoshida4': Yoshida composition. Fourth order, symplectic.
+        5. 'yoshida6': Yoshida composition. Sixth order, symplectic.
+        6. 'wisdom_holman': Kepler/interaction splitting. Symplectic,
+           for systems dominated by a central mass.
+        """
+        if integrator == "euler_cromer":
+            return self._step
+        elif integrator == "wisdom_holman":
+            self._central_index: int = int(np.argmax(self.masses))
+            self._orbiting: np.ndarray = np.delete(
+                np.arange(self.num_bodies), self._central_index)
+            # Indices into the orbiting bodies of those that are sources
+            self._orbiting_sources: np.ndarray = np.flatnonzero(
+                np.isin(self._orbiting, self._sources))
+            return self._step_wisdom_holman
+        elif integrator == "leapfrog":
+            stepper = self._step_leapfrog
+        elif integrator == "velocity_verlet":
+            stepper = self._step_velocity_verlet
+        elif integrator == "yoshida4":
+            stepper = self._step_yoshida4
+        elif integrator == "yoshida6":
+            stepper = self._step_yoshida6
+        else:
+            raise ValueError(f"Unknown integrator: {integrator}")
+
+        # Symplectic steppers reuse the accelerations from the previous
+        # step, so prime them for the starting positions
+        self._calculate_accelerations()
+        return stepper
+
+    def _get_block_stepper(
+        self, integrator: str
+    ) -> Callable[[float, int], None]:
+        """Return a function advancing the system by a number of steps,
+        fused into one compiled call when jit is enabled and possible.
+        With radii, collisions are resolved after every step.
+        """
+        step: Callable[[float], None] = self._get_stepper(integrator)
+
+        if self.radii is not None:
+            def step_block(dt: float, num_steps: int) -> None:
+                nonlocal step
+                for _ in range(num_steps):
+                    step(dt)
+                    if self._merge_collisions():
+                        # New N: prepare the stepper state again
+                        step = self._get_stepper(integrator)
+        elif (self.jit and JIT_AVAILABLE and integrator in FUSED_STEPPERS
+                and self.force_backend == "direct"
+                and self.precision == "double"):
+            fused: Callable[..., None] = FUSED_STEPPERS[integrator]
+
+            def step_block(dt: float, num_steps: int) -> None:
+                fused(
+                    self.positions, self.velocities, self.accelerations,
+                    self._active_masses, self.G,
+                    self.softening * self.softening, dt, num_steps)
+        else:
+            def step_block(dt: float, num_steps: int) -> None:
+                for _ in range(num_steps):
+                    step(dt)
+
+        return step_block
+
+    def _merge_collisions(self) -> bool:
+        """Merge the bodies whose spheres overlap (see collisions.py)
+        and shrink the system to the survivors.
+
+        Returns:
+            bool: Whether any bodies merged.
+        """
+        pair_i, pair_j = find_collisions(self.positions, self.radii)
+        if len(pair_i) == 0:
+            return False
+
+        labels: np.ndarray = cluster_labels(pair_i, pair_j, self.num_bodies)
+        (keep, self.positions, self.velocities, self.masses, self.radii,
+         self.massive) = merge_clusters(
+            labels, self.positions, self.velocities, self.masses,
+            self.radii, self.massive)
+        self.body_ids = self.body_ids[keep]
+        self.num_bodies = len(keep)
+        self._allocate_workspace()
+        return True
+
+    def _iter_adaptive(
+        self,
+        time_frame: float,
+        time_step: float,
+        output_interval: float,
+        tolerance: float,
+        state: dict
+    ) -> Iterator[Snapshot]:
+        """Run the simulation with the adaptive Dormand-Prince 5(4) method.
+
+        Each step is checked against the embedded 4th order solution and
+        retried with a smaller dt when the error exceeds the tolerance,
+        so the step shrinks through close encounters and grows again in
+        the quiet stretches. Snapshots are interpolated inside the steps,
+        so they land exactly on multiples of output_interval.
+
+        Args:
+            time_frame (float): The total duration of the simulation in days.
+            time_step (float): The initial time step (dt) in days.
+            output_interval (float): Save frequency in days.
+            tolerance (float): Relative error allowed per step.
+            state (dict): Progress of the run ('time', 'dt' and
+                'output_count'), updated as it goes.
+
+        Yields:
+            tuple: (positions, velocities, time) of each snapshot
+        """
+        if state["output_count"] == 0:
+            yield self.positions.copy(), self.velocities.copy(), 0.0
+            state["output_count"] = 1
+
+        # Derivatives of (positions, velocities) at each stage
+        stage_velocities: np.ndarray = np.zeros((7, self.num_bodies, 3))
+        stage_accelerations: np.ndarray = np.zeros((7, self.num_bodies, 3))
+        start_positions: np.ndarray = self.positions.copy()
+        start_velocities: np.ndarray = self.velocities.copy()
+
+        self._calculate_accelerations()
+        stage_velocities[0] = self.velocities
+        stage_accelerations[0] = self.accelerations
+
+        output_count: int = state["output_count"]
+        current_time: float = state["time"]
+        next_output_time: float = output_count * output_interval
+        dt: float = state.get("dt", time_step)
+
+        while current_time < time_frame:
+            dt = min(dt, time_frame - current_time)
+            start_positions[:] = self.positions
+            start_velocities[:] = self.velocities
+
+            for stage, weights in enumerate(DORMAND_PRINCE_A, start=1):
+                self.positions[:] = start_positions + dt * np.tensordot(
+                    weights, stage_velocities[:stage], axes=1)
+                self.velocities[:] = start_velocities + dt * np.tensordot(
+                    weights, stage_accelerations[:stage], axes=1)
+                self._calculate_accelerations()
+                stage_velocities[stage] = self.velocities
+                stage_accelerations[stage] = self.accelerations
+
+            # Error relative to the size of the system and its velocities
+            position_error: float = np.max(np.abs(np.tensordot(
+                DORMAND_PRINCE_ERROR, stage_velocities, axes=1))) * dt
+            velocity_error: float = np.max(np.abs(np.tensordot(
+                DORMAND_PRINCE_ERROR, stage_accelerations, axes=1))) * dt
+            position_scale: float = max(
+                np.max(np.abs(start_positions)),
+                np.max(np.abs(self.positions))) or 1.0
+            velocity_scale: float = max(
+                np.max(np.abs(start_velocities)),
+                np.max(np.abs(self.velocities))) or 1.0
+            error: float = max(
+                position_error / position_scale,
+                velocity_error / velocity_scale) / tolerance
+
+            if error <= 1.0:
+                # Accept: output every snapshot that falls inside the step
+                end_time: float = current_time + dt
+                while next_output_time <= end_time:
+                    positions, velocities = _hermite_interpolate(
+                        (next_output_time - current_time) / dt, dt,
+                        (start_positions, self.positions),
+                        (start_velocities, self.velocities),
+                        (stage_accelerations[0], stage_accelerations[6])
+                    )
+                    yield positions, velocities, next_output_time
+                    output_count += 1
+                    next_output_time = output_count * output_interval
+
+                current_time = end_time
+                state["time"] = current_time
+                state["output_count"] = output_count
+                stage_velocities[0] = stage_velocities[6]
+                stage_accelerations[0] = stage_accelerations[6]
+            else:
+                # Reject: retry from the start of the step
+                self.positions[:] = start_positions
+                self.velocities[:] = start_velocities
+
+            # Standard controller for a 5th order method, growth limited
+            # so a quiet stretch cannot jump straight into an encounter
+            factor: float = 5.0 if error == 0.0 else 0.9 * error ** -0.2
+            dt *= min(5.0, max(0.2, factor))
+            if dt <= 1e-12 * max(1.0, current_time):
+                raise RuntimeError(
+                    f"Step size underflow at t = {current_time} days.")
+            state["dt"] = dt
+            self._checkpoint(current_time)
+
+        self.accelerations[:] = stage_accelerations[0]
+
+    def _iter_fixed(
+        self,
+        time_frame: float,
+        time_step: float,
+        output_interval: float,
+        integrator: str,
+        state: dict
+    ) -> Iterator[Snapshot]:
+        """Run the simulation with a fixed step integrator.
+
+        The steps between two outputs are counted up front and run in a
+        tight inner loop, so there is no per-step bookkeeping and every
+        snapshot time is an exact multiple of the time step.
+
+        Args:
+            time_frame (float): The total duration of the simulation in days.
+            time_step (float): The integration time step (dt) in days.
+            output_interval (float): Save frequency in days, rounded to a
+                whole number of steps.
+            integrator (str): Integration method, see run.
+            state (dict): Progress of the run ('step' and 'output_count'),
+                updated as it goes.
+
+        Yields:
+            tuple: (positions, velocities, time) of each snapshot
+        """
+        # Initial conditions
+        if state["output_count"] == 0:
+            yield self.positions.copy(), self.velocities.copy(), 0.0
+            state["output_count"] = 1
+
+        num_steps, steps_per_output = self._count_steps(
+            time_frame, time_step, output_interval)
+        step_block: Callable[[float, int], None] = (
+            self._get_block_stepper(integrator))
+
+        # Main simulation loop, one output per iteration
+        # (the last block is shorter if the outputs do not divide the run)
+        while state["step"] < num_steps:
+            block: int = min(steps_per_output, num_steps - state["step"])
+            step_block(time_step, block)
+            state["step"] += block
+
+            current_time: float = state["step"] * time_step
+            yield self.positions.copy(), self.velocities.copy(), current_time
+            state["output_count"] += 1
+
+            self._checkpoint(current_time)
+
+    @staticmethod
+    def _count_steps(
+        time_frame: float, time_step: float, output_interval: float
+    ) -> tuple[int, int]:
+        """Number of fixed steps in a run, and between two outputs.
+
+        Both are rounded to the nearest whole number, so that e.g.
+        3 * 365.24 / 0.01 is 109572 steps and not 109571.
+        """
+        num_steps: int = round(time_frame / time_step)
+        steps_per_output: int = max(1, round(output_interval / time_step))
+        return num_steps, steps_per_output
+
+    @staticmethod
+    def count_snapshots(
+        time_frame: float, time_step: float, output_interval: float,
+        integrator: str = "euler_cromer"
+    ) -> int:
+        """Number of snapshots a run returns, initial conditions included.
+
+        Exact for the fixed step integrators; for 'rk45' an upper bound
+        (one more than the multiples of output_interval in time_frame).
+
+        Args:
+            time_frame (float): The total duration of the simulation in days.
+            time_step (float): The integration time step (dt) in days.
+            output_interval (float): Save frequency in days.
+            integrator (str): Integration method, see run.
+
+        Returns:
+            int: Number of snapshots.
+        """
+        if integrator == "rk45":
+            return int(time_frame // output_interval) + 2
+        num_steps, steps_per_output = NBodySystem._count_steps(
+            time_frame, time_step, output_interval)
+        return 1 + -(-num_steps // steps_per_output)
+
+    def iter_run(
+        self,
+        time_frame: float,
+        time_step: float,
+        output_interval: float,
+        integrator: str = "euler_cromer",
+        tolerance: float = 1e-9,
+        checkpoint_path: str | Path | None = None,
+        checkpoint_interval: float | None = None
+    ) -> Iterator[Snapshot]:
+        """Run the simulation lazily, yielding each snapshot as soon as
+        it is produced.
+
+        Nothing is kept between snapshots, so consumers (plots, frame
+        drawing, the game loop) run in constant memory and get the first
+        frame without waiting for the whole run. The system advances only
+        while the generator is consumed.
+
+        Args:
+            time_frame (float): The total duration of the simulation in days.
+            time_step (float): The integration time step (dt) in days.
+                For 'rk45' this is only the initial step.
+            output_interval (float): Save frequency in days.
+            integrator (str): Integration method, see run.
+            tolerance (float): Relative error allowed per step ('rk45').
+            checkpoint_path (str | Path | None): File to save checkpoints
+                to (see save_checkpoint), for resume_run.
+            checkpoint_interval (float | None): Simulated days between
+                checkpoints, None for one at each output.
+
+        Yields:
+            tuple:
+            A tuple containing:
+                - positions, copy of shape (N, 3), N shrinking as bodies
+                  merge (see body_ids)
+                - velocities, copy of shape (N, 3)
+                - time
+        """
+        if self.radii is not None and integrator == "rk45":
+            raise ValueError(
+                "Collisions are only supported by the fixed step "
+                "integrators")
+
+        # Everything needed to continue the run from a checkpoint
+        interval: float = checkpoint_interval or output_interval
+        self._run_state: dict = {
+            "time_frame": time_frame,
+            "time_step": time_step,
+            "output_interval": output_interval,
+            "integrator": integrator,
+            "tolerance": tolerance,
+            "checkpoint_path": (
+                None if checkpoint_path is None else str(checkpoint_path)),
+            "checkpoint_interval": interval,
+            "next_checkpoint": interval,
+            "output_count": 0,
+            "step": 0,
+            "time": 0.0,
+        }
+        return self._iter_run_state()
+
+    def _iter_run_state(self) -> Iterator[Snapshot]:
+        """Run (or continue) the run described by self._run_state."""
+        state: dict = self._run_state
+        if state["integrator"] == "rk45":
+            snapshots: Iterator[Snapshot] = self._iter_adaptive(
+                state["time_frame"], state["time_step"],
+                state["output_interval"], state["tolerance"], state)
+        else:
+            snapshots = self._iter_fixed(
+                state["time_frame"], state["time_step"],
+                state["output_interval"], state["integrator"], state)
+
+        yield from snapshots
+        # Final checkpoint, so resuming a finished run does nothing
+        if state["checkpoint_path"] is not None:
+            self.save_checkpoint(state["checkpoint_path"])
+
+    def _checkpoint(self, current_time: float) -> None:
+        """Save a checkpoint if one is due at this simulation time."""
+        state: dict = self._run_state
+        if (state["checkpoint_path"] is not None
+                and current_time >= state["next_checkpoint"]):
+            interval: float = state["checkpoint_interval"]
+            state["next_checkpoint"] = (
+                math.floor(current_time / interval) + 1) * interval
+            self.save_checkpoint(state["checkpoint_path"])
+
+    def save_checkpoint(self, path: str | Path) -> None:
+        """Save the system and the progress of its current run.
+
+        The file is written next to the target and then renamed, so a
+        crash while saving leaves the previous checkpoint intact.
+
+        Args:
+            path (str | Path): Checkpoint file (.npz).
+        """
+        path = Path(path)
+        temporary: Path = path.with_name(path.name + ".tmp")
+        with open(temporary, "wb") as file:
+            np.savez(
+                file,
+                positions=self.positions,
+                velocities=self.velocities,
+                accelerations=self.accelerations,
+                masses=self.masses,
+                massive=self.massive,
+                G=self.G,
+                force_backend=self.force_backend,
+                theta=self.theta,
+                expansion_order=self.expansion_order,
+                block_size=(
+                    0 if self.block_size is None else self.block_size),
+                jit=self.jit,
+                num_threads=(
+                    0 if self.num_threads is None else self.num_threads),
+                precision=self.precision,
+                softening=self.softening,
+                # No radii is saved as an empty array
+                radii=(
+                    np.empty(0) if self.radii is None else self.radii),
+                body_ids=self.body_ids,
+                num_ids=self._num_ids,
+                # Kahan carry of mixed precision, empty in double
+                position_error=(
+                    np.empty(0) if self._position_error is None
+                    else self._position_error),
+                # JSON keeps the floats exact (shortest repr round trip)
+                run_state=json.dumps(getattr(self, "_run_state", None)),
+            )
+        os.replace(temporary, path)
+
+    @classmethod
+    def from_checkpoint(cls, path: str | Path) -> "NBodySystem":
+        """Restore a system saved by save_checkpoint, ready to continue
+        its run with resume_run.
+
+        Args:
+            path (str | Path): Checkpoint file (.npz).
+
+        Returns:
+            NBodySystem: The restored system.
+        """
+        with np.load(path) as data:
+            system: NBodySystem = cls(
+                num_bodies=len(data["masses"]),
+                positions=data["positions"],
+                velocities=data["velocities"],
+                masses=data["masses"],
+                G=float(data["G"]),
+                force_backend=str(data["force_backend"]),
+                theta=float(data["theta"]),
+                expansion_order=int(data["expansion_order"]),
+                block_size=int(data["block_size"]) or None,
+                massive=data["massive"],
+                jit=bool(data["jit"]),
+                num_threads=int(data["num_threads"]) or None,
+                precision=str(data["precision"]),
+                softening=float(data["softening"]),
+                radii=(
+                    data["radii"] if len(data["radii"]) == len(data["masses"])
+                    else None),
+            )
+            system.accelerations[:] = data["accelerations"]
+            system.body_ids = data["body_ids"]
+            system._num_ids = int(data["num_ids"])
+            if system._position_error is not None:
+                system._position_error[:] = data["position_error"]
+            run_state: dict | None = json.loads(str(data["run_state"]))
+        if run_state is not None:
+            system._run_state = run_state
+        return system
 
     def run(
         self,
         time_frame: float,
         time_step: float,
-        output_interval: float
-    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        output_interval: float,
+        integrator: str = "euler_cromer",
+        tolerance: float = 1e-9,
+        observer: Callable[[Snapshot], None] | None = None,
+        trajectory_path: str | Path | None = None,
+        checkpoint_path: str | Path | None = None,
+        checkpoint_interval: float | None = None,
+        diagnostics: bool = False
+    ) -> tuple[np.ndarray, ...]:
         """Run the simulation for a specified duration and return the history.
 
         Args:
             time_frame (float): The total duration of the simulation in days.
             time_step (float): The integration time step (dt) in days.
-            output_interval (float): Save frequency in days.
+                For 'rk45' this is only the initial step.
+            output_interval (float): Save frequency in days. Rounded to
+                a whole number of steps, except for 'rk45'.
+            integrator (str): Integration method, one of 'euler_cromer',
+                'leapfrog', 'velocity_verlet', 'yoshida4', 'yoshida6',
+                'wisdom_holman' or 'rk45' (adaptive time step).
+            tolerance (float): Relative error allowed per step ('rk45').
+            observer (Callable | None): Called with each snapshot
+                (positions, velocities, time) as it is produced.
+            trajectory_path (str | Path | None): Directory to stream the
+                history to as memory-mapped .npy files (see trajectory.py)
+                instead of keeping it in RAM.
+            checkpoint_path (str | Path | None): File to save checkpoints
+                to, so an interrupted run can be continued with
+                from_checkpoint and resume_run.
+            checkpoint_interval (float | None): Simulated days between
+                checkpoints, None for one at each output. Checkpoints are
+                taken at the outputs.
+            diagnostics (bool): Also track the conserved quantities at
+                each output (see conserved_quantities).
+
+        With radii, the histories keep one column per original body
+        (see body_ids): a body merged into another is NaN from then on.
 
         Returns:
             tuple:
@@ -101,46 +1426,227 @@ class NBodySystem:
                 - position_history
                 - velocity_history
                 - time_history
+                - diagnostics, only if requested: dict of arrays
+                  'time', 'kinetic_energy', 'potential_energy', 'energy',
+                  'momentum' (T, 3) and 'angular_momentum' (T, 3)
+            The histories are read-only memory maps if trajectory_path
+            is given.
             """
-        # Estimate array size (+2 for initial and final time)
-        num_snapshots: int = int(time_frame // output_interval + 2)
-
-        # Initialize history arrays
-        # 3 is at the end because it's in 3D space (x,y,z)
-        position_history: np.ndarray = np.zeros(
-            (num_snapshots, self.num_bodies, 3))
-        velocity_history: np.ndarray = np.zeros(
-            (num_snapshots, self.num_bodies, 3))
-        time_history: np.ndarray = np.zeros(num_snapshots)
-
-        # Store initial conditions
-        position_history[0] = self.positions
-        velocity_history[0] = self.velocities
-        time_history[0] = 0.0
-
-        # Setup loop variables
-        output_count: int = 1
-        current_time: float = 0.0
-        next_output_time: float = output_count * output_interval
-        num_steps: int = int(time_frame / time_step)
-
-        # Main simulation loop
-        for i in range(num_steps):
-            # Advance system by dt
-            self._step(time_step)
-            current_time = i * time_step
-
-            # Check if it is time to save a snapshot
-            if current_time >= next_output_time:
-                position_history[output_count] = self.positions
-                velocity_history[output_count] = self.velocities
+        snapshots: Iterator[Snapshot] = self.iter_run(
+            time_frame, time_step, output_interval, integrator, tolerance,
+            checkpoint_path, checkpoint_interval)
+        return self._record(
+            snapshots, observer, trajectory_path, diagnostics)
+
+    def resume_run(
+        self,
+        observer: Callable[[Snapshot], None] | None = None,
+        trajectory_path: str | Path | None = None,
+        diagnostics: bool = False
+    ) -> tuple[np.ndarray, ...]:
+        """Continue the run of a system restored with from_checkpoint.
+
+        The snapshots and checkpoints are bit-identical to those of the
+        uninterrupted run. Snapshots taken before the checkpoint are not
+        returned, except through trajectory_path: pointing it at the
+        directory of the interrupted run appends to it, discarding the
+        snapshots written after the checkpoint.
+
+        Args:
+            observer (Callable | None): See run.
+            trajectory_path (str | Path | None): See run.
+            diagnostics (bool): See run.
+
+        Returns:
+            tuple: (position_history, velocity_history, time_history)
+            and the diagnostics if requested
+        """
+        if not hasattr(self, "_run_state"):
+            raise ValueError("No run to resume, see from_checkpoint")
+        return self._record(
+            self._iter_run_state(), observer, trajectory_path, diagnostics)
+
+    def _record(
+        self,
+        snapshots: Iterator[Snapshot],
+        observer: Callable[[Snapshot], None] | None,
+        trajectory_path: str | Path | None,
+        diagnostics: bool = False
+    ) -> tuple[np.ndarray, ...]:
+        """Collect the snapshots of a run into history arrays."""
+        state: dict = self._run_state
+        # Snapshots taken before a resumed checkpoint
+        start: int = state["output_count"]
+
+        num_snapshots: int = self.count_snapshots(
+            state["time_frame"], state["time_step"],
+            state["output_interval"], state["integrator"])
+
+        # Conserved quantities of each snapshot, taken as it is produced
+        # (so the force kernel's distances can still be reused)
+        records: list[tuple] = []
+        if diagnostics:
+            user_observer: Callable[[Snapshot], None] | None = observer
+
+            def record_diagnostics(snapshot: Snapshot) -> None:
+                positions, velocities, current_time = snapshot
+                records.append((
+                    current_time,
+                    *self.conserved_quantities(positions, velocities)
+                ))
+                if user_observer is not None:
+                    user_observer(snapshot)
+
+            observer = record_diagnostics
+
+        # With collisions the histories keep one column per original body
+        state_shape: tuple[int, ...] = (
+            self.positions.shape if self.radii is None
+            else (self._num_ids, 3))
+
+        histories: tuple[np.ndarray, np.ndarray, np.ndarray]
+        if trajectory_path is not None:
+            with TrajectoryWriter(
+                trajectory_path, state_shape, num_snapshots, start
+            ) as writer:
+                for snapshot in snapshots:
+                    if observer is not None:
+                        observer(snapshot)
+                    writer(self._place_by_id(snapshot))
+            trajectory: Trajectory = Trajectory(trajectory_path)
+            histories = (
+                trajectory.positions, trajectory.velocities,
+                trajectory.times
+            )
+        else:
+            # Initialize history arrays
+            # 3 is at the end because it's in 3D space (x,y,z)
+            position_history: np.ndarray = np.zeros(
+                (num_snapshots - start, *state_shape))
+            velocity_history: np.ndarray = np.zeros(
+                (num_snapshots - start, *state_shape))
+            time_history: np.ndarray = np.zeros(num_snapshots - start)
+
+            output_count: int = 0
+            for snapshot in snapshots:
+                if observer is not None:
+                    observer(snapshot)
+                positions, velocities, current_time = (
+                    self._place_by_id(snapshot))
+                position_history[output_count] = positions
+                velocity_history[output_count] = velocities
                 time_history[output_count] = current_time
                 output_count += 1
-                next_output_time = output_count * output_interval
 
-        # Truncate arrays
+            # Truncate arrays
+            histories = (
+                position_history[:output_count],
+                velocity_history[:output_count],
+                time_history[:output_count]
+            )
+
+        if not diagnostics:
+            return histories
+        times, kinetic, potential, momentum, angular_momentum = (
+            zip(*records) if records else ([],) * 5)
+        return (*histories, {
+            "time": np.array(times),
+            "kinetic_energy": np.array(kinetic),
+            "potential_energy": np.array(potential),
+            "energy": np.array(kinetic) + np.array(potential),
+            "momentum": np.array(momentum).reshape(-1, 3),
+            "angular_momentum": np.array(angular_momentum).reshape(-1, 3),
+        })
+
+    def _place_by_id(self, snapshot: Snapshot) -> Snapshot:
+        """Put the bodies of a snapshot back at their original index,
+        with NaN for the bodies merged away, once some have merged."""
+        if self.num_bodies == self._num_ids:
+            return snapshot
+        positions, velocities, current_time = snapshot
+        placed_positions: np.ndarray = np.full((self._num_ids, 3), np.nan)
+        placed_velocities: np.ndarray = np.full((self._num_ids, 3), np.nan)
+        placed_positions[self.body_ids] = positions
+        placed_velocities[self.body_ids] = velocities
+        return placed_positions, placed_velocities, current_time
+
+    def conserved_quantities(
+        self, positions: np.ndarray, velocities: np.ndarray
+    ) -> tuple[float, float, np.ndarray, np.ndarray]:
+        """Energy, linear and angular momentum of a state of the system.
+
+        The potential reuses the pair distances of the last force
+        evaluation when they match the positions ('direct' and
+        'threaded' backends, e.g. after a leapfrog step). Otherwise it is
+        recomputed exactly, in tiles the size of the blocked kernel's,
+        so the memory stays that of the chosen backend. Test particles
+        are massless here.
+
+        Args:
+            positions (np.ndarray): Positions, shape (N, 3).
+            velocities (np.ndarray): Velocities, shape (N, 3).
+
+        Returns:
+            tuple:
+            A tuple containing:
+                - kinetic energy
+                - potential energy
+                - linear momentum, shape (3,)
+                - angular momentum, shape (3,)
+        """
+        masses: np.ndarray = self._active_masses
+        kinetic: float = 0.5 * float(
+            masses @ np.einsum("ik,ik->i", velocities, velocities))
+        momentum: np.ndarray = masses @ velocities
+        angular_momentum: np.ndarray = masses @ np.cross(
+            positions, velocities)
         return (
-            position_history[:output_count],
-            velocity_history[:output_count],
-            time_history[:output_count]
+            kinetic, self._potential_energy(positions), momentum,
+            angular_momentum
         )
+
+    def _potential_energy(self, positions: np.ndarray) -> float:
+        """-G/2 * sum over pairs (i, j), i a source, of m_i m_j / r_ij."""
+        masses: np.ndarray = self._active_masses
+        source_masses: np.ndarray = self._source_masses
+
+        if (self._distances_fresh
+                and np.array_equal(
+                    positions[self._sources], self._source_positions)):
+            # The kernel's (sources, targets) distances, infinite between
+            # a body and itself, are for these positions: 1/r in place
+            self._distances_fresh = False
+            if self.force_backend == "direct":
+                r_norm: np.ndarray = np.reciprocal(
+                    self._r_norm, out=self._r_norm)
+                return -0.5 * self.G * float(source_masses @ r_norm @ masses)
+
+            potential: float = 0.0
+            for t0, t1, _, r_norm, _ in self._target_chunks:
+                np.reciprocal(r_norm, out=r_norm)
+                potential += float(source_masses @ r_norm @ masses[t0:t1])
+            return -0.5 * self.G * potential
+
+        # Recomputed over (tile, tile) blocks of sources and targets, so
+        # memory stays bounded whatever the backend
+        tile: int = (
+            self._block if self.force_backend == "blocked"
+            else self._auto_block_size())
+        n: int = len(positions)
+        sources: np.ndarray = positions[self._sources]
+        m: int = len(sources)
+        r_ij_buffer: np.ndarray = np.empty((min(tile, m), min(tile, n), 3))
+        r_norm_buffer: np.ndarray = np.empty((min(tile, m), min(tile, n)))
+        potential = 0.0
+        for t0 in range(0, n, tile):
+            t1: int = min(t0 + tile, n)
+            for s0 in range(0, m, tile):
+                s1: int = min(s0 + tile, m)
+                r_norm = r_norm_buffer[:s1 - s0, :t1 - t0]
+                self._tile_distances(
+                    sources[s0:s1], self._sources[s0:s1], positions[t0:t1],
+                    t0, r_ij_buffer[:s1 - s0, :t1 - t0], r_norm)
+                np.reciprocal(r_norm, out=r_norm)
+                potential += float(
+                    source_masses[s0:s1] @ r_norm @ masses[t0:t1])
+        return -0.5 * self.G * potential
@@ -12,11 +12,14 @@ from math_utils import (
     plot_3d_trajectory
 )
 
+from frame_scheduler import schedule_frames
 from anim_utils import (
+    FIGURES_DIR,
     draw_frames,
     create_gif,
     create_mp4,
-    delete_frames
+    delete_frames,
+    stream_animation
 )
 
 # %%
@@ -41,7 +44,12 @@ pos_history, vel_history, time_history = n_body_system.run(
     output_interval=OUTPUT_INTERVAL
 )
 
-num_frames = len(time_history)
+# Video frames, interpolated between the snapshots
+FPS: float = 24
+DURATION: float = 25.0  # seconds
+frame_times, frame_positions = schedule_frames(
+    time_history, pos_history, vel_history, FPS, DURATION)
+num_frames = len(frame_times)
 
 # %%
 plot_trajectory(
@@ -61,20 +69,21 @@ plot_3d_trajectory(
 # %%
 # God's eye view
 draw_frames(
-    positions=pos_history,
+    positions=frame_positions,
     labels=labels,
     colors=colors,
     legend=legend,
     num_frames=num_frames,
     masses=n_body_system.masses,
     view_limit=4.0,       # Zoom out to see everything
-    visual_scale=1.5
+    visual_scale=1.5,
+    incremental=True      # Move the artists instead of redrawing
 )
 
 # %%
 # Following Sun C
 draw_frames(
-    positions=pos_history,
+    positions=frame_positions,
     labels=labels,
     colors=colors,
     legend=legend,
@@ -83,16 +92,32 @@ draw_frames(
     view_limit=1.0,
     target_body_index=2,  # Track Sun C
     visual_scale=0.5,
-    hide_grid=True
+    hide_grid=True,
+    incremental=True
 )
 
 # %%
-create_gif(num_frames)
+create_gif(num_frames, fps=FPS)
 
 # %%
-create_mp4(num_frames)
+create_mp4(num_frames, fps=FPS)
 
 # %%
 delete_frames(num_frames)
 
 # %%
+# Straight to video, without PNG frames on disk
+stream_animation(
+    positions=frame_positions,
+    labels=labels,
+    colors=colors,
+    legend=legend,
+    num_frames=num_frames,
+    output_path=FIGURES_DIR / "animation_stream.mp4",
+    masses=n_body_system.masses,
+    view_limit=4.0,
+    visual_scale=1.5,
+    fps=FPS
+)
+
+# %%
@@ -0,0 +1,76 @@
+import numpy as np
+from grid import expand_ranges
+
+
+def simplify_polyline(points: np.ndarray, tolerance: float) -> np.ndarray:
+    """Indices of the points kept by Douglas-Peucker simplification.
+
+    Every dropped point lies within tolerance of the segment joining the
+    kept points around it, so the simplified line never strays more than
+    tolerance from the original. With tolerance set to the size of a
+    pixel, the number of points follows the length and curvature of the
+    line on screen, not the number of snapshots.
+
+    All open segments are split together, one level at a time, as flat
+    arrays of (segment, point) pairs: O(T) per level, about log(T)
+    levels for smooth curves.
+
+    ref: D. Douglas, T. Peucker, Cartographica 10 (1973) 112-122
+
+    Args:
+        points (np.ndarray): Vertices of the line, shape (T, D).
+        tolerance (float): Largest distance allowed between the original
+            and the simplified line, in the units of the points.
+
+    Returns:
+        np.ndarray: Sorted indices of the kept points, the first and
+        last included. Non-finite points (e.g. bodies merged away) are
+        dropped.
+    """
+    finite: np.ndarray = np.flatnonzero(np.all(np.isfinite(points), axis=1))
+    if len(finite) <= 2:
+        return finite
+    points = points[finite]
+    tolerance_sq: float = tolerance * tolerance
+
+    keep: np.ndarray = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    # Segments (start, end) between kept points with points inside
+    starts: np.ndarray = np.array([0])
+    ends: np.ndarray = np.array([len(points) - 1])
+
+    while len(starts) > 0:
+        counts: np.ndarray = ends - starts - 1
+        segment, index = expand_ranges(starts + 1, counts)
+
+        # Squared distance of each inner point to its segment
+        start_points: np.ndarray = points[starts[segment]]
+        chord: np.ndarray = points[ends[segment]] - start_points
+        offset: np.ndarray = points[index] - start_points
+        chord_sq: np.ndarray = np.einsum("pk,pk->p", chord, chord)
+        projection: np.ndarray = np.einsum("pk,pk->p", offset, chord)
+        # Position along the chord (0 at the start, 1 at the end),
+        # 0 for closed segments where the chord has no length
+        along: np.ndarray = np.clip(
+            np.divide(
+                projection, chord_sq, out=np.zeros_like(projection),
+                where=chord_sq > 0),
+            0.0, 1.0)
+        gap: np.ndarray = offset - along[:, np.newaxis] * chord
+        distance_sq: np.ndarray = np.einsum("pk,pk->p", gap, gap)
+
+        # Farthest point of each segment: first of its run once sorted
+        order: np.ndarray = np.lexsort((-distance_sq, segment))
+        farthest: np.ndarray = order[np.cumsum(counts) - counts]
+        split: np.ndarray = distance_sq[farthest] > tolerance_sq
+        new_points: np.ndarray = index[farthest[split]]
+        keep[new_points] = True
+
+        # Each split segment becomes two
+        starts = np.concatenate([starts[split], new_points])
+        ends = np.concatenate([new_points, ends[split]])
+        has_inside: np.ndarray = ends - starts > 1
+        starts = starts[has_inside]
+        ends = ends[has_inside]
+
+    return finite[keep]
@@ -0,0 +1,184 @@
+import numpy as np
+from pathlib import Path
+
+# One .npy file per history, inside the trajectory directory
+HISTORY_FILES: tuple[str, str, str] = (
+    "positions.npy", "velocities.npy", "times.npy")
+
+
+def _resize_npy(path: Path, length: int) -> None:
+    """Change the length of the first axis of a .npy file in place.
+
+    NumPy pads .npy headers so the first axis can grow to any size
+    without moving the data, so only the shape in the header is
+    rewritten and the file is cut or extended to match.
+    """
+    with open(path, "r+b") as file:
+        version: tuple[int, int] = np.lib.format.read_magic(file)
+        shape, fortran_order, dtype = (
+            np.lib.format.read_array_header_1_0(file) if version == (1, 0)
+            else np.lib.format.read_array_header_2_0(file))
+        data_offset: int = file.tell()
+
+        new_shape: tuple[int, ...] = (length, *shape[1:])
+        header: str = (
+            f"{{'descr': {np.lib.format.dtype_to_descr(dtype)!r}, "
+            f"'fortran_order': {fortran_order}, 'shape': {new_shape!r}, }}")
+        header_start: int = 10 if version == (1, 0) else 12
+        file.seek(header_start)
+        file.write(
+            header.ljust(data_offset - header_start - 1).encode("latin1")
+            + b"\n")
+        file.truncate(
+            data_offset + length * int(np.prod(shape[1:])) * dtype.itemsize)
+
+
+class TrajectoryWriter:
+    """Sink that appends snapshots to memory-mapped .npy files as a run
+    goes, so the history never has to fit in RAM.
+
+    The files grow by doubling when the initial capacity is exceeded
+    and are cut to the number of snapshots written on close. Can be
+    passed as the observer of NBodySystem.run.
+
+    Attributes:
+        directory (Path): Directory holding the history files.
+        count (int): Number of snapshots written so far.
+    """
+
+    def __init__(
+        self, directory: str | Path, state_shape: tuple[int, ...],
+        capacity: int = 1024, start: int = 0
+    ) -> None:
+        """
+        Args:
+            directory (str | Path): Directory of the history files,
+                created if needed.
+            state_shape (tuple): Shape of the positions, e.g. (N, 3).
+            capacity (int): Number of snapshots to allocate up front.
+            start (int): Snapshots of existing files to keep and append
+                to (a resumed run), 0 to start new files.
+        """
+        self.directory: Path = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.count: int = start
+        self._state_shape: tuple[int, ...] = tuple(state_shape)
+        self._capacity: int = max(1, capacity, start)
+        if start > 0:
+            for name in HISTORY_FILES:
+                _resize_npy(self.directory / name, self._capacity)
+            self._open(mode="r+")
+        else:
+            self._open(mode="w+")
+
+    def _open(self, mode: str) -> None:
+        """Map the history files with the current capacity."""
+        positions, velocities, times = (
+            self.directory / name for name in HISTORY_FILES)
+        shape: tuple[int, ...] = (self._capacity, *self._state_shape)
+        if mode == "w+":
+            self._positions: np.ndarray = np.lib.format.open_memmap(
+                positions, mode="w+", dtype=np.float64, shape=shape)
+            self._velocities: np.ndarray = np.lib.format.open_memmap(
+                velocities, mode="w+", dtype=np.float64, shape=shape)
+            self._times: np.ndarray = np.lib.format.open_memmap(
+                times, mode="w+", dtype=np.float64, shape=(self._capacity,))
+        else:
+            self._positions = np.load(positions, mmap_mode=mode)
+            self._velocities = np.load(velocities, mmap_mode=mode)
+            self._times = np.load(times, mmap_mode=mode)
+
+    def _resize(self, length: int) -> None:
+        """Unmap the files, change their length and map them again."""
+        self.flush()
+        del self._positions, self._velocities, self._times
+        for name in HISTORY_FILES:
+            _resize_npy(self.directory / name, length)
+
+    def __call__(
+        self, snapshot: tuple[np.ndarray, np.ndarray, float]
+    ) -> None:
+        """Append one (positions, velocities, time) snapshot."""
+        if self.count == self._capacity:
+            self._capacity *= 2
+            self._resize(self._capacity)
+            self._open(mode="r+")
+
+        positions, velocities, time = snapshot
+        self._positions[self.count] = positions
+        self._velocities[self.count] = velocities
+        self._times[self.count] = time
+        self.count += 1
+
+    def flush(self) -> None:
+        """Write the mapped pages back to disk."""
+        self._positions.flush()
+        self._velocities.flush()
+        self._times.flush()
+
+    def close(self) -> None:
+        """Cut the files to the snapshots written and unmap them."""
+        self._resize(self.count)
+
+    def __enter__(self) -> "TrajectoryWriter":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+
+class Trajectory:
+    """Lazy reader of the history files written by TrajectoryWriter.
+
+    The histories are memory-mapped read-only: slicing them only reads
+    the pages it touches, and they can be passed anywhere an array is
+    expected (e.g. math_utils.plot_trajectory).
+
+    Attributes:
+        positions (np.ndarray): Position history, (T, N, 3).
+        velocities (np.ndarray): Velocity history, (T, N, 3).
+        times (np.ndarray): Time of each snapshot, (T,).
+    """
+
+    def __init__(self, directory: str | Path) -> None:
+        directory = Path(directory)
+        positions, velocities, times = (
+            directory / name for name in HISTORY_FILES)
+        self.positions: np.ndarray = np.load(positions, mmap_mode="r")
+        self.velocities: np.ndarray = np.load(velocities, mmap_mode="r")
+        self.times: np.ndarray = np.load(times, mmap_mode="r")
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def select(
+        self,
+        start_time: float | None = None,
+        end_time: float | None = None,
+        bodies: list[int] | slice = slice(None),
+        stride: int = 1
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Read the snapshots with start_time <= time < end_time, of some
+        bodies only and every stride-th snapshot.
+
+        Args:
+            start_time (float | None): First time, None from the start.
+            end_time (float | None): End time (excluded), None to the end.
+            bodies (list[int] | slice): Bodies to read.
+            stride (int): Keep one snapshot out of stride.
+
+        Returns:
+            tuple: (positions, velocities, times) in memory
+        """
+        start: int = (
+            0 if start_time is None
+            else int(np.searchsorted(self.times, start_time, "left")))
+        end: int = (
+            len(self) if end_time is None
+            else int(np.searchsorted(self.times, end_time, "left")))
+        steps: slice = slice(start, end, stride)
+        return (
+            np.asarray(self.positions[steps][:, bodies]),
+            np.asarray(self.velocities[steps][:, bodies]),
+            np.array(self.times[steps])
+        )